@@ -0,0 +1,662 @@
+# annIndex.py
+"""
+Approximate nearest-neighbour retrieval for large tenants: an IVF-PQ index in NumPy.
+
+  IVF : vectors are assigned to the nearest of `nlist` coarse k-means centroids;
+        a query only scans the `nprobe` lists whose centroids score highest.
+  PQ  : within a list each vector is stored as the product-quantized code of its
+        residual (vector - centroid): `m` uint8 codes instead of 384 float32s.
+        Inner products are scored with one (m x 256) lookup table per query.
+
+Until a partition holds `train_size` vectors (at least ANN_EXACT_MAX, default 50000)
+it keeps raw float32 vectors in one contiguous array and searches exactly: below that
+size a matrix-vector product is as fast as IVF-PQ and has perfect recall. The first
+time it reaches that size it trains and encodes everything.
+`nprobe` is the recall/latency knob. PQ scoring alone caps recall (about 0.55 recall@10
+on 384-d data whatever nprobe is); with `refine=R` (default 4) the index also keeps
+float16 copies of the vectors and re-scores the best k*R PQ candidates exactly
+(IVF-PQ+R, about 0.94), trading memory for recall. Inserts, deletes (tombstones +
+periodic compaction) and snapshot/restore to .npz are incremental.
+
+AnnVectorIndex wraps one IVFPQIndex per (userId, accountId) behind the same
+RetrievalBackend contract as vectorStore (RETRIEVAL_BACKEND=ann). Training and
+periodic snapshot writes run on a background thread, outside its lock: upsert() returns
+as soon as the vector is added, and match() keeps answering while a partition is
+trained or flushed; the results are swapped in under the lock.
+
+    python annIndex.py --n 100000 --nprobe 1 4 8 16 32     # recall@k vs exact search
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from structuredLog import log_event
+from vectorStore import RetrievalBackend, EMBEDDING_DIM, parse_embedding
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", ".ann_index")
+ANN_NLIST = int(os.getenv("ANN_NLIST", "256"))
+ANN_M = int(os.getenv("ANN_M", "48"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+ANN_REFINE = int(os.getenv("ANN_REFINE", "4"))
+ANN_EXACT_MAX = int(os.getenv("ANN_EXACT_MAX", "50000"))  # partitions up to this size are searched exactly
+ANN_FLUSH_SECONDS = float(os.getenv("ANN_FLUSH_SECONDS", "60"))
+
+KSUB = 256          # centroids per PQ sub-quantizer (one uint8 code)
+COMPACT_RATIO = 0.2  # compact a list once this share of it is tombstoned
+TRAIN_POINTS_PER_CENTROID = 64  # k-means training sample cap
+
+
+def _normalize_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms > 0, norms, 1)
+
+
+def _nearest(x, centroids, chunk=8192):
+    """Index of the nearest centroid (L2) for every row of x."""
+    c_sq = (centroids * centroids).sum(axis=1)
+    out = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk):
+        block = x[start:start + chunk]
+        out[start:start + chunk] = np.argmin(c_sq - 2 * block @ centroids.T, axis=1)
+    return out
+
+
+def kmeans(x, k, iters=20, seed=0):
+    """Lloyd's k-means; empty clusters are reseeded from random points."""
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    k = min(k, n)
+    centroids = x[rng.choice(n, k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        order = np.argsort(assign, kind="stable")
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(x[order], starts, axis=0) / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = x[rng.choice(n, len(empty), replace=False)]
+    return centroids
+
+
+class IVFPQIndex:
+    def __init__(self, dim=EMBEDDING_DIM, nlist=ANN_NLIST, m=ANN_M, nprobe=ANN_NPROBE, refine=ANN_REFINE,
+                 train_size=None, seed=0, auto_train=True):
+        if dim % m:
+            raise ValueError(f"dim {dim} must be divisible by m {m}")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.dsub = dim // m
+        self.nprobe = nprobe
+        self.refine = refine
+        # ~39 points per centroid for k-means, and never below the size where exact search still wins
+        self.train_size = train_size or max(nlist * 39, ANN_EXACT_MAX, 1000)
+        self.seed = seed
+        self.auto_train = auto_train  # False: the owner trains off-lock (fit() + install())
+
+        self.coarse = None       # (nlist, dim)
+        self.codebooks = None    # (m, KSUB, dsub)
+        self.list_ids = []       # per list: int64 internal ids
+        self.list_codes = []     # per list: (n, m) uint8 codes
+        self.list_vecs = []      # per list: (n, dim) float16 vectors, only when refine > 0
+        self.list_of = {}        # internal id -> list number
+        self.deleted = set()     # tombstoned internal ids still present in a list
+        self.list_dead = []      # per list: number of tombstoned entries
+
+        self.raw_ids = []        # before training: internal ids + raw vectors (rows of raw_buf)
+        self.raw_buf = np.empty((0, dim), dtype=np.float32)
+
+        self.key_of = {}         # internal id -> external key
+        self.id_of = {}          # external key -> internal id
+        self.next_id = 0
+
+    @property
+    def trained(self):
+        return self.coarse is not None
+
+    def __len__(self):
+        return len(self.id_of)
+
+    @property
+    def raw_vecs(self):
+        return self.raw_buf[:len(self.raw_ids)]
+
+    def _raw_append(self, ids, x):
+        n = len(self.raw_ids)
+        if n + len(x) > len(self.raw_buf):
+            grown = np.empty((max(n + len(x), 2 * len(self.raw_buf), 64), self.dim), dtype=np.float32)
+            grown[:n] = self.raw_buf[:n]
+            self.raw_buf = grown
+        self.raw_buf[n:n + len(x)] = x
+        self.raw_ids.extend(ids)
+
+    @property
+    def needs_training(self):
+        return not self.trained and len(self.raw_ids) >= self.train_size
+
+    # ---- training / encoding -------------------------------------------------
+
+    def _fit_quantizers(self, vectors):
+        """(coarse centroids, PQ codebooks) for a training sample; does not touch the index."""
+        x = _normalize_rows(vectors)
+        rng = np.random.default_rng(self.seed)
+        if len(x) > TRAIN_POINTS_PER_CENTROID * self.nlist:
+            x = x[rng.choice(len(x), TRAIN_POINTS_PER_CENTROID * self.nlist, replace=False)]
+        coarse = kmeans(x, self.nlist, seed=self.seed)
+        residuals = x - coarse[_nearest(x, coarse)]
+        if len(residuals) > TRAIN_POINTS_PER_CENTROID * KSUB:
+            residuals = residuals[rng.choice(len(residuals), TRAIN_POINTS_PER_CENTROID * KSUB, replace=False)]
+        codebooks = np.stack([
+            kmeans(np.ascontiguousarray(residuals[:, j * self.dsub:(j + 1) * self.dsub]), KSUB, seed=self.seed + j)
+            if len(residuals) >= KSUB else
+            np.resize(residuals[:, j * self.dsub:(j + 1) * self.dsub], (KSUB, self.dsub))
+            for j in range(self.m)
+        ]).astype(np.float32)
+        return coarse, codebooks
+
+    def train(self, vectors):
+        self._set_quantizers(*self._fit_quantizers(vectors))
+
+    def _set_quantizers(self, coarse, codebooks):
+        self.coarse, self.codebooks = coarse, codebooks
+        self.nlist = len(self.coarse)
+        self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self.list_codes = [np.empty((0, self.m), dtype=np.uint8) for _ in range(self.nlist)]
+        if self.refine:
+            self.list_vecs = [np.empty((0, self.dim), dtype=np.float16) for _ in range(self.nlist)]
+        self.list_dead = [0] * self.nlist
+
+    def _encode(self, x, coarse=None, codebooks=None):
+        coarse = self.coarse if coarse is None else coarse
+        codebooks = self.codebooks if codebooks is None else codebooks
+        lists = _nearest(x, coarse)
+        residuals = x - coarse[lists]
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _nearest(residuals[:, j * self.dsub:(j + 1) * self.dsub], codebooks[j])
+        return lists, codes
+
+    def _add_encoded(self, ids, x, encoded=None):
+        lists, codes = encoded if encoded is not None else self._encode(x)
+        for lst in np.unique(lists):
+            mask = lists == lst
+            self.list_ids[lst] = np.concatenate([self.list_ids[lst], ids[mask]])
+            self.list_codes[lst] = np.concatenate([self.list_codes[lst], codes[mask]])
+            if self.refine:
+                self.list_vecs[lst] = np.concatenate([self.list_vecs[lst], x[mask].astype(np.float16)])
+        for i, lst in zip(ids.tolist(), lists.tolist()):
+            self.list_of[i] = lst
+
+    # ---- mutations -----------------------------------------------------------
+
+    def add(self, keys, vectors):
+        """Insert or replace vectors under external keys."""
+        keys = list(keys)
+        x = _normalize_rows(np.atleast_2d(vectors))
+        for key in keys:
+            if key in self.id_of:
+                self.remove(key)
+        ids = np.arange(self.next_id, self.next_id + len(keys), dtype=np.int64)
+        self.next_id += len(keys)
+        for key, i in zip(keys, ids.tolist()):
+            self.id_of[key] = i
+            self.key_of[i] = key
+
+        if self.trained:
+            self._add_encoded(ids, x)
+            return
+
+        self._raw_append(ids.tolist(), x)
+        if self.auto_train and self.needs_training:
+            self.install(self.fit(*self.training_snapshot()))
+
+    def training_snapshot(self):
+        """Copies of the raw ids and vectors, for fit() to run on while the index keeps changing."""
+        return list(self.raw_ids), self.raw_vecs.copy()
+
+    def fit(self, ids, vectors):
+        """
+        Train on a snapshot of the raw vectors and encode them. Pure with respect to the
+        index, so a caller holding a lock can run it outside the lock and install() after.
+        """
+        coarse, codebooks = self._fit_quantizers(vectors)
+        return ids, vectors, coarse, codebooks, self._encode(vectors, coarse, codebooks)
+
+    def install(self, fitted):
+        """Switch to the trained layout. Raw vectors added or removed since fit() are reconciled."""
+        ids, vectors, coarse, codebooks, (lists, codes) = fitted
+        self._set_quantizers(coarse, codebooks)
+        position = {i: pos for pos, i in enumerate(ids)}
+        live = np.array([i in position for i in self.raw_ids], dtype=bool)
+        raw_ids = np.asarray(self.raw_ids, dtype=np.int64)
+        if live.any():
+            keep = np.array([position[i] for i in raw_ids[live].tolist()], dtype=np.int64)
+            self._add_encoded(raw_ids[live], vectors[keep], (lists[keep], codes[keep]))
+        if (~live).any():  # added while fit() ran
+            self._add_encoded(raw_ids[~live], self.raw_vecs[~live])
+        self.raw_ids, self.raw_buf = [], np.empty((0, self.dim), dtype=np.float32)
+
+    def remove(self, key):
+        i = self.id_of.pop(key, None)
+        if i is None:
+            return False
+        del self.key_of[i]
+        if not self.trained:
+            pos, last = self.raw_ids.index(i), len(self.raw_ids) - 1
+            self.raw_ids[pos] = self.raw_ids[last]  # move the last row into the hole
+            self.raw_buf[pos] = self.raw_buf[last]
+            self.raw_ids.pop()
+            return True
+        self.deleted.add(i)
+        lst = self.list_of.pop(i)
+        self.list_dead[lst] += 1
+        if self.list_dead[lst] > COMPACT_RATIO * len(self.list_ids[lst]):
+            self._compact(lst)
+        return True
+
+    def _compact(self, lst):
+        ids = self.list_ids[lst]
+        keep = np.array([i not in self.deleted for i in ids.tolist()], dtype=bool)
+        self.deleted.difference_update(ids[~keep].tolist())
+        self.list_ids[lst] = ids[keep]
+        self.list_codes[lst] = self.list_codes[lst][keep]
+        if self.refine:
+            self.list_vecs[lst] = self.list_vecs[lst][keep]
+        self.list_dead[lst] = 0
+
+    # ---- search --------------------------------------------------------------
+
+    def search(self, query, k=10, nprobe=None, refine=None):
+        """Top-k (key, inner product) pairs for a query vector; scores are approximate unless refined."""
+        if not self.id_of:
+            return []
+        q = _normalize_rows(query).reshape(-1)
+
+        if not self.trained:
+            scores = self.raw_vecs @ q
+            ids = np.asarray(self.raw_ids, dtype=np.int64)
+        else:
+            nprobe = min(nprobe or self.nprobe, self.nlist)
+            coarse_scores = self.coarse @ q
+            probe = np.argpartition(-coarse_scores, nprobe - 1)[:nprobe]
+            # q·(c + r) = q·c + Σ_j q_j·codebook_j[code_j]
+            lut = np.einsum("jkd,jd->jk", self.codebooks, q.reshape(self.m, self.dsub))
+            cols = np.arange(self.m)
+            refine = self.refine if refine is None else refine
+            refine = refine if self.list_vecs else 0
+            id_parts, score_parts, vec_parts = [], [], []
+            for lst in probe.tolist():
+                codes = self.list_codes[lst]
+                if len(codes):
+                    id_parts.append(self.list_ids[lst])
+                    score_parts.append(coarse_scores[lst] + lut[cols, codes].sum(axis=1))
+                    if refine:
+                        vec_parts.append(self.list_vecs[lst])
+            if not id_parts:
+                return []
+            ids = np.concatenate(id_parts)
+            scores = np.concatenate(score_parts)
+            alive = ~np.isin(ids, np.fromiter(self.deleted, dtype=np.int64)) if self.deleted else None
+            if alive is not None:
+                ids, scores = ids[alive], scores[alive]
+
+            if refine and len(ids):
+                # exact re-scoring of the best k*refine PQ candidates
+                vecs = np.concatenate(vec_parts)
+                if alive is not None:
+                    vecs = vecs[alive]
+                n_cand = min(k * refine, len(ids))
+                cand = np.argpartition(-scores, n_cand - 1)[:n_cand]
+                ids = ids[cand]
+                scores = vecs[cand].astype(np.float32) @ q
+
+        if len(ids) == 0:
+            return []
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.key_of[int(ids[i])], float(scores[i])) for i in top]
+
+    # ---- snapshot / restore --------------------------------------------------
+
+    def save(self, path):
+        """Write the whole index to one .npz (atomically)."""
+        self.write_snapshot(path, self.snapshot())
+
+    def snapshot(self):
+        """The arrays save() writes, copied so they can be written without holding any lock."""
+        lengths = np.array([len(ids) for ids in self.list_ids], dtype=np.int64)
+        keys = [self.key_of[i] for i in range(self.next_id) if i in self.key_of]
+        return dict(
+            config=np.array([self.dim, self.nlist, self.m, self.nprobe, self.refine, self.train_size,
+                             self.next_id, self.seed]),
+            coarse=self.coarse if self.trained else np.empty((0, self.dim), np.float32),
+            codebooks=self.codebooks if self.trained else np.empty((0, KSUB, self.dsub), np.float32),
+            list_lengths=lengths,
+            list_ids=np.concatenate(self.list_ids) if self.list_ids else np.empty(0, np.int64),
+            list_codes=np.concatenate(self.list_codes) if self.list_codes else np.empty((0, self.m), np.uint8),
+            list_vecs=np.concatenate(self.list_vecs) if self.list_vecs else np.empty((0, self.dim), np.float16),
+            deleted=np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)),
+            raw_ids=np.asarray(self.raw_ids, dtype=np.int64),
+            raw_vecs=self.raw_vecs.copy(),
+            key_ids=np.array([self.id_of[k] for k in keys], dtype=np.int64),
+            keys=np.array(json.dumps(keys)),
+        )
+
+    @staticmethod
+    def write_snapshot(path, arrays):
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        dim, nlist, m, nprobe, refine, train_size, next_id, seed = data["config"].tolist()
+        index = cls(dim=dim, nlist=nlist, m=m, nprobe=nprobe, refine=refine, train_size=train_size, seed=seed)
+        index.next_id = next_id
+        for key, i in zip(json.loads(str(data["keys"])), data["key_ids"].tolist()):
+            index.id_of[key] = i
+            index.key_of[i] = key
+        if len(data["coarse"]):
+            index.coarse = data["coarse"]
+            index.codebooks = data["codebooks"]
+            offsets = np.concatenate(([0], np.cumsum(data["list_lengths"])))
+            index.list_ids = [data["list_ids"][a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            index.list_codes = [data["list_codes"][a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            if refine:
+                index.list_vecs = [data["list_vecs"][a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+            index.deleted = set(data["deleted"].tolist())
+            index.list_dead = [0] * index.nlist
+            for lst, ids in enumerate(index.list_ids):
+                for i in ids.tolist():
+                    if i in index.deleted:
+                        index.list_dead[lst] += 1
+                    elif i in index.key_of:
+                        index.list_of[i] = lst
+        else:
+            index._raw_append(data["raw_ids"].tolist(), data["raw_vecs"])
+        return index
+
+    def stats(self):
+        code_bytes = sum(c.nbytes + i.nbytes for c, i in zip(self.list_codes, self.list_ids))
+        code_bytes += sum(v.nbytes for v in self.list_vecs)
+        raw_bytes = self.raw_vecs.nbytes
+        return {
+            "vectors": len(self),
+            "trained": self.trained,
+            "nlist": self.nlist,
+            "m": self.m,
+            "nprobe": self.nprobe,
+            "refine": self.refine,
+            "tombstones": len(self.deleted),
+            "bytes": code_bytes + raw_bytes,
+        }
+
+
+class AnnVectorIndex(RetrievalBackend):
+    """One IVFPQIndex per (userId, accountId), snapshotted to ANN_INDEX_DIR."""
+
+    name = "ann"
+
+    def __init__(self, directory=ANN_INDEX_DIR, flush_seconds=ANN_FLUSH_SECONDS, **index_kwargs):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.index_kwargs = index_kwargs
+        self.partitions = {}  # key -> (IVFPQIndex, {source_id: doc})
+        self.owner = {}
+        self.tombstones = {}  # source_id -> version of its DELETE, see _superseded
+        self.dirty = set()
+        self.training = set()  # partitions whose fit() is running
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()  # one snapshot writer at a time
+        self.last_flush = time.monotonic()
+        self.flush_pending = False
+        # upsert() runs on the embedding batcher's collector thread: k-means and .npz writes
+        # must not hold up the next webhook batch
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann-maintenance")
+        self.pending = set()  # futures of queued training / flush jobs
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    @staticmethod
+    def _file_stem(key):
+        return hashlib.sha1(f"{key[0]}|{key[1]}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            stem = os.path.join(self.directory, name[:-5])
+            try:
+                with open(f"{stem}.json") as f:
+                    meta = json.load(f)
+                index = IVFPQIndex.load(f"{stem}.npz")
+                index.auto_train = False
+            except Exception as e:
+                log_event("ann.partition_unreadable", logging.WARNING, partition=stem, error=str(e))
+                continue
+            key = (meta["user_id"], meta["account_id"])
+            self.partitions[key] = (index, meta["docs"])
+            for source_id in meta["docs"]:
+                self.owner[source_id] = key
+
+    def flush(self):
+        """Snapshot dirty partitions under the lock, then write them without it."""
+        if not self.directory:
+            return
+        with self.flush_lock:
+            with self.lock:
+                keys, self.dirty = self.dirty, set()
+                snapshots = [
+                    (key, self.partitions[key][0].snapshot(),
+                     {source_id: dict(doc) for source_id, doc in self.partitions[key][1].items()})
+                    for key in keys
+                ]
+                self.last_flush = time.monotonic()
+            try:
+                for key, arrays, docs in snapshots:
+                    stem = os.path.join(self.directory, self._file_stem(key))
+                    IVFPQIndex.write_snapshot(f"{stem}.npz", arrays)
+                    with open(f"{stem}.json.tmp", "w") as f:
+                        json.dump({"user_id": key[0], "account_id": key[1], "docs": docs}, f, default=str)
+                    os.replace(f"{stem}.json.tmp", f"{stem}.json")
+            except Exception:
+                with self.lock:
+                    self.dirty.update(keys)  # retried on the next flush
+                raise
+
+    def _submit(self, fn, *args):
+        future = self.background.submit(fn, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        if future.exception() is not None:
+            log_event("ann.maintenance_failed", logging.WARNING, error=str(future.exception()))
+
+    def drain(self, timeout=None):
+        """Wait for queued training and flush jobs (tests, shutdown)."""
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending, timeout=timeout)
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        finally:
+            with self.lock:
+                self.flush_pending = False
+
+    def _maybe_flush(self):
+        if not self.directory or time.monotonic() - self.last_flush < self.flush_seconds:
+            return
+        with self.lock:
+            if self.flush_pending:
+                return
+            self.flush_pending = True
+        self._submit(self._background_flush)
+
+    def _train(self, key, index, snapshot):
+        """Train a partition that reached its train_size; only install() runs under the lock."""
+        try:
+            fitted = index.fit(*snapshot)
+            with self.lock:
+                index.install(fitted)
+                self.dirty.add(key)
+        finally:
+            with self.lock:
+                self.training.discard(key)
+        self._maybe_flush()
+
+    def match(self, query_embedding, user_id, account_id, top_k=5, nprobe=None):
+        with self.lock:
+            part = self.partitions.get((user_id, account_id))
+            if part is None:
+                return []
+            index, docs = part
+            hits = index.search(np.asarray(query_embedding, dtype=np.float32), k=top_k, nprobe=nprobe)
+            return [{**docs[source_id], "similarity": score} for source_id, score in hits]
+
+    def upsert(self, record, embedding):
+        if record.get("deleted"):
+            with self.lock:
+                self._superseded(record)
+                self._remove(record["source_id"])
+            self._maybe_flush()
+            return
+        key = (record.get("user_id"), record.get("account_id"))
+        source_id = record["source_id"]
+        doc = {
+            "source_table": record.get("source_table"),
+            "source_id": source_id,
+            "chunk_text": record.get("chunk_text"),
+            "metadata": record.get("metadata"),
+        }
+        vec = np.asarray(parse_embedding(embedding), dtype=np.float32)
+        snapshot = None
+        with self.lock:
+            if self._superseded(record):
+                return
+            previous = self.owner.get(source_id)
+            if previous is not None and previous != key:
+                self._remove(source_id)
+            if key not in self.partitions:
+                self.partitions[key] = (IVFPQIndex(auto_train=False, **self.index_kwargs), {})
+            index, docs = self.partitions[key]
+            index.add([source_id], vec)
+            docs[source_id] = doc
+            self.owner[source_id] = key
+            self.dirty.add(key)
+            if index.needs_training and key not in self.training:
+                self.training.add(key)
+                snapshot = index.training_snapshot()
+        if snapshot is not None:
+            self._submit(self._train, key, index, snapshot)
+        self._maybe_flush()
+
+    def patch_metadata(self, source_id, metadata):
+        with self.lock:
+            key = self.owner.get(source_id)
+            if key is not None:
+                self.partitions[key][1][source_id]["metadata"] = metadata
+                self.dirty.add(key)
+        self._maybe_flush()
+
+    def _remove(self, source_id):
+        key = self.owner.pop(source_id, None)
+        if key is not None:
+            index, docs = self.partitions[key]
+            index.remove(source_id)
+            docs.pop(source_id, None)
+            self.dirty.add(key)
+
+    def remove(self, source_id):
+        with self.lock:
+            self._remove(source_id)
+        self._maybe_flush()
+
+    def stats(self):
+        with self.lock:
+            return {f"{k[0]}/{k[1]}": index.stats() for k, (index, _) in self.partitions.items()}
+
+
+def synthetic_embeddings(n, dim=EMBEDDING_DIM, latent_dim=32, clusters=200, noise=0.05, seed=0):
+    """
+    Unit vectors with low intrinsic dimensionality (clustered points in a small latent space
+    projected up to `dim`), which is closer to real embeddings than isotropic noise, where every
+    point is nearly equidistant from every other and "nearest neighbours" are meaningless.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, latent_dim), dtype=np.float32)
+    latent = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, latent_dim), dtype=np.float32)
+    projection = rng.standard_normal((latent_dim, dim), dtype=np.float32) / np.sqrt(latent_dim)
+    x = latent @ projection + noise * rng.standard_normal((n, dim), dtype=np.float32)
+    return _normalize_rows(x)
+
+
+def benchmark(n=100000, n_queries=200, k=10, nlist=ANN_NLIST, m=ANN_M, nprobes=(1, 4, 8, 16, 32),
+              refines=(0, 4), seed=0):
+    """recall@k and latency of IVF-PQ against exact search on synthetic 384-d data."""
+    data = synthetic_embeddings(n, seed=seed)
+    queries = _normalize_rows(data[np.random.default_rng(seed + 1).choice(n, n_queries, replace=False)]
+                              + 0.05 * np.random.default_rng(seed + 2).standard_normal((n_queries, EMBEDDING_DIM),
+                                                                                       dtype=np.float32))
+
+    started = time.perf_counter()
+    index = IVFPQIndex(nlist=nlist, m=m, refine=max(refines), train_size=n)
+    index.add(range(n), data)
+    build_s = time.perf_counter() - started
+    stats = index.stats()
+    pq_bytes = index.m + 8  # codes + id
+    print(f"n={n} nlist={index.nlist} m={m}: build {build_s:.1f}s, {pq_bytes} bytes/vector PQ-only, "
+          f"{stats['bytes'] / n:.0f} with refine vectors (raw float32: {4 * EMBEDDING_DIM})")
+
+    exact_ms, truth = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        scores = data @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        exact_ms.append((time.perf_counter() - t0) * 1000)
+        truth.append(set(top.tolist()))
+    print(f"exact                  : recall@{k}=1.000  p50={np.percentile(exact_ms, 50):.3f} ms  p99={np.percentile(exact_ms, 99):.3f} ms")
+
+    for refine in refines:
+        for nprobe in nprobes:
+            latencies, hits = [], 0
+            for q, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                found = index.search(q, k=k, nprobe=nprobe, refine=refine)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                hits += len(expected & {key for key, _ in found})
+            print(f"refine={refine:<3} nprobe={nprobe:<4}: recall@{k}={hits / (k * n_queries):.3f}  "
+                  f"p50={np.percentile(latencies, 50):.3f} ms  p99={np.percentile(latencies, 99):.3f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="recall@k benchmark for the IVF-PQ index.")
+    parser.add_argument("--n", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=ANN_NLIST)
+    parser.add_argument("--m", type=int, default=ANN_M)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--refine", type=int, nargs="+", default=[0, 4])
+    args = parser.parse_args()
+    benchmark(n=args.n, n_queries=args.queries, k=args.k, nlist=args.nlist, m=args.m,
+              nprobes=args.nprobe, refines=args.refine)
@@ -0,0 +1,306 @@
+# answerCache.py
+"""
+Per-user response cache for /api/retrieve.
+
+A lookup first tries the exact normalized query, then (when a query embedding is
+given) the most similar cached query of the same user/account above
+ANSWER_CACHE_THRESHOLD, so paraphrases hit too. Two queries only count as
+paraphrases if they mention the same months, dates, numbers, relative periods and
+categories: "spent in September" and "spent in October" embed almost identically
+but must not share an answer.
+
+Entries expire after ANSWER_CACHE_TTL_SECONDS, each user keeps at most
+ANSWER_CACHE_MAX_PER_USER entries and at most ANSWER_CACHE_MAX_USERS users are
+kept (both LRU).
+
+Every entry is stamped with the user's data version and only hit while that version
+is current, so answers never outlive the data they were computed from:
+  - ANSWER_CACHE_VERSIONS=local (default): an in-process counter bumped by the webhook
+    worker's invalidate(). Correct when one process serves both the API and the webhook,
+    as main.py does, and free.
+  - ANSWER_CACHE_VERSIONS=supabase: the version is the user's row in the `data_versions`
+    table, bumped by a trigger on every write to transactions, accounts and budgets (SQL
+    in the README). A write seen by any worker or instance invalidates every process's
+    entries, for one query per lookup. probe_versions() checks the table once and falls
+    back to local versions when it is missing; later read failures skip the cache.
+
+Follow-up questions ("and last month?", "what about food?") depend on the conversation,
+so their entries are also keyed by a digest of the session history (context_digest()).
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from queryParser import MONTHS, CATEGORIES, CATEGORY_ALIASES, RANGE_WORDS
+from structuredLog import log_event
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_PER_USER = int(os.getenv("ANSWER_CACHE_MAX_PER_USER", "200"))
+ANSWER_CACHE_MAX_USERS = int(os.getenv("ANSWER_CACHE_MAX_USERS", "5000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_VERSIONS = os.getenv("ANSWER_CACHE_VERSIONS", "local")  # local | supabase
+
+
+def _alternation(terms):
+    return "|".join(re.escape(t) for t in sorted(set(terms), key=len, reverse=True))
+
+
+# the parser's vocabularies, so the signature tracks whatever it can filter on
+_MONTHS = _alternation(MONTHS)
+_CATEGORIES = _alternation([*CATEGORIES, *CATEGORY_ALIASES, *" ".join(CATEGORIES).replace("&", " ").split(),
+                            "income", "expense", "expenses"])
+_PERIODS = "today|yesterday|tomorrow|this|last|next|previous|week|month|year|quarter|weekend"
+_RANGES = _alternation([*RANGE_WORDS, "from", "to", "and"])
+_KEY_TERMS = re.compile(rf"\b(?:\d+(?:[.,]\d+)*|{_MONTHS}|{_CATEGORIES}|{_PERIODS}|{_RANGES})\b")
+_WHITESPACE = re.compile(r"\s+")
+# questions that lean on earlier turns; a false positive only costs a cache miss
+_FOLLOW_UP = re.compile(
+    r"^(?:and|also|but|or|so|then|ok|okay|what about|how about|same|compared)\b"
+    r"|\b(?:it|its|that|those|these|them|they|the same|previous|before that|instead|else|again|too)\b"
+)
+
+
+def normalize_query(query):
+    return _WHITESPACE.sub(" ", str(query).lower()).strip().rstrip("?.! ")
+
+
+def query_signature(query):
+    """The terms two queries must share to be answered from the same entry."""
+    return frozenset(_KEY_TERMS.findall(normalize_query(query)))
+
+
+def context_digest(query, history):
+    """Digest of the session history for follow-up questions, "" for standalone ones."""
+    norm = normalize_query(query)
+    if not history or history == "None":
+        return ""
+    if not _FOLLOW_UP.search(norm) and len(norm.split()) > 3:
+        return ""
+    return hashlib.sha256(history.encode("utf-8")).hexdigest()[:16]
+
+
+def _supabase_version(user_id):
+    from clients import supabase
+
+    res = supabase.table("data_versions").select("version").eq("user_id", user_id).limit(1).execute()
+    if hasattr(res, "error") and res.error:
+        raise Exception(res.error)
+    return int(res.data[0]["version"]) if res.data else 0
+
+
+def _probe_data_versions():
+    from clients import supabase
+
+    res = supabase.table("data_versions").select("version").limit(1).execute()
+    if hasattr(res, "error") and res.error:
+        raise Exception(res.error)
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else None
+
+
+class _Entry:
+    __slots__ = ("response", "embedding", "signature", "context", "version", "expires_at")
+
+    def __init__(self, response, embedding, signature, context, version, expires_at):
+        self.response = response
+        self.embedding = embedding
+        self.signature = signature
+        self.context = context
+        self.version = version
+        self.expires_at = expires_at
+
+
+class AnswerCache:
+    def __init__(self, ttl_seconds=ANSWER_CACHE_TTL_SECONDS, max_per_user=ANSWER_CACHE_MAX_PER_USER,
+                 max_users=ANSWER_CACHE_MAX_USERS, threshold=ANSWER_CACHE_THRESHOLD,
+                 versions=ANSWER_CACHE_VERSIONS):
+        self.versions = versions
+        self.probed = versions != "supabase"
+        self.ttl = ttl_seconds
+        self.max_per_user = max_per_user
+        self.max_users = max_users
+        self.threshold = threshold
+        self.users = OrderedDict()   # user_id -> {account_id: OrderedDict[normalized query -> _Entry]}
+        # ANSWER_CACHE_VERSIONS=local: the generation of each user in self.users, evicted with it.
+        # Users without answers here share generation_floor, which only ever moves forward, so no
+        # user's version goes back to one an in-flight answer was stamped with
+        self.generations = {}
+        self.generation_clock = 0
+        self.generation_floor = 0
+        self.lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0,
+                         "stale": 0, "version_errors": 0}
+
+    def _partition(self, user_id, account_id, create=False):
+        accounts = self.users.get(user_id)
+        if accounts is None:
+            if not create:
+                return None
+            accounts = self.users[user_id] = {}
+            self.generations[user_id] = self.generation_floor
+            while len(self.users) > self.max_users:
+                evicted_user, evicted = self.users.popitem(last=False)
+                self.counters["evictions"] += sum(len(part) for part in evicted.values())
+                self.generation_floor = max(self.generation_floor, self.generations.pop(evicted_user))
+        self.users.move_to_end(user_id)
+        part = accounts.get(account_id)
+        if part is None and create:
+            part = accounts[account_id] = OrderedDict()
+        return part
+
+    def _generation(self, user_id):
+        return self.generations.get(user_id, self.generation_floor)
+
+    def probe_versions(self):
+        """
+        With supabase versions, check once that the data_versions table can be read, and
+        fall back to local versions (one warning) when it can't, rather than paying a
+        failing query on every request. Run at startup; current_version() runs it otherwise.
+        """
+        with self.lock:
+            if self.probed:
+                return self.versions
+            self.probed = True
+        try:
+            _probe_data_versions()
+        except Exception as e:
+            with self.lock:
+                self.versions = "local"
+            log_event("answer_cache.versions_unavailable", logging.WARNING, error=str(e), using="local")
+        return self.versions
+
+    def current_version(self, user_id):
+        """
+        The user's data version, to pass to get() and put(); None when it can't be read,
+        in which case both are no-ops. May be a network call (ANSWER_CACHE_VERSIONS=supabase).
+        """
+        if not self.probed:
+            self.probe_versions()
+        if self.versions == "local":
+            with self.lock:
+                return self._generation(user_id)
+        try:
+            return _supabase_version(user_id)
+        except Exception as e:
+            with self.lock:
+                self.counters["version_errors"] += 1
+            log_event("answer_cache.version_failed", logging.WARNING, error=str(e))
+            return None
+
+    def get(self, user_id, account_id, query, query_embedding=None, version=0, context=""):
+        """
+        Returns (response, "exact" | "semantic") or None. `query_embedding` may be a
+        zero-argument callable; it is only called when the exact lookup misses and
+        the user has cached entries to compare against. Only entries stamped with
+        `version` and computed in the same `context` (see context_digest) are hits.
+        """
+        if version is None:
+            return None
+        now = time.monotonic()
+        norm = normalize_query(query)
+        key = f"{context}\x1f{norm}" if context else norm
+        with self.lock:
+            part = self._partition(user_id, account_id)
+            if part:
+                for k in [k for k, e in part.items() if e.expires_at <= now or e.version != version]:
+                    self.counters["evictions" if part[k].version == version else "stale"] += 1
+                    del part[k]
+
+                entry = part.get(key)
+                if entry is not None:
+                    part.move_to_end(key)
+                    self.counters["exact_hits"] += 1
+                    return entry.response, "exact"
+            if not part or query_embedding is None:
+                self.counters["misses"] += 1
+                return None
+
+        # resolve the embedding outside the lock, it may be a network call
+        if callable(query_embedding):
+            query_embedding = query_embedding()
+        q = _unit(query_embedding) if query_embedding is not None and len(query_embedding) else None
+        signature = query_signature(query)
+
+        with self.lock:
+            part = self._partition(user_id, account_id)
+            if part and q is not None:
+                candidates = [(k, e) for k, e in part.items()
+                              if e.embedding is not None and e.signature == signature and e.context == context
+                              and e.version == version and e.expires_at > now]
+                if candidates:
+                    sims = np.stack([e.embedding for _, e in candidates]) @ q
+                    best = int(np.argmax(sims))
+                    if sims[best] >= self.threshold:
+                        key, entry = candidates[best]
+                        part.move_to_end(key)
+                        self.counters["semantic_hits"] += 1
+                        return entry.response, "semantic"
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, user_id, account_id, query, response, query_embedding=None, version=0, context=""):
+        """`version` is current_version() from before the answer was computed."""
+        if version is None:
+            return
+        emb = _unit(query_embedding) if query_embedding is not None and len(query_embedding) else None
+        entry = _Entry(response, emb, query_signature(query), context, version, time.monotonic() + self.ttl)
+        norm = normalize_query(query)
+        key = f"{context}\x1f{norm}" if context else norm
+        with self.lock:
+            if self.versions == "local" and version != self._generation(user_id):
+                return  # data changed while this answer was being computed
+            part = self._partition(user_id, account_id, create=True)
+            part[key] = entry
+            part.move_to_end(key)
+            while len(part) > self.max_per_user:
+                part.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate(self, user_id, account_id=None):
+        """
+        Drop this process's cached answers for one account, or for every account of the user.
+        With supabase versions other processes find out through data_versions instead.
+        """
+        with self.lock:
+            self.generation_clock += 1
+            accounts = self.users.get(user_id)
+            if accounts is None:
+                # nothing cached: retire the shared generation, so answers still being computed
+                # for this user aren't stored; other uncached users only lose those in-flight puts
+                self.generation_floor = self.generation_clock
+                return
+            self.generations[user_id] = self.generation_clock
+            for account in list(accounts) if account_id is None else [account_id]:
+                self.counters["invalidations"] += len(accounts.pop(account, ()))
+
+    def clear(self):
+        with self.lock:
+            for user_id in self.users:
+                self.generation_floor = max(self.generation_floor, self.generations.pop(user_id))
+            self.users.clear()
+
+    def stats(self):
+        with self.lock:
+            hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "versions": self.versions,
+                "users": len(self.users),
+                "entries": sum(len(p) for accounts in self.users.values() for p in accounts.values()),
+            }
+
+
+answer_cache = AnswerCache()
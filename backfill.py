@@ -0,0 +1,320 @@
+# backfill.py
+"""
+Backfill engine for embeddingsnew.
+
+Pages through each source table with keyset pagination, diffs every page in bulk
+against the source_ids that already have an embedding, embeds only the missing rows
+in batched, rate-limited Gemini calls on a bounded worker pool and bulk-upserts the
+results. The last id before which every row was handled is checkpointed per table, so a
+run that was interrupted or had failed batches resumes there and retries them. Ids are
+random UUIDs, so new rows don't sort after the checkpoint: a run after a complete one scans
+the table again, and the diff keeps it to rows without an embedding. With
+RETRIEVAL_BACKEND=local|ann the new embeddings are also written to that index's snapshot.
+Afterwards the monthly rollups (rollups.py) are rebuilt from a full pass over transactions.
+
+Usage:
+    python backfill.py                       # all tables, resume from checkpoint
+    python backfill.py --tables transactions --workers 8 --restart
+    python backfill.py --rollups-only        # just rebuild the rollups
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embeddingCreation import (
+    supabase,
+    get_gemini_embeddings,
+    build_embedding_record,
+    bulk_upsert_embeddings,
+    build_embedding_text,
+)
+from rollups import get_rollup_store
+from vectorStore import RETRIEVAL_BACKEND, get_backend
+
+TABLE_NAMES = ["transactions", "accounts", "budgets"]
+
+PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "1000"))
+EMBED_BATCH_SIZE = int(os.getenv("BACKFILL_EMBED_BATCH_SIZE", "100"))
+MAX_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+REQUESTS_PER_MINUTE = float(os.getenv("BACKFILL_RPM", "60"))
+MAX_RETRIES = 3
+DIFF_CHUNK_SIZE = 200  # source ids per .in_() filter; 1000 uuids overflow PostgREST/proxy URL limits
+CHECKPOINT_FILE = os.getenv("BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+
+
+class RateLimiter:
+    """Token bucket shared by all workers; acquire() blocks until a request may go out."""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Progress:
+    """Thread-safe counters with a periodic rows/sec report."""
+
+    def __init__(self, table, every=5.0):
+        self.table = table
+        self.every = every
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.scanned = 0
+        self.skipped = 0
+        self.embedded = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def add(self, scanned=0, skipped=0, embedded=0, failed=0):
+        with self.lock:
+            self.scanned += scanned
+            self.skipped += skipped
+            self.embedded += embedded
+            self.failed += failed
+            now = time.monotonic()
+            if now - self.last_report >= self.every:
+                self.last_report = now
+                self._print(now)
+
+    def _print(self, now):
+        elapsed = max(now - self.started, 1e-9)
+        print(
+            f"[{self.table}] scanned={self.scanned} skipped={self.skipped} "
+            f"embedded={self.embedded} failed={self.failed} "
+            f"({self.scanned / elapsed:.1f} rows/s scanned, {self.embedded / elapsed:.1f} rows/s embedded)"
+        )
+
+    def report(self):
+        with self.lock:
+            self._print(time.monotonic())
+
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {path}: {e}")
+        return {}
+
+
+def save_checkpoint(state, path=CHECKPOINT_FILE):
+    # write-then-rename so a crash never leaves a half-written checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def fetch_page(table_name, after_id, page_size=PAGE_SIZE):
+    """Keyset pagination on id: rows with id > after_id, in id order."""
+    query = supabase.table(table_name).select("*").order("id").limit(page_size)
+    if after_id is not None:
+        query = query.gt("id", after_id)
+    res = query.execute()
+    if hasattr(res, "error") and res.error:
+        raise Exception(f"Failed to fetch rows from {table_name}: {res.error}")
+    return res.data or []
+
+
+def existing_source_ids(table_name, ids, chunk_size=DIFF_CHUNK_SIZE):
+    """Which of these ids already have an embedding (one query per chunk of ids)."""
+    existing = set()
+    for start in range(0, len(ids), chunk_size):
+        res = supabase.table("embeddingsnew")\
+            .select("source_id")\
+            .eq("source_table", table_name)\
+            .in_("source_id", ids[start:start + chunk_size])\
+            .execute()
+        if hasattr(res, "error") and res.error:
+            raise Exception(f"Failed to diff {table_name} against embeddingsnew: {res.error}")
+        existing.update(r["source_id"] for r in (res.data or []))
+    return existing
+
+
+def embed_batch(table_name, rows, limiter, dim=384, index=None):
+    """
+    Embed one batch with a single Gemini call and bulk-upsert it. Returns rows written.
+    The written rows are also added to `index` (a local/ann retrieval backend), if given.
+    """
+    texts = [build_embedding_text(table_name, row) for row in rows]
+    for attempt in range(1, MAX_RETRIES + 1):
+        limiter.acquire()
+        embs = get_gemini_embeddings(texts, dim=dim)
+        if embs:
+            break
+        time.sleep(2 ** attempt)
+    else:
+        raise Exception(f"embedding failed after {MAX_RETRIES} attempts")
+
+    records = [
+        build_embedding_record(table_name, row, text, emb)
+        for row, text, emb in zip(rows, texts, embs)
+        if emb
+    ]
+    # upsert, so a row the webhook worker embedded meanwhile is not duplicated
+    written = bulk_upsert_embeddings(records)
+    if index is not None:
+        for record in written:
+            index.upsert(record, record["embedding"])
+    return len(written)
+
+
+def backfill_table(table_name, executor, limiter, state, page_size=PAGE_SIZE,
+                   batch_size=EMBED_BATCH_SIZE, checkpoint_path=CHECKPOINT_FILE, index=None):
+    table_state = state.setdefault(table_name, {"last_id": None, "done": False})
+    if table_state.get("done"):
+        # ids are random UUIDs, so rows added since the last run sort anywhere in id order:
+        # a finished table is scanned again and the embeddingsnew diff skips what is already there
+        table_state.update(last_id=None, done=False)
+
+    progress = Progress(table_name)
+    after_id = table_state.get("last_id")
+    if after_id is not None:
+        print(f"[{table_name}] resuming after id {after_id}")
+
+    held = False  # a batch failed: the checkpoint stays in front of it for the rest of the run
+    while True:
+        page = fetch_page(table_name, after_id, page_size)
+        if not page:
+            break
+
+        rows = [r for r in page if r.get("id")]
+        existing = existing_source_ids(table_name, [r["id"] for r in rows])
+        missing = [r for r in rows if r["id"] not in existing]
+        progress.add(scanned=len(rows), skipped=len(rows) - len(missing))
+
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        futures = [(executor.submit(embed_batch, table_name, b, limiter, index=index), b) for b in batches]
+        first_failed = None
+        for fut, batch in futures:
+            try:
+                progress.add(embedded=fut.result())
+            except Exception as e:
+                print(f"[{table_name}] batch of {len(batch)} failed: {e}")
+                progress.add(failed=len(batch))
+                if first_failed is None:
+                    first_failed = batch[0]["id"]
+
+        # only advance once every batch of the page has finished, and never past a failed one,
+        # so the next run retries it
+        if not held:
+            if first_failed is not None:
+                pos = next(i for i, r in enumerate(rows) if r["id"] == first_failed)
+                table_state["last_id"] = rows[pos - 1]["id"] if pos else after_id
+                held = True
+            else:
+                table_state["last_id"] = rows[-1]["id"] if rows else after_id
+            save_checkpoint(state, checkpoint_path)
+        after_id = rows[-1]["id"] if rows else after_id
+
+        if len(page) < page_size or not rows:
+            break
+
+    table_state["done"] = not held
+    save_checkpoint(state, checkpoint_path)
+    progress.report()
+
+
+def iter_pages(table_name, page_size=PAGE_SIZE):
+    """Every row of a table, one keyset page at a time."""
+    after_id = None
+    while True:
+        page = fetch_page(table_name, after_id, page_size)
+        if not page:
+            return
+        yield page
+        after_id = page[-1]["id"]
+        if len(page) < page_size:
+            return
+
+
+def build_rollups(page_size=PAGE_SIZE):
+    """Rebuild the monthly rollups from the whole transactions table (no embedding calls)."""
+    started = time.monotonic()
+    loaded = get_rollup_store().build(iter_pages("transactions", page_size))
+    print(f"[rollups] built from {loaded} transactions in {time.monotonic() - started:.1f}s")
+    return loaded
+
+
+def run_backfill(tables=None, workers=MAX_WORKERS, rpm=REQUESTS_PER_MINUTE, page_size=PAGE_SIZE,
+                 batch_size=EMBED_BATCH_SIZE, checkpoint_path=CHECKPOINT_FILE, restart=False, rollups=True):
+    tables = tables or TABLE_NAMES
+    state = {} if restart else load_checkpoint(checkpoint_path)
+    limiter = RateLimiter(rpm)
+    # a local/ann index is only fed by webhooks otherwise, so backfilled rows would never reach it
+    index = get_backend(supabase) if RETRIEVAL_BACKEND != "supabase" else None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for table_name in tables:
+            try:
+                backfill_table(table_name, executor, limiter, state, page_size, batch_size, checkpoint_path, index)
+            except Exception as e:
+                # keep going with the other tables; the checkpoint lets this one resume
+                print(f"[{table_name}] backfill stopped: {e}")
+
+    if index is not None:
+        index.drain()  # an ANN partition may still be training on the rows just added
+        index.flush()
+        print(f"[{index.name}] index snapshot updated; restart running servers to load it")
+
+    # the rollups cover every row, not only the ones that needed embedding, so they get their own pass
+    if rollups and "transactions" in tables:
+        try:
+            build_rollups(page_size)
+        except Exception as e:
+            print(f"[rollups] build failed: {e}")
+
+    print("Backfill complete")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill embeddingsnew for source tables.")
+    parser.add_argument("--tables", nargs="+", default=TABLE_NAMES)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="embedding requests per minute")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true", help="ignore any existing checkpoint")
+    parser.add_argument("--no-rollups", action="store_true", help="skip rebuilding the monthly rollups")
+    parser.add_argument("--rollups-only", action="store_true", help="only rebuild the monthly rollups")
+    args = parser.parse_args()
+
+    if args.rollups_only:
+        build_rollups(args.page_size)
+        return
+
+    run_backfill(
+        tables=args.tables,
+        workers=args.workers,
+        rpm=args.rpm,
+        page_size=args.page_size,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint,
+        restart=args.restart,
+        rollups=not args.no_rollups,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# benchmark.py
+"""
+Offline load benchmark: drives main.app in-process against the fakes in fakes.py, so
+nothing touches Supabase or Gemini and runs are comparable across commits.
+
+For each concurrency level it sends --requests questions to /api/retrieve (and, with
+the stream phase, /api/retrieve/stream). The question mix covers semantic, parser,
+comparative, hybrid and LLM-SQL questions. It then posts --webhooks INSERT/UPDATE/DELETE
+events to /webhook/webhook and waits for the consumers to drain the queue. It reports
+throughput, p50 and p99 per phase, plus mean stage latencies from metrics.py.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --rows 50000 --concurrency 1 8 32 --requests 300 --out bench.json
+    python benchmark.py --embed-ms 80 --generate-ms 600 --db-ms 40 --jitter 0.3 --baseline bench.json
+
+Latencies are simulated as mean ± jitter × mean, per call.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august",
+          "september", "october", "november", "december"]
+
+QUESTION_TEMPLATES = [
+    ("semantic", "what did I buy at {word}"),
+    ("semantic", "show me my {category} purchases"),
+    ("parser", "how much did I spend on {category} in {month}"),
+    ("parser", "total income last month"),
+    ("parser", "average {category} expense this year"),
+    ("comparative", "compare {month} and {month2} spending"),
+    ("hybrid", "how much did I spend on {word} in {month}"),
+    ("llm_sql", "which of my payments look unusual for a weekday"),
+]
+
+
+def _configure_env(args, workdir):
+    """Settings read at import time; they must be in place before main is imported."""
+    os.environ["ANSWER_CACHE"] = "1" if args.answer_cache else "0"
+    os.environ.setdefault("EMBED_CACHE_DISK", "0")
+    os.environ.setdefault("RETRIEVAL_BACKEND", "supabase")
+    os.environ["INGEST_QUEUE_DB"] = os.path.join(workdir, "ingest_queue.db")
+    os.environ["SQL_PLAN_CACHE_FILE"] = os.path.join(workdir, "sql_plans.json")
+    os.environ["VECTOR_INDEX_DIR"] = os.path.join(workdir, "vector_index")
+    os.environ["ROLLUP_DB"] = os.path.join(workdir, "rollups.db")
+    os.environ["ROLLUPS"] = "0" if args.no_rollups else "1"
+    os.environ.setdefault("INGEST_POLL_INTERVAL", "0.05")
+    os.environ.setdefault("IMPORT_BUDGET_MS", "100000")
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def _summary(phase, concurrency, latencies, errors, wall):
+    n = len(latencies)
+    return {
+        "phase": phase,
+        "concurrency": concurrency,
+        "requests": n,
+        "errors": errors,
+        "error_rate": round(errors / n, 4) if n else 0.0,
+        "throughput_rps": round(n / wall, 2) if wall else 0.0,
+        "p50_ms": round(_percentile(latencies, 50), 1),
+        "p99_ms": round(_percentile(latencies, 99), 1),
+        "wall_s": round(wall, 3),
+    }
+
+
+def _questions(rows, n, seed):
+    rng = random.Random(seed)
+    accounts = sorted({(r["userId"], r["accountId"]) for r in rows})
+    words = sorted({w for r in rows for w in r["description"].split() if w != "credit"})
+    categories = sorted({r["category"] for r in rows if r["type"] == "EXPENSE"})
+    out = []
+    for i in range(n):
+        kind, template = QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)]
+        month, month2 = rng.sample(MONTHS, 2)
+        user_id, account_id = rng.choice(accounts)
+        query = template.format(word=rng.choice(words), category=rng.choice(categories), month=month, month2=month2)
+        # a unique suffix keeps repeated questions from being answer/embedding cache hits
+        out.append((kind, {"query": f"{query} (#{i})", "userid": user_id, "accountid": account_id}))
+    return out
+
+
+def _webhook_events(rows, n, seed):
+    rng = random.Random(seed)
+    events, next_id = [], len(rows)
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.6:
+            row = dict(rng.choice(rows), id=f"txn-{next_id:07d}")
+            next_id += 1
+            events.append({"type": "INSERT", "table": "transactions", "record": row, "old_record": None})
+        elif roll < 0.9:
+            old = rng.choice(rows)
+            new = dict(old, amount=round(old["amount"] * rng.uniform(0.5, 1.5), 2),
+                       updatedAt=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            events.append({"type": "UPDATE", "table": "transactions", "record": new, "old_record": old})
+        else:
+            events.append({"type": "DELETE", "table": "transactions", "record": None,
+                           "old_record": rng.choice(rows)})
+    return events
+
+
+async def _drive(client, method, path, bodies, concurrency, check):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(body):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                ok = response.status_code == 200 and check(response)
+            except Exception:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(b) for b in bodies))
+    return latencies, errors, time.perf_counter() - started
+
+
+def _retrieve_ok(response):
+    return "status" not in response.json()  # only failures carry a status
+
+
+def _stream_ok(response):
+    return "event: done" in response.text
+
+
+def _webhook_ok(response):
+    return response.json().get("status") == "queued"
+
+
+async def run(args, main, fakes_state):
+    import httpx
+    import worker
+
+    rows, supabase_fake, genai_fake = fakes_state
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=300) as client:
+            for _ in range(200):
+                if (await client.get("/ready")).status_code == 200:
+                    break
+                await asyncio.sleep(0.05)
+            if not args.no_rollups:
+                # after the consumers started, as a real deployment must (see rollups.complete)
+                from rollups import get_rollup_store
+                get_rollup_store().build([rows])  # what backfill.py's rollup pass does against Supabase
+
+            for concurrency in args.concurrency:
+                if "retrieve" in args.phases:
+                    questions = _questions(rows, args.requests, seed=concurrency)
+                    latencies, errors, wall = await _drive(
+                        client, "POST", "/api/retrieve", [q for _, q in questions], concurrency, _retrieve_ok)
+                    results.append(_summary("retrieve", concurrency, latencies, errors, wall))
+                    _emit(_format_row(results[-1]))
+                if "stream" in args.phases:
+                    questions = _questions(rows, args.requests, seed=1000 + concurrency)
+                    latencies, errors, wall = await _drive(
+                        client, "POST", "/api/retrieve/stream", [q for _, q in questions], concurrency, _stream_ok)
+                    results.append(_summary("stream", concurrency, latencies, errors, wall))
+                    _emit(_format_row(results[-1]))
+                if "webhook" in args.phases:
+                    events = _webhook_events(rows, args.webhooks, seed=concurrency)
+                    started = time.perf_counter()
+                    latencies, errors, _ = await _drive(
+                        client, "POST", "/webhook/webhook", events, concurrency, _webhook_ok)
+                    results.append(_summary("webhook_enqueue", concurrency, latencies, errors,
+                                            time.perf_counter() - started))
+                    _emit(_format_row(results[-1]))
+                    # end to end: until every queued event has been processed
+                    while True:
+                        stats = await asyncio.to_thread(worker.ingest_queue.stats)
+                        if not stats["pending"] and not stats["in_flight"]:
+                            break
+                        await asyncio.sleep(0.02)
+                    drain = time.perf_counter() - started
+                    results.append({"phase": "webhook_drain", "concurrency": concurrency,
+                                    "requests": len(events), "errors": stats["dead_letters"],
+                                    "throughput_rps": round(len(events) / drain, 2), "wall_s": round(drain, 3)})
+                    _emit(_format_row(results[-1]))
+    return results
+
+
+def stage_means():
+    """Mean latency (ms) and count per (stage, route) from the metrics registry."""
+    import metrics
+
+    totals = {}
+    for (stage, route, _intent), hist in list(metrics.STAGE_SECONDS.children.items()):
+        entry = totals.setdefault(f"{route}/{stage}", [0.0, 0])
+        entry[0] += hist.total
+        entry[1] += hist.count
+    return {k: {"mean_ms": round(t / c * 1000, 2), "count": c} for k, (t, c) in sorted(totals.items()) if c}
+
+
+def _format_row(r):
+    p50 = f"{r['p50_ms']:>9.1f}" if "p50_ms" in r else f"{'-':>9}"
+    p99 = f"{r['p99_ms']:>9.1f}" if "p99_ms" in r else f"{'-':>9}"
+    return (f"{r['phase']:<16}{r['concurrency']:>6}{r['requests']:>9}{r['errors']:>8}"
+            f"{r['throughput_rps']:>11.1f}{p50}{p99}")
+
+
+def _emit(line):
+    """Report lines go to the real stdout; the app's own prints are swallowed during the run."""
+    sys.__stdout__.write(line + "\n")
+    sys.__stdout__.flush()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["phase"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nvs {baseline_path} ({baseline.get('commit')}):")
+    for r in results:
+        old = before.get((r["phase"], r["concurrency"]))
+        if not old:
+            continue
+        deltas = []
+        for key in ("throughput_rps", "p50_ms", "p99_ms"):
+            if r.get(key) is not None and old.get(key):
+                deltas.append(f"{key} {100 * (r[key] - old[key]) / old[key]:+.1f}%")
+        print(f"  {r['phase']:<16} c={r['concurrency']:<4} " + "  ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput/latency benchmark of main.app")
+    parser.add_argument("--rows", type=int, default=20000, help="synthetic transactions")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=160, help="retrieve requests per level")
+    parser.add_argument("--webhooks", type=int, default=300, help="webhook events per level")
+    parser.add_argument("--phases", nargs="+", default=["retrieve", "stream", "webhook"],
+                        choices=["retrieve", "stream", "webhook"])
+    parser.add_argument("--embed-ms", type=float, default=60)
+    parser.add_argument("--generate-ms", type=float, default=400)
+    parser.add_argument("--chunk-ms", type=float, default=30, help="delay between streamed chunks")
+    parser.add_argument("--db-ms", type=float, default=25)
+    parser.add_argument("--jitter", type=float, default=0.25, help="jitter as a fraction of each mean")
+    parser.add_argument("--answer-cache", action="store_true", help="leave the answer cache on")
+    parser.add_argument("--no-rollups", action="store_true", help="send every analytical question down the SQL path")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    _configure_env(args, workdir)
+    sys.path.insert(0, HERE)
+    random.seed(args.seed)
+
+    import contextlib
+    import io
+
+    import clients
+    from fakes import FakeGenAI, FakeSupabase, Latency, synthetic_transactions
+
+    def latency(mean):
+        return Latency(mean, mean * args.jitter)
+
+    started = time.perf_counter()
+    rows = synthetic_transactions(args.rows, n_users=args.users, seed=args.seed)
+    genai_fake = FakeGenAI(latency(args.embed_ms), latency(args.generate_ms), latency(args.chunk_ms))
+    supabase_fake = FakeSupabase(rows, latency=latency(args.db_ms))
+    supabase_fake.seed_embeddings(rows, genai_fake.embedder)
+    clients.install(supabase_client=supabase_fake, genai_module=genai_fake)
+    print(f"dataset: {len(rows)} rows, {args.users} users, seeded in {time.perf_counter() - started:.1f}s")
+
+    with contextlib.redirect_stdout(io.StringIO()):  # keep the app's request logging out of the report
+        import main as app_main
+
+    print(f"{'phase':<16}{'conc':>6}{'requests':>9}{'errors':>8}{'req/s':>11}{'p50 ms':>9}{'p99 ms':>9}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(run(args, app_main, (rows, supabase_fake, genai_fake)))
+
+    stages = stage_means()
+    print("\nstage means:")
+    for name, s in stages.items():
+        print(f"  {name:<34}{s['mean_ms']:>9.2f} ms  x{s['count']}")
+    print(f"\nfake calls: {genai_fake.embed_calls} embed, {genai_fake.generate_calls} generate, "
+          f"{sum(supabase_fake.calls.values())} supabase")
+
+    report = {"commit": _git_commit(), "config": vars(args), "results": results, "stages": stages}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.out}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# clients.py
+"""
+Shared Supabase and Gemini clients for the whole process.
+
+worker, fetching, embeddingCreation and llmResponse used to each create their own
+Supabase client and call genai.configure at import time. They now import the lazy
+`supabase` and `genai` handles from here. The real clients are built on first use,
+or up front by init_clients() at app startup, and then shared:
+
+- Supabase goes through one pooled httpx client (HTTP/2 when the `h2` package is
+  installed) with keep-alive, so requests reuse warm connections. Pool size and
+  timeouts come from SUPABASE_* env vars.
+- Gemini is configured once. Generative models are cached per name, and
+  embed_options() / generate_options() carry per-call timeouts for the SDK's
+  request_options.
+"""
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from structuredLog import log_event
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "3"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "64"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "32"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "1") != "0"
+GEMINI_EMBED_TIMEOUT = float(os.getenv("GEMINI_EMBED_TIMEOUT", "15"))
+GEMINI_GENERATE_TIMEOUT = float(os.getenv("GEMINI_GENERATE_TIMEOUT", "60"))
+
+_lock = threading.RLock()
+_http = None
+_supabase = None
+_genai = None
+_models = {}
+
+
+def get_http_client():
+    """The pooled httpx transport behind the Supabase client."""
+    global _http
+    if _http is None:
+        with _lock:
+            if _http is None:
+                import httpx
+
+                kwargs = dict(
+                    timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(max_connections=SUPABASE_MAX_CONNECTIONS,
+                                        max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                                        keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY),
+                )
+                try:
+                    _http = httpx.Client(http2=SUPABASE_HTTP2, **kwargs)
+                except ImportError:
+                    log_event("clients.http2_unavailable", logging.WARNING, using="HTTP/1.1")
+                    _http = httpx.Client(**kwargs)
+    return _http
+
+
+def get_supabase():
+    global _supabase
+    if _supabase is None:
+        with _lock:
+            if _supabase is None:
+                if not SUPABASE_URL or not SUPABASE_KEY:
+                    raise ValueError("Supabase credentials not found in .env")
+                from supabase import create_client, ClientOptions
+
+                try:
+                    options = ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT,
+                                            httpx_client=get_http_client())
+                except TypeError:
+                    # older supabase-py without httpx_client: PostgREST keeps its own pooled client
+                    options = ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT)
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=options)
+    return _supabase
+
+
+def get_genai():
+    """google.generativeai, configured once with GEMINI_API_KEY."""
+    global _genai
+    if _genai is None:
+        with _lock:
+            if _genai is None:
+                if not GEMINI_API_KEY:
+                    raise ValueError("GEMINI_API_KEY not found in .env")
+                import google.generativeai as genai_module
+
+                genai_module.configure(api_key=GEMINI_API_KEY)
+                _genai = genai_module
+    return _genai
+
+
+def get_model(name="gemini-2.0-flash"):
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = get_genai().GenerativeModel(name)
+    return model
+
+
+def embed_options():
+    return {"timeout": GEMINI_EMBED_TIMEOUT}
+
+
+def generate_options():
+    return {"timeout": GEMINI_GENERATE_TIMEOUT}
+
+
+def init_clients():
+    """Build both clients now (app startup) instead of on the first request."""
+    get_supabase()
+    get_genai()
+
+
+def install(supabase_client=None, genai_module=None):
+    """Use these objects in place of the real clients (benchmark.py installs its fakes)."""
+    global _supabase, _genai
+    with _lock:
+        if supabase_client is not None:
+            _supabase = supabase_client
+        if genai_module is not None:
+            _genai = genai_module
+            _models.clear()
+
+
+def close_clients():
+    global _http, _supabase
+    with _lock:
+        if _http is not None:
+            _http.close()
+        _http = _supabase = None
+
+
+class _Lazy:
+    """Module-level handle that builds the real object on first attribute access."""
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+def lazy(factory):
+    """
+    Import-time handle for a factory that caches its own result (get_backend,
+    get_ingest_queue, ...), so modules can keep `name.method()` call sites without
+    building anything when they are imported.
+    """
+    return _Lazy(factory)
+
+
+supabase = _Lazy(get_supabase)
+genai = _Lazy(get_genai)
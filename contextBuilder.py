@@ -0,0 +1,212 @@
+# contextBuilder.py
+"""
+Compiles retrieved rows into the RECORDS section of the answer prompt, within a
+token budget (CONTEXT_TOKEN_BUDGET, estimated at ~4 characters per token).
+
+1. Projection: bookkeeping columns (ids, receiptUrl, metadata, audit timestamps,
+   embeddings) are dropped, as are columns that are empty in every row. Timestamps
+   are cut to their date.
+2. Encoding: one CSV table with a header line instead of "key: value" per row.
+3. Pre-aggregation: when the table does not fit, transaction-like rows (an amount
+   plus date/category/type) are summarised with NumPy into totals per type, per
+   month and per category. The summary goes first, followed by as many of the most
+   recent rows as the remaining budget allows.
+
+Every build records the tokens the old "Record i: k: v" format would have used, so
+the savings can be read from stats().
+"""
+import csv
+import io
+import os
+import threading
+
+import numpy as np
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CHARS_PER_TOKEN = 4
+
+DROP_COLUMNS = {
+    "id", "userId", "accountId", "user_id", "account_id", "source_id", "receiptUrl", "metadata",
+    "embedding", "createdAt", "updatedAt", "lastProcessed", "nextRecurringDate",
+}
+# columns shown first when present, in this order; anything else follows
+PREFERRED_COLUMNS = [
+    "date", "type", "amount", "category", "description", "name", "balance", "isRecurring",
+    "recurringInterval", "status", "source_table", "chunk_text", "similarity",
+]
+_DATE_COLUMNS = {"date", "createdAt", "updatedAt", "nextRecurringDate", "lastProcessed"}
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _legacy_tokens(records):
+    """Token estimate of the unprojected "Record i: k: v" format the prompt used before."""
+    chars = 0
+    for i, rec in enumerate(records, 1):
+        body = ", ".join(f"{k}: {v}" for k, v in rec.items()) if isinstance(rec, dict) else str(rec)
+        chars += len(f"Record {i}: ") + len(body) + 1
+    return (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _project(records):
+    present = {}
+    for rec in records:
+        for k, v in rec.items():
+            if k not in DROP_COLUMNS and v not in (None, "", [], {}):
+                present[k] = True
+    columns = [c for c in PREFERRED_COLUMNS if c in present]
+    return columns + [c for c in present if c not in columns]
+
+
+def _cell(column, value):
+    if value is None:
+        return ""
+    if column in _DATE_COLUMNS and isinstance(value, str):
+        return value[:10]
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def _csv_rows(rows):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows(rows)
+    return buf.getvalue()
+
+
+def _csv(header, rows):
+    return _csv_rows([header] + list(rows))
+
+
+def _amounts(records):
+    out = np.empty(len(records), dtype=np.float64)
+    for i, rec in enumerate(records):
+        try:
+            out[i] = float(rec.get("amount"))
+        except (TypeError, ValueError):
+            out[i] = np.nan
+    return out
+
+
+def _group_table(keys, amounts, names):
+    """CSV of count/total per distinct key tuple, largest total first."""
+    labels = np.array(["\x1f".join(k) for k in zip(*keys)], dtype=object)
+    uniq, inverse = np.unique(labels, return_inverse=True)
+    totals = np.bincount(inverse, weights=amounts, minlength=len(uniq))
+    counts = np.bincount(inverse, minlength=len(uniq))
+    order = np.argsort(-totals, kind="stable")
+    rows = [uniq[i].split("\x1f") + [int(counts[i]), f"{totals[i]:.2f}"] for i in order]
+    return _csv(list(names) + ["count", "total"], rows)
+
+
+def aggregate_records(records):
+    """NumPy summary of transaction-like rows, or None when there is nothing to sum."""
+    amounts = _amounts(records)
+    valid = ~np.isnan(amounts)
+    if not valid.any():
+        return None
+    rows = [r for r, ok in zip(records, valid) if ok]
+    amounts = amounts[valid]
+
+    def column(name, transform=str):
+        return [transform(r.get(name)) if r.get(name) not in (None, "") else "unknown" for r in rows]
+
+    types = column("type")
+    sections = [_group_table([types], amounts, ["type"])]
+    if any(r.get("date") for r in rows):
+        months = column("date", lambda v: str(v)[:7])
+        dates = sorted(str(r["date"])[:10] for r in rows if r.get("date"))
+        sections.insert(0, f"{len(rows)} rows from {dates[0]} to {dates[-1]}\n")
+        sections.append(_group_table([months, types], amounts, ["month", "type"]))
+    if any(r.get("category") for r in rows):
+        categories = column("category", lambda v: str(v).lower())
+        sections.append(_group_table([categories, types], amounts, ["category", "type"]))
+    return "\n".join(sections)
+
+
+class BuiltContext:
+    __slots__ = ("text", "rows", "rows_included", "aggregated", "tokens", "legacy_tokens")
+
+    def __init__(self, text, rows, rows_included, aggregated, legacy_tokens):
+        self.text = text
+        self.rows = rows
+        self.rows_included = rows_included
+        self.aggregated = aggregated
+        self.tokens = estimate_tokens(text)
+        self.legacy_tokens = legacy_tokens
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.legacy_tokens - self.tokens)
+
+    def summary(self):
+        return {
+            "rows": self.rows,
+            "rows_included": self.rows_included,
+            "aggregated": self.aggregated,
+            "tokens": self.tokens,
+            "legacy_tokens": self.legacy_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+_lock = threading.Lock()
+_counters = {"builds": 0, "aggregated": 0, "tokens": 0, "legacy_tokens": 0}
+
+
+def _record(built):
+    with _lock:
+        _counters["builds"] += 1
+        _counters["aggregated"] += int(built.aggregated)
+        _counters["tokens"] += built.tokens
+        _counters["legacy_tokens"] += built.legacy_tokens
+    return built
+
+
+def build_context(records, budget=CONTEXT_TOKEN_BUDGET):
+    if not records:
+        return _record(BuiltContext("No records were found.", 0, 0, False, 0))
+    if isinstance(records, dict):
+        records = [records]
+    legacy = _legacy_tokens(records)
+    if not all(isinstance(r, dict) for r in records):
+        text = "\n".join(str(r) for r in records)
+        return _record(BuiltContext(text, len(records), len(records), False, legacy))
+
+    columns = _project(records)
+    table = [[_cell(c, r.get(c)) for c in columns] for r in records]
+    full = _csv(columns, table)
+    if estimate_tokens(full) <= budget:
+        return _record(BuiltContext(full, len(records), len(records), False, legacy))
+
+    # too big: summary first (when the rows have amounts), then the most recent rows that fit
+    summary = aggregate_records(records) if "amount" in columns else None
+    head = f"SUMMARY (computed over all {len(records)} rows):\n{summary}\n" if summary else ""
+    if "date" in columns:
+        date_idx = columns.index("date")
+        table.sort(key=lambda row: row[date_idx], reverse=True)
+
+    remaining = budget * CHARS_PER_TOKEN - len(head) - 120  # room for the framing lines
+    used, kept = len(_csv_rows([columns])), 0
+    for row in table:
+        line_len = len(_csv_rows([row]))
+        if used + line_len > remaining:
+            break
+        used += line_len
+        kept += 1
+
+    parts = [head] if head else []
+    if kept:
+        label = "MOST RECENT" if "date" in columns else "FIRST"
+        parts.append(f"{label} {kept} OF {len(records)} ROWS:\n{_csv(columns, table[:kept])}")
+    if kept < len(records):
+        parts.append(f"({len(records) - kept} more rows not shown{'; they are included in the summary' if summary else ''})")
+    return _record(BuiltContext("\n".join(parts), len(records), kept, bool(summary), legacy))
+
+
+def stats():
+    with _lock:
+        return {**_counters, "tokens_saved": max(0, _counters["legacy_tokens"] - _counters["tokens"]),
+                "budget": CONTEXT_TOKEN_BUDGET}
@@ -0,0 +1,159 @@
+# embeddingBatcher.py
+"""
+Micro-batching coalescer for embed-and-insert work.
+
+Callers (the webhook consumers) submit (table, row, text) and block on a Future.
+A single collector thread gathers submissions until it has BATCH_MAX_ITEMS of them
+or BATCH_MAX_WAIT_MS has passed since the first one arrived, embeds the whole batch
+with one Gemini call, upserts the rows into embeddingsnew in one request and then
+resolves each caller's Future. Batch-size and latency histograms are kept for tuning the window.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+from metrics import Histogram
+from embeddingCreation import get_gemini_embeddings, build_embedding_record, bulk_upsert_embeddings
+from structuredLog import log_event
+
+BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "50"))
+
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class _Item:
+    __slots__ = ("source_table", "row", "text", "future", "submitted")
+
+    def __init__(self, source_table, row, text):
+        self.source_table = source_table
+        self.row = row
+        self.text = text
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class EmbeddingBatcher:
+    def __init__(self, max_items=BATCH_MAX_ITEMS, max_wait_ms=BATCH_MAX_WAIT_MS, dim=384):
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000.0
+        self.dim = dim
+        self.pending = queue.Queue()
+        self.batch_sizes = Histogram(SIZE_BUCKETS)
+        self.embed_latency_ms = Histogram(LATENCY_BUCKETS_MS)   # one Gemini batch call
+        self.flush_latency_ms = Histogram(LATENCY_BUCKETS_MS)   # embed + bulk upsert
+        self.wait_latency_ms = Histogram(LATENCY_BUCKETS_MS)    # submit -> result, per caller
+        self.listeners = []   # fn(record, embedding), called for each row the bulk upsert wrote
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, source_table, row, text):
+        """Queue one row; the Future resolves to True once its embedding is written (or a newer one exists)."""
+        self._ensure_started()
+        item = _Item(source_table, row, text)
+        self.pending.put(item)
+        return item.future
+
+    def embed_and_insert(self, source_table, row, text, timeout=None):
+        """Blocking, batched equivalent of embeddingCreation.embed_and_insert."""
+        return self.submit(source_table, row, text).result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._flush(batch)
+            except Exception as e:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+            now = time.monotonic()
+            for item in batch:
+                self.wait_latency_ms.observe((now - item.submitted) * 1000)
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        self.batch_sizes.observe(len(batch))
+
+        embs = get_gemini_embeddings([item.text for item in batch], dim=self.dim)
+        self.embed_latency_ms.observe((time.monotonic() - started) * 1000)
+        if not embs:
+            raise RuntimeError(f"batch embedding failed for {len(batch)} rows")
+
+        ready, records, vectors = [], [], {}
+        for item, emb in zip(batch, embs):
+            if emb:
+                ready.append(item)
+                record = build_embedding_record(item.source_table, item.row, item.text, emb)
+                records.append(record)
+                vectors[id(record)] = emb
+            else:
+                item.future.set_exception(RuntimeError(f"empty embedding for {item.row.get('id')}"))
+
+        written = bulk_upsert_embeddings(records)
+        self.flush_latency_ms.observe((time.monotonic() - started) * 1000)
+        log_event("embedding.batch_upserted", written=len(written), stale=len(records) - len(written))
+        for record in written:
+            emb = vectors[id(record)]
+            for listener in self.listeners:
+                try:
+                    listener(record, emb)
+                except Exception as e:
+                    log_event("embedding.listener_failed", logging.WARNING, source_id=record["source_id"],
+                              error=str(e))
+        for item in ready:
+            item.future.set_result(True)
+
+    def stats(self):
+        return {
+            "max_items": self.max_items,
+            "max_wait_ms": self.max_wait * 1000,
+            "queued": self.pending.qsize(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "embed_latency_ms": self.embed_latency_ms.snapshot(),
+            "flush_latency_ms": self.flush_latency_ms.snapshot(),
+            "wait_latency_ms": self.wait_latency_ms.snapshot(),
+        }
+
+
+batcher = EmbeddingBatcher()
+
+metrics.registry.register_histogram(
+    "rag_embed_batch_size", "Rows per coalesced embedding batch", batcher.batch_sizes)
+metrics.registry.register_histogram(
+    "rag_embed_batch_embed_ms", "Gemini batch embed call latency (ms)", batcher.embed_latency_ms)
+metrics.registry.register_histogram(
+    "rag_embed_batch_flush_ms", "Batch embed + bulk upsert latency (ms)", batcher.flush_latency_ms)
+metrics.registry.register_histogram(
+    "rag_embed_batch_wait_ms", "Submit to result latency per caller (ms)", batcher.wait_latency_ms)
+metrics.registry.gauge(
+    "rag_embed_batch_queued", "Rows waiting for the next embedding batch", batcher.pending.qsize)
@@ -0,0 +1,259 @@
+# embeddingCache.py
+"""
+Content-addressed cache for Gemini embeddings.
+
+Entries are keyed by sha256(model, task_type, dim, normalized text), so identical text
+never goes back to Gemini. Two tiers:
+  - memory: LRU with a max entry count and a TTL
+  - disk:   float32 vectors appended to one file per dimension and read back through a
+            numpy memmap, plus an append-only key -> slot index; survives restarts.
+            Appends hold an flock on a sidecar lock file, so web workers and ingest
+            consumers in other processes never claim the same slot. A file that reaches
+            DISK_MAX_ENTRIES vectors is compacted to its newest half.
+Lookups that miss memory but hit disk are promoted back into memory. Disk reads and
+writes happen outside the memory tier's lock, so they never hold up memory hits. The
+cache directory is created on the first disk write, not at import.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from structuredLog import log_event
+
+CACHE_DIR = os.getenv("EMBED_CACHE_DIR", ".embedding_cache")
+MEMORY_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "10000"))
+MEMORY_TTL_SECONDS = float(os.getenv("EMBED_CACHE_TTL_SECONDS", "86400"))
+DISK_ENABLED = os.getenv("EMBED_CACHE_DISK", "1") != "0"
+DISK_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_DISK_MAX_ENTRIES", "100000"))  # per dimension
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", str(text))).strip()
+
+
+def cache_key(model, task_type, dim, text):
+    raw = f"{model}\x1f{task_type}\x1f{dim}\x1f{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """
+    Append-only float32 store for one embedding dimension, capped at max_entries vectors.
+    A full store is compacted down to its newest half: both files are rewritten and swapped
+    in under the exclusive flock, and other processes notice the new index file and reload.
+    """
+
+    def __init__(self, directory, dim, max_entries=DISK_MAX_ENTRIES):
+        self.dim = dim
+        self.directory = directory
+        self.max_entries = max_entries
+        self.lock_path = os.path.join(directory, f"vectors_{dim}.lock")
+        self.vectors_path = os.path.join(directory, f"vectors_{dim}.f32")
+        self.index_path = os.path.join(directory, f"index_{dim}.tsv")
+        self.slots = {}
+        self.mmap = None
+        self.index_id = None          # inode of the index file self.slots was read from
+        self.lock = threading.Lock()  # slots and mmap, between threads of this process
+
+    @contextmanager
+    def _flock(self, mode):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _index_on_disk(self):
+        try:
+            return os.stat(self.index_path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _n_vectors(self):
+        return os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+
+    def _load_index(self):
+        self.slots, self.mmap = {}, None
+        self.index_id = self._index_on_disk()
+        if self.index_id is None:
+            return
+        n_vectors = self._n_vectors()
+        with open(self.index_path) as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                # ignore a torn last line or an index entry whose vector never made it to disk
+                if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < n_vectors:
+                    self.slots[parts[0]] = int(parts[1])
+
+    def _remap(self):
+        n = self._n_vectors()
+        self.mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim)) if n else None
+
+    def get(self, key):
+        with self.lock:
+            if self.index_id != self._index_on_disk():
+                # first lookup, or another process compacted the store: re-read both files together
+                with self._flock(fcntl.LOCK_SH):
+                    self._load_index()
+            slot = self.slots.get(key)
+            if slot is None:
+                return None
+            if self.mmap is None or slot >= self.mmap.shape[0]:
+                with self._flock(fcntl.LOCK_SH):
+                    if self.index_id != self._index_on_disk():
+                        self._load_index()
+                        slot = self.slots.get(key)
+                    self._remap()
+                if slot is None or self.mmap is None:
+                    return None
+            return self.mmap[slot].tolist()
+
+    def put(self, key, emb):
+        vec = np.asarray(emb, dtype=np.float32)
+        if vec.shape != (self.dim,):
+            return
+        with self.lock:
+            if key in self.slots and self.index_id == self._index_on_disk():
+                return
+            # the slot is the file length, so reading it, appending and indexing must be one step
+            # across processes; self.lock only covers threads
+            with self._flock(fcntl.LOCK_EX):
+                if self.index_id != self._index_on_disk():
+                    self._load_index()
+                if key in self.slots:
+                    return
+                size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+                slot = size // (4 * self.dim)
+                if slot >= self.max_entries:
+                    self._compact()
+                    slot = len(self.slots)
+                    size = slot * 4 * self.dim
+                with open(self.vectors_path, "ab") as f:
+                    if size % (4 * self.dim):
+                        f.truncate(slot * 4 * self.dim)  # drop a torn vector from a crashed writer
+                    f.write(vec.tobytes())
+                with open(self.index_path, "a") as f:
+                    f.write(f"{key}\t{slot}\n")
+                if self.index_id is None:
+                    self.index_id = self._index_on_disk()
+            self.slots[key] = slot
+
+    def _compact(self):
+        """Keep the newest max_entries // 2 vectors. Called with the exclusive flock held."""
+        self._load_index()  # every process's appends, not just this one's
+        newest = sorted(self.slots.items(), key=lambda item: item[1])
+        keep = newest[max(0, len(newest) - self.max_entries // 2):]
+        self._remap()
+        vectors_tmp, index_tmp = self.vectors_path + ".tmp", self.index_path + ".tmp"
+        with open(vectors_tmp, "wb") as f:
+            for _, slot in keep:
+                f.write(self.mmap[slot].tobytes())
+        with open(index_tmp, "w") as f:
+            f.writelines(f"{key}\t{i}\n" for i, (key, _) in enumerate(keep))
+        # vectors first: readers only trust a vectors file once they see the index that goes with it
+        os.replace(vectors_tmp, self.vectors_path)
+        os.replace(index_tmp, self.index_path)
+        dropped = len(self.slots) - len(keep)
+        self._load_index()
+        log_event("embedding_cache.disk_compacted", dim=self.dim, kept=len(keep), dropped=dropped)
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries=MEMORY_MAX_ENTRIES, ttl_seconds=MEMORY_TTL_SECONDS,
+                 directory=CACHE_DIR, disk=DISK_ENABLED, disk_max_entries=DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.directory = directory
+        self.disk_enabled = disk
+        self.disk_max_entries = disk_max_entries
+        self.memory = OrderedDict()   # key -> (embedding, expires_at)
+        self.disk = {}                # dim -> _DiskTier
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _disk_tier(self, dim):
+        """Called with self.lock held; the tier reads its files lazily, under its own lock."""
+        tier = self.disk.get(dim)
+        if tier is None:
+            tier = self.disk[dim] = _DiskTier(self.directory, dim, self.disk_max_entries)
+        return tier
+
+    def _remember(self, key, emb):
+        self.memory[key] = (emb, time.monotonic() + self.ttl)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, model, task_type, dim, text):
+        key = cache_key(model, task_type, dim, text)
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[0]
+                del self.memory[key]
+                self.counters["expirations"] += 1
+            if not self.disk_enabled:
+                self.counters["misses"] += 1
+                return None
+            tier = self._disk_tier(dim)
+
+        emb = tier.get(key)
+        with self.lock:
+            if emb is None:
+                self.counters["misses"] += 1
+            else:
+                self._remember(key, emb)
+                self.counters["disk_hits"] += 1
+        return emb
+
+    def put(self, model, task_type, dim, text, emb):
+        if not emb:
+            return
+        key = cache_key(model, task_type, dim, text)
+        with self.lock:
+            self._remember(key, list(emb))
+            if not self.disk_enabled:
+                return
+            tier = self._disk_tier(dim)
+        try:
+            tier.put(key, emb)
+        except OSError as e:
+            log_event("embedding_cache.disk_write_failed", logging.WARNING, error=str(e))
+
+    def clear_memory(self):
+        with self.lock:
+            self.memory.clear()
+
+    def stats(self):
+        with self.lock:
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": {dim: len(tier) for dim, tier in self.disk.items()},
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -1,31 +1,38 @@
-import google.generativeai as genai
-from google.generativeai import types
-from supabase import create_client
-from dotenv import load_dotenv
 import os
+import hashlib
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+import metrics
+from clients import supabase, genai, embed_options  # shared lazy clients
+from embeddingCache import embedding_cache, normalize_text
+from structuredLog import log_event
+from vectorCodec import VECTOR_WIRE_FORMAT, encode_vector
 
-# 🔹 Load environment variables
-load_dotenv()
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-# Initialize Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Configure Gemini (new syntax — no Client() object)
-genai.configure(api_key=GEMINI_API_KEY)
+EMBEDDING_MODEL = "gemini-embedding-001"   # correct model name
+EMBEDDING_TASK_TYPE = "retrieval_document"  # recommended task type for RAG embeddings
+# 🔹 Versioned upsert RPC on embeddingsnew (SQL in the README); "0" falls back to a plain
+# PostgREST upsert on (source_table, source_id), which is idempotent but lets stale events win
+EMBEDDING_UPSERT_RPC = os.getenv("EMBEDDING_UPSERT_RPC", "upsert_embeddings")
 
 # Function to create embeddings with Gemini
-def get_gemini_embedding(text, dim=384):
+@metrics.timed("embed")
+def get_gemini_embedding(text, dim=384, use_cache=True):
+    if use_cache:
+        cached = embedding_cache.get(EMBEDDING_MODEL, EMBEDDING_TASK_TYPE, dim, text)
+        if cached is not None:
+            metrics.inc(metrics.EMBEDDING_TEXTS, source="cache")
+            return cached
     try:
+        metrics.inc(metrics.EMBEDDING_CALLS, kind="single")
+        metrics.inc(metrics.EMBEDDING_TEXTS, source="gemini")
         result = genai.embed_content(
-            model="gemini-embedding-001",   # correct model name
+            model=EMBEDDING_MODEL,
             content=text,
-            task_type="retrieval_document", # recommended task type for RAG embeddings
+            task_type=EMBEDDING_TASK_TYPE,
             title="Embedding generation",
-            output_dimensionality=dim       # if supported
+            output_dimensionality=dim,      # if supported
+            request_options=embed_options()
         )
         if isinstance(result, dict) and "embedding" in result:
             emb = result["embedding"]
@@ -36,64 +43,236 @@ def get_gemini_embedding(text, dim=384):
         else:
             raise ValueError("Unexpected embedding format received from Gemini API.")
 
+        if use_cache:
+            embedding_cache.put(EMBEDDING_MODEL, EMBEDDING_TASK_TYPE, dim, text, emb)
         return emb
         #return result["embedding"]  # returns list of floats
     except Exception as e:
-        print(f"Gemini embedding failed: {e}")
+        log_event("embedding.failed", logging.WARNING, error=str(e))
         return []
 
-# Function to insert embeddings into Supabase
-def embed_and_insert(source_table, row, text):
+# Function to create embeddings for many texts in one Gemini call
+def get_gemini_embeddings(texts, dim=384, use_cache=True):
+    """
+    Batched variant of get_gemini_embedding: one embed_content call for a list of texts.
+    Texts already in the embedding cache are not sent again.
+    Returns a list of vectors aligned with `texts`, or [] if the call failed.
+    """
+    if not texts:
+        return []
+    embs = [None] * len(texts)
+    if use_cache:
+        for i, text in enumerate(texts):
+            embs[i] = embedding_cache.get(EMBEDDING_MODEL, EMBEDDING_TASK_TYPE, dim, text)
+    missing = [i for i, emb in enumerate(embs) if emb is None]
+    metrics.inc(metrics.EMBEDDING_TEXTS, len(texts) - len(missing), source="cache")
+    if not missing:
+        return embs
     try:
-        exists = supabase.table("embeddingsnew")\
-            .select("id")\
-            .eq("source_id", row["id"])\
-            .execute()
+        metrics.inc(metrics.EMBEDDING_CALLS, kind="batch")
+        metrics.inc(metrics.EMBEDDING_TEXTS, len(missing), source="gemini")
+        result = genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=[texts[i] for i in missing],
+            task_type=EMBEDDING_TASK_TYPE,
+            title="Embedding generation",
+            output_dimensionality=dim,
+            request_options=embed_options()
+        )
+        if isinstance(result, dict) and "embedding" in result:
+            fresh = result["embedding"]
+        elif hasattr(result, "embeddings") and result.embeddings:
+            fresh = [e.values for e in result.embeddings]
+        else:
+            raise ValueError("Unexpected batch embedding format received from Gemini API.")
 
-        if exists.data:
-            print(f"Embedding already exists for {source_table} id {row['id']}, skipping.")
-            return
-            
-        emb = get_gemini_embedding(text, dim=384)
-        if not emb:
-            print(f"Skipped embedding for {source_table} id {row['id']}")
-            return
+        if len(fresh) != len(missing):
+            raise ValueError(f"Expected {len(missing)} embeddings, got {len(fresh)}")
+        for i, emb in zip(missing, fresh):
+            embs[i] = emb
+            if use_cache:
+                embedding_cache.put(EMBEDDING_MODEL, EMBEDDING_TASK_TYPE, dim, texts[i], emb)
+        return embs
+    except Exception as e:
+        log_event("embedding.batch_failed", logging.WARNING, texts=len(missing), error=str(e))
+        return []
 
-        emb_str = f"[{', '.join(str(x) for x in emb)}]"  # convert to pgvector format
+# 🔹 Columns that carry meaning for retrieval, per source table.
+# Bookkeeping columns (ids, timestamps, status, receiptUrl) are left out so that
+# processing jobs touching only those don't change the embedded text.
+TEXT_COLUMNS = {
+    "transactions": ["type", "amount", "description", "date", "category", "isRecurring", "recurringInterval"],
+    "accounts": ["name", "type", "balance", "isDefault"],
+    "budgets": ["amount"],
+}
 
-        response = supabase.table("embeddingsnew").insert({
-            "source_table": source_table,
-            "source_id": row["id"],
-            "user_id": row.get("userId"),
-            "account_id": row.get("accountId"),
-            "chunk_text": text,
-            "metadata": {"columns": row},
-            "embedding": emb_str
-        }).execute()
+# Dropped from the fallback text of tables without an entry in TEXT_COLUMNS
+VOLATILE_COLUMNS = {"id", "userId", "accountId", "createdAt", "updatedAt", "lastProcessed",
+                    "nextRecurringDate", "lastAlertSent", "status", "receiptUrl"}
 
-        if hasattr(response, "error") and response.error:
-            print(f"Insert failed for {source_table} id {row['id']}: {response.error}")
-        else:
-            print(f"Inserted embedding for {source_table} id {row['id']}")
+def build_embedding_text(source_table, row):
+    """Canonical embedding text: only the semantically relevant columns, in a fixed order."""
+    columns = TEXT_COLUMNS.get(source_table)
+    if columns is None:
+        columns = [k for k in row if k not in VOLATILE_COLUMNS]
+    return " ".join(str(row[c]) for c in columns if row.get(c) is not None)
 
-    except Exception as e:
-        print(f"Embedding failed for {source_table} id {row['id']}: {e}")
+def has_text_columns(source_table, row):
+    """True if `row` carries every column the canonical text is built from."""
+    columns = TEXT_COLUMNS.get(source_table)
+    return bool(row) and (columns is None or all(c in row for c in columns))
 
-# Example for one table
-if __name__ == "__main__":
-    table_names = ["transactions"]  # extend later
-    for table_name in table_names:
-        rows_response = supabase.table(table_name).select("*").execute()
+def content_fingerprint(text):
+    """Stable hash of the embedded text, stored in metadata next to each embedding."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-        if hasattr(rows_response, "error") and rows_response.error:
-            print(f"Failed to fetch rows from {table_name}: {rows_response.error}")
+def row_version(row):
+    """
+    Version of a source row for ordering its events: updatedAt (falling back to createdAt)
+    in microseconds since the epoch, or 0 when the row carries neither.
+    """
+    for column in ("updatedAt", "createdAt"):
+        value = row.get(column)
+        if not value:
             continue
+        try:
+            ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            continue
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)  # Postgres timestamp without time zone is UTC here
+        return (ts - _EPOCH) // timedelta(microseconds=1)
+    return 0
+
+def tombstone_version(row, received_at=None):
+    """
+    Version of a DELETE: old_record may carry only the id, but the row was gone by the time
+    the webhook arrived (received_at, epoch seconds, default now), so that bounds it.
+    """
+    return max(row_version(row), int((received_at or time.time()) * 1_000_000))
+
+def build_embedding_record(source_table, row, text, emb):
+    """Shape one embeddingsnew row. The embedding is encoded for the wire (VECTOR_WIRE_FORMAT)."""
+    return {
+        "source_table": source_table,
+        "source_id": row["id"],
+        "user_id": row.get("userId"),
+        "account_id": row.get("accountId"),
+        "chunk_text": text,
+        "metadata": {"columns": row, "fingerprint": content_fingerprint(text)},
+        "embedding": encode_vector(emb),
+        "version": row_version(row),
+        "deleted": False,
+    }
+
+def build_tombstone_record(source_table, row, received_at=None):
+    """Shape the embeddingsnew row a DELETE leaves behind: no embedding, versioned by tombstone_version."""
+    return {
+        "source_table": source_table,
+        "source_id": row["id"],
+        "user_id": row.get("userId"),
+        "account_id": row.get("accountId"),
+        "chunk_text": "",
+        "metadata": {},
+        "embedding": None,
+        "version": tombstone_version(row, received_at),
+        "deleted": True,
+    }
+
+def stored_fingerprint(source_table, source_id):
+    """Fingerprint saved with the current embedding, or None if there is no embedding."""
+    res = supabase.table("embeddingsnew")\
+        .select("fingerprint:metadata->>fingerprint")\
+        .eq("source_table", source_table)\
+        .eq("source_id", source_id)\
+        .eq("deleted", False)\
+        .limit(1)\
+        .execute()
+    if not res.data:
+        return None
+    return res.data[0].get("fingerprint") or ""
+
+def patch_embedding_metadata(source_table, row, text):
+    """
+    Refresh the row snapshot in metadata without touching the embedding. Rows already
+    written from a newer version, and tombstones, are left alone, so response.data is
+    empty when there is no embedding, when the row was deleted and when this event is stale.
+    """
+    version = row_version(row)
+    return supabase.table("embeddingsnew")\
+        .update({"metadata": {"columns": row, "fingerprint": content_fingerprint(text)}, "version": version})\
+        .eq("source_table", source_table)\
+        .eq("source_id", row["id"])\
+        .eq("deleted", False)\
+        .lte("version", version)\
+        .execute()
+
+def delete_embedding(source_table, row, received_at=None):
+    """
+    Replace the embedding with a versioned tombstone instead of deleting the row, so an
+    INSERT or UPDATE of the same row processed after the DELETE (a retry, or one still
+    waiting in the batcher) can't write it back. Returns the tombstone if it was written,
+    None if a newer version was already stored.
+    """
+    written = bulk_upsert_embeddings([build_tombstone_record(source_table, row, received_at)])
+    return written[0] if written else None
+
+def _latest_per_key(records):
+    """One record per (source_table, source_id), the highest version winning (ties: the last one)."""
+    latest = {}
+    for record in records:
+        key = (record["source_table"], record["source_id"])
+        if key not in latest or record.get("version", 0) >= latest[key].get("version", 0):
+            latest[key] = record
+    return list(latest.values())
+
+def bulk_upsert_embeddings(records):
+    """
+    Write many embeddingsnew rows in one request, keyed on (source_table, source_id).
+    A row is only replaced by a record of the same or a newer version (a tombstone only by
+    a newer one), so replayed and out-of-order events are no-ops. Returns the records that
+    were actually written.
+    """
+    if not records:
+        return []
+    records = _latest_per_key(records)  # ON CONFLICT cannot touch the same row twice in one statement
+    if not EMBEDDING_UPSERT_RPC or EMBEDDING_UPSERT_RPC == "0":
+        if VECTOR_WIRE_FORMAT != "text":
+            raise ValueError("VECTOR_WIRE_FORMAT needs the upsert_embeddings RPC to decode vectors")
+        response = supabase.table("embeddingsnew")\
+            .upsert(records, on_conflict="source_table,source_id", returning="minimal")\
+            .execute()
+        if hasattr(response, "error") and response.error:
+            raise Exception(f"Bulk upsert failed: {response.error}")
+        return records
+
+    response = supabase.rpc(EMBEDDING_UPSERT_RPC, {"rows": records}).execute()
+    if hasattr(response, "error") and response.error:
+        raise Exception(f"Bulk upsert failed: {response.error}")
+    written = {(r.get("source_table"), str(r.get("source_id"))) for r in (response.data or [])}
+    return [r for r in records if (r["source_table"], str(r["source_id"])) in written]
+
+# Function to embed one row and write it to Supabase
+def embed_and_insert(source_table, row, text):
+    """Returns True when the row has an embedding afterwards, False if it failed."""
+    try:
+        emb = get_gemini_embedding(text, dim=384)
+        if not emb:
+            log_event("embedding.skipped", logging.WARNING, table=source_table, source_id=row["id"])
+            return False
 
-        rows = rows_response.data
-        print(f"{len(rows)} rows fetched from {table_name}")
+        written = bulk_upsert_embeddings([build_embedding_record(source_table, row, text, emb)])
+        # per row on every webhook: sampled through LOG_SAMPLE_RATES (see structuredLog)
+        log_event("embedding.upserted" if written else "embedding.stale", table=source_table, source_id=row["id"])
+        return True
 
-        for row in rows:
-            text = " ".join(str(v) for v in row.values() if v is not None)
-            embed_and_insert(table_name, row, text)
+    except Exception as e:
+        log_event("embedding.insert_failed", logging.WARNING, table=source_table, source_id=row["id"], error=str(e))
+        return False
 
-    print("Backfill complete")
\ No newline at end of file
+# Backfill every table (see backfill.py for options)
+if __name__ == "__main__":
+    from backfill import main
+    main()
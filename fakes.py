@@ -0,0 +1,549 @@
+# fakes.py
+"""
+In-process stand-ins for the Supabase client and google.generativeai, for offline
+benchmarks (benchmark.py). Install them with clients.install() before the first
+request.
+
+FakeSupabase
+    table(...).select/insert/upsert/update/delete with eq/in_/gt/lte/order/limit,
+    backed by dicts for embeddingsnew and by an in-memory SQLite database for the
+    source tables, plus the RPCs the app calls:
+      match_embeddings / match_embeddings_encoded   exact cosine top-k per partition
+      match_filtered_embeddings                     the same, among rows passing a filter query
+      execute_sql_wrapper                           the generated SQL, translated to SQLite
+      upsert_embeddings                             versioned upsert honouring delete tombstones, as in the README
+FakeGenAI
+    embed_content (hashed bag-of-words vectors, so similar texts are close) and
+    GenerativeModel.generate_content, streaming included.
+
+Every call sleeps for a configurable Latency (mean ± uniform jitter) to stand in for
+the network. synthetic_transactions() generates the datasets.
+"""
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from embeddingCreation import build_embedding_text, content_fingerprint
+from vectorCodec import decode_vector
+
+EMBEDDING_DIM = 384
+
+CATEGORY_WORDS = {
+    "food": ["swiggy", "zomato", "dominos", "cafe", "biryani"],
+    "groceries": ["bigbasket", "dmart", "vegetables", "milk", "blinkit"],
+    "transportation": ["uber", "ola", "metro", "petrol", "parking"],
+    "entertainment": ["netflix", "movie", "concert", "spotify", "bowling"],
+    "utilities": ["electricity", "water", "internet", "gas", "mobile"],
+    "travel": ["goa", "flight", "hotel", "train", "airbnb"],
+    "shopping": ["amazon", "myntra", "shoes", "headphones", "flipkart"],
+    "healthcare": ["pharmacy", "doctor", "dental", "lab", "insurance"],
+    "housing": ["rent", "maintenance", "repairs", "furniture", "deposit"],
+    "education": ["course", "books", "udemy", "tuition", "exam"],
+}
+INCOME_WORDS = ["salary", "freelance", "dividend", "refund", "bonus"]
+
+
+class Latency:
+    """Simulated call latency in milliseconds: mean ± uniform jitter, never negative."""
+
+    def __init__(self, mean_ms=0.0, jitter_ms=0.0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+
+    def sleep(self, scale=1.0):
+        ms = self.mean_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if ms > 0:
+            time.sleep(ms * scale / 1000.0)
+
+
+def synthetic_transactions(n_rows, n_users=4, accounts_per_user=1, months=12, seed=0, today=None):
+    """
+    n_rows transaction rows shaped like the app's `transactions` table, spread over
+    n_users × accounts_per_user accounts and the last `months` months.
+    """
+    rng = random.Random(seed)
+    today = today or datetime.now().replace(microsecond=0)
+    accounts = [(f"user-{u}", f"account-{u}-{a}") for u in range(n_users) for a in range(accounts_per_user)]
+    categories = list(CATEGORY_WORDS)
+    rows = []
+    for i in range(n_rows):
+        user_id, account_id = accounts[i % len(accounts)]
+        when = today - timedelta(days=rng.uniform(0, months * 30.4))
+        if rng.random() < 0.1:
+            kind, category = "INCOME", rng.choice(["salary", "freelance", "investments"])
+            description = f"{rng.choice(INCOME_WORDS)} credit"
+            amount = round(rng.uniform(5000, 90000), 2)
+        else:
+            kind, category = "EXPENSE", rng.choice(categories)
+            words = CATEGORY_WORDS[category]
+            description = f"{rng.choice(words)} {rng.choice(words)}"
+            amount = round(rng.lognormvariate(6, 1.1), 2)
+        stamp = when.replace(microsecond=0).isoformat()
+        rows.append({
+            "id": f"txn-{i:07d}",
+            "type": kind,
+            "amount": amount,
+            "description": description,
+            "date": stamp,
+            "category": category,
+            "isRecurring": category in ("utilities", "housing") or category == "salary",
+            "recurringInterval": "MONTHLY" if category in ("utilities", "housing", "salary") else None,
+            "status": "COMPLETED",
+            "userId": user_id,
+            "accountId": account_id,
+            "createdAt": stamp,
+            "updatedAt": stamp,
+        })
+    return rows
+
+
+# 🔹 Gemini
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+class _Embedder:
+    """Sum of per-token random unit vectors, normalised: texts sharing words are similar."""
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def _token(self, token):
+        vec = self.tokens.get(token)
+        if vec is None:
+            rng = np.random.default_rng(zlib.crc32(token.encode("utf-8")))
+            vec = rng.standard_normal(self.dim).astype(np.float32)
+            with self.lock:
+                self.tokens[token] = vec
+        return vec
+
+    def __call__(self, text, dim=None):
+        tokens = _TOKEN.findall(str(text).lower()) or ["<empty>"]
+        vec = np.sum([self._token(t) for t in tokens], axis=0)
+        vec /= max(float(np.linalg.norm(vec)), 1e-12)
+        return vec[: dim or self.dim].tolist()
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    def __init__(self, name, fake):
+        self.name = name
+        self.fake = fake
+
+    def _reply(self, prompt):
+        if "You are generating SQL" in prompt or "SQL generator" in prompt:
+            return "SELECT * FROM transactions WHERE type = 'EXPENSE' ORDER BY date DESC LIMIT 50"
+        records = prompt.count("\n")
+        return (f"Based on the {records} lines of context you have a steady pattern of spending. "
+                "The largest items are listed above and the totals match your records.")
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        self.fake.generate_calls += 1
+        self.fake.generate_latency.sleep()  # time to first token
+        text = self._reply(prompt)
+        if not stream:
+            return _Chunk(text)
+        words = text.split(" ")
+        chunks = [" ".join(words[i:i + 6]) + " " for i in range(0, len(words), 6)]
+
+        def iterate():
+            for i, chunk in enumerate(chunks):
+                if i:
+                    self.fake.stream_chunk_latency.sleep()
+                yield _Chunk(chunk)
+        return iterate()
+
+
+class FakeGenAI:
+    """Duck-typed google.generativeai: configure, embed_content, GenerativeModel."""
+
+    def __init__(self, embed_latency=None, generate_latency=None, stream_chunk_latency=None):
+        self.embed_latency = embed_latency or Latency()
+        self.generate_latency = generate_latency or Latency()
+        self.stream_chunk_latency = stream_chunk_latency or Latency()
+        self.embedder = _Embedder()
+        self.embed_calls = 0
+        self.generate_calls = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def embed_content(self, model=None, content=None, task_type=None, title=None,
+                      output_dimensionality=None, request_options=None, **kwargs):
+        self.embed_calls += 1
+        if isinstance(content, list):
+            self.embed_latency.sleep(1 + 0.02 * len(content))  # batches cost a little more
+            return {"embedding": [self.embedder(c, output_dimensionality) for c in content]}
+        self.embed_latency.sleep()
+        return {"embedding": self.embedder(content, output_dimensionality)}
+
+    def GenerativeModel(self, name):
+        return FakeModel(name, self)
+
+
+# 🔹 Supabase
+
+class _Response:
+    def __init__(self, data=None, error=None):
+        self.data = data
+        self.error = error
+
+
+class _Call:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return self.fn()
+
+
+def _select_columns(spec):
+    """PostgREST select spec → [(output name, column, json key or None)]."""
+    if not spec or spec.strip() == "*":
+        return None
+    out = []
+    for item in spec.split(","):
+        item = item.strip()
+        alias, _, path = item.rpartition(":") if ":" in item else ("", "", item)
+        column, _, key = path.partition("->>")
+        if not key:
+            column, _, key = path.partition("->")
+        out.append((alias or key or column, column.strip(), key.strip() or None))
+    return out
+
+
+class _Query:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.columns = None
+        self.payload = None
+        self.filters = []
+        self.order_by = None
+        self.limit_n = None
+
+    # builders
+    def select(self, spec="*", **kwargs):
+        self.columns = _select_columns(spec)
+        return self
+
+    def insert(self, records, **kwargs):
+        self.action, self.payload = "insert", records
+        return self
+
+    def upsert(self, records, on_conflict="", returning=None, **kwargs):
+        self.action, self.payload = "upsert", records
+        return self
+
+    def update(self, values, **kwargs):
+        self.action, self.payload = "update", values
+        return self
+
+    def delete(self, **kwargs):
+        self.action = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda r: str(r.get(column)) == str(value))
+        return self
+
+    def in_(self, column, values):
+        values = {str(v) for v in values}
+        self.filters.append(lambda r: str(r.get(column)) in values)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) > value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) <= value)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def execute(self):
+        self.db.latency.sleep()
+        return self.db._execute(self)
+
+
+class FakeSupabase:
+    """Enough of supabase.Client for the app: embeddingsnew, source tables and its RPCs."""
+
+    def __init__(self, transactions=(), latency=None, today=None):
+        self.latency = latency or Latency()
+        self.lock = threading.RLock()
+        self.embeddings = {}       # (source_table, source_id) -> row, embedding as float32 array
+        self.partitions = {}       # (user_id, account_id) -> {key: None}, insertion ordered
+        self._matrices = {}        # (user_id, account_id) -> (keys, normalised matrix)
+        self.calls = {}
+        self.sql = sqlite3.connect(":memory:", check_same_thread=False)
+        self.sql.row_factory = sqlite3.Row
+        self.sql.execute("""CREATE TABLE transactions (
+            id TEXT PRIMARY KEY, type TEXT, amount REAL, description TEXT, date TEXT, category TEXT,
+            "isRecurring" INTEGER, "recurringInterval" TEXT, status TEXT, "userId" TEXT, "accountId" TEXT,
+            "createdAt" TEXT, "updatedAt" TEXT, "receiptUrl" TEXT, "nextRecurringDate" TEXT, "lastProcessed" TEXT)""")
+        self.sql.execute('CREATE INDEX transactions_account ON transactions ("userId", "accountId", date)')
+        # the data_versions trigger from the README, for the answer cache
+        self.sql.execute("CREATE TABLE data_versions (user_id TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            self.sql.execute(f"""CREATE TRIGGER transactions_version_{event.lower()} AFTER {event} ON transactions
+                BEGIN INSERT INTO data_versions (user_id, version) VALUES ({row}."userId", 1)
+                      ON CONFLICT (user_id) DO UPDATE SET version = version + 1; END""")
+        self.add_transactions(transactions)
+
+    # 🔹 seeding
+
+    def add_transactions(self, rows):
+        columns = ["id", "type", "amount", "description", "date", "category", "isRecurring",
+                   "recurringInterval", "status", "userId", "accountId", "createdAt", "updatedAt"]
+        quoted = ", ".join(f'"{c}"' for c in columns)
+        with self.lock:
+            self.sql.executemany(
+                f"INSERT OR REPLACE INTO transactions ({quoted}) VALUES ({', '.join('?' * len(columns))})",
+                [[row.get(c) for c in columns] for row in rows])
+
+    def seed_embeddings(self, rows, embedder, source_table="transactions"):
+        """Embeddings for existing rows, as the backfill would have written them (no latency)."""
+        for row in rows:
+            text = build_embedding_text(source_table, row)
+            self._put({
+                "source_table": source_table, "source_id": row["id"], "user_id": row.get("userId"),
+                "account_id": row.get("accountId"), "chunk_text": text,
+                "metadata": {"columns": row, "fingerprint": content_fingerprint(text)},
+                "embedding": embedder(text), "version": 0,
+            })
+
+    # 🔹 embeddingsnew
+
+    def _put(self, record):
+        row = dict(record)
+        row["embedding"] = decode_vector(row.get("embedding"))
+        row["deleted"] = bool(row.get("deleted"))
+        key = (row["source_table"], str(row["source_id"]))
+        with self.lock:
+            previous = self.embeddings.get(key)
+            if previous is not None:
+                self._unlink(key, previous)
+            row.setdefault("id", previous["id"] if previous else str(uuid.uuid4()))
+            self.embeddings[key] = row
+            if row["deleted"]:
+                return  # a tombstone is kept for its version but never matched
+            partition = (row.get("user_id"), row.get("account_id"))
+            self.partitions.setdefault(partition, {})[key] = None
+            self._matrices.pop(partition, None)
+
+    def _unlink(self, key, row):
+        partition = (row.get("user_id"), row.get("account_id"))
+        self.partitions.get(partition, {}).pop(key, None)
+        self._matrices.pop(partition, None)
+
+    def _remove(self, key):
+        with self.lock:
+            row = self.embeddings.pop(key, None)
+            if row is not None:
+                self._unlink(key, row)
+
+    def _public(self, row):
+        out = dict(row)
+        if out.get("embedding") is not None:
+            out["embedding"] = json.dumps(out["embedding"].tolist())  # PostgREST returns the text literal
+        return out
+
+    def _match_filtered(self, query, filter_query, user_id, account_id, top_k):
+        keys = {("transactions", str(r["id"])) for r in self._run_sql(filter_query, user_id, account_id)}
+        return self._match(query, user_id, account_id, top_k, keep=keys.__contains__)
+
+    def _match(self, query, user_id, account_id, top_k, keep=None):
+        partition = (user_id, account_id)
+        with self.lock:
+            cached = self._matrices.get(partition)
+            if cached is None:
+                keys = list(self.partitions.get(partition, {}))
+                matrix = (np.stack([self.embeddings[k]["embedding"] for k in keys])
+                          if keys else np.zeros((0, EMBEDDING_DIM), dtype=np.float32))
+                matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                cached = self._matrices[partition] = (keys, matrix)
+        keys, matrix = cached
+        if keep is not None:
+            rows = [i for i, key in enumerate(keys) if keep(key)]
+            keys, matrix = [keys[i] for i in rows], matrix[rows]
+        if not keys:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        scores = matrix @ q
+        k = min(int(top_k), len(keys))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        out = []
+        for i in best:
+            row = self.embeddings.get(keys[i])
+            if row is not None:
+                out.append({"id": row["id"], "source_table": row["source_table"], "source_id": row["source_id"],
+                            "chunk_text": row["chunk_text"], "metadata": row["metadata"],
+                            "similarity": float(scores[i])})
+        return out
+
+    def _upsert_versioned(self, rows):
+        written = []
+        with self.lock:
+            for record in rows:
+                key = (record["source_table"], str(record["source_id"]))
+                current = self.embeddings.get(key)
+                if current is not None and (current.get("version", 0) > record.get("version", 0) or (
+                        current["deleted"] and current.get("version", 0) == record.get("version", 0))):
+                    continue  # stale event, or a write no newer than the row's delete
+                self._put(record)
+                written.append({"source_table": key[0], "source_id": key[1]})
+        return written
+
+    # 🔹 source tables through SQLite
+
+    def _run_sql(self, query, user_id, account_id):
+        translated = translate_sql(query)
+        scoped = re.sub(r'\bFROM\s+transactions\b',
+                        'FROM (SELECT * FROM transactions WHERE "userId" = :user_id AND "accountId" = :account_id) '
+                        'AS transactions', translated, flags=re.IGNORECASE)
+        with self.lock:
+            cur = self.sql.execute(scoped, {"user_id": user_id, "account_id": account_id})
+            return [dict(r) for r in cur.fetchall()]
+
+    # 🔹 client surface
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, name, params):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+        def run():
+            self.latency.sleep()
+            try:
+                if name == "match_embeddings":
+                    return _Response(self._match(params["query_embedding"], params["user_id"],
+                                                 params["account_id"], params.get("top_k", 5)))
+                if name == "match_embeddings_encoded":
+                    return _Response(self._match(decode_vector(params["query_vector"]), params["user_id"],
+                                                 params["account_id"], params.get("top_k", 5)))
+                if name == "match_filtered_embeddings":
+                    return _Response(self._match_filtered(decode_vector(params["query_vector"]), params["filter_query"],
+                                                          params["user_id"], params["account_id"],
+                                                          params.get("top_k", 5)))
+                if name == "execute_sql_wrapper":
+                    return _Response(self._run_sql(params["query"], params["user_id"], params["account_id"]))
+                if name == "upsert_embeddings":
+                    return _Response(self._upsert_versioned(params["rows"]))
+            except Exception as e:
+                return _Response(None, f"{type(e).__name__}: {e}")
+            return _Response(None, f"function {name} does not exist")
+        return _Call(run)
+
+    def _execute(self, q):
+        self.calls[f"{q.table}.{q.action}"] = self.calls.get(f"{q.table}.{q.action}", 0) + 1
+        if q.table != "embeddingsnew":
+            if q.action != "select":
+                raise NotImplementedError(f"fake {q.table}.{q.action}")
+            with self.lock:
+                rows = [dict(r) for r in self.sql.execute(f"SELECT * FROM {q.table}").fetchall()]
+            return _Response(self._shape(q, rows))
+
+        if q.action in ("insert", "upsert"):
+            records = q.payload if isinstance(q.payload, list) else [q.payload]
+            for record in records:
+                self._put(record)
+            return _Response([] if q.action == "upsert" else records)
+
+        with self.lock:
+            matched = [(k, r) for k, r in self.embeddings.items() if all(f(r) for f in q.filters)]
+            if q.action == "delete":
+                for key, _ in matched:
+                    self._remove(key)
+                return _Response([self._public(r) for _, r in matched])
+            if q.action == "update":
+                for _, row in matched:
+                    row.update(q.payload)
+                return _Response([self._public(r) for _, r in matched])
+        return _Response(self._shape(q, [self._public(r) for _, r in matched]))
+
+    def _shape(self, q, rows):
+        rows = [r for r in rows if all(f(r) for f in q.filters)]
+        if q.order_by:
+            column, desc = q.order_by
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        if q.limit_n is not None:
+            rows = rows[:q.limit_n]
+        if q.columns:
+            shaped = []
+            for r in rows:
+                out = {}
+                for name, column, key in q.columns:
+                    value = r.get(column)
+                    if key is not None:
+                        value = (value or {}).get(key) if isinstance(value, dict) else None
+                    out[name] = value
+                shaped.append(out)
+            rows = shaped
+        return rows
+
+
+# 🔹 Postgres → SQLite for the SQL the parser and the SQL prompt produce
+
+_INTERVAL = re.compile(r"(date\('now'\)|'[^']*'|\"?\w+\"?)\s*([+-])\s*INTERVAL\s*'(\d+)\s*(\w+)'", re.IGNORECASE)
+_EXTRACT = re.compile(r"EXTRACT\s*\(\s*(YEAR|MONTH|DAY|DOW)\s+FROM\s+([^)]+)\)", re.IGNORECASE)
+_EXTRACT_FORMATS = {"year": "%Y", "month": "%m", "day": "%d", "dow": "%w"}
+_TRUNC_FORMATS = {"year": "%Y-01-01", "month": "%Y-%m-01", "day": "%Y-%m-%d"}
+
+
+def _replace_date_trunc(sql):
+    out, pos = [], 0
+    pattern = re.compile(r"date_trunc\s*\(\s*'(\w+)'\s*,", re.IGNORECASE)
+    while True:
+        m = pattern.search(sql, pos)
+        if not m:
+            out.append(sql[pos:])
+            return "".join(out)
+        depth, i = 1, m.end()
+        while i < len(sql) and depth:
+            depth += {"(": 1, ")": -1}.get(sql[i], 0)
+            i += 1
+        expr = _replace_date_trunc(sql[m.end():i - 1].strip())
+        unit = m.group(1).lower()
+        if unit == "week":
+            replacement = f"date({expr}, 'weekday 1', '-7 days')"
+        else:
+            replacement = f"strftime('{_TRUNC_FORMATS.get(unit, '%Y-%m-%d')}', {expr})"
+        out.append(sql[pos:m.start()] + replacement)
+        pos = i
+
+
+def translate_sql(sql):
+    s = re.sub(r"::\s*\w+", "", sql)
+    s = re.sub(r"\bCURRENT_DATE\b", "date('now')", s, flags=re.IGNORECASE)
+    s = re.sub(r"\bNOW\(\)", "datetime('now')", s, flags=re.IGNORECASE)
+    s = _INTERVAL.sub(lambda m: f"date({m.group(1)}, '{m.group(2)}{m.group(3)} {m.group(4)}')", s)
+    s = _EXTRACT.sub(lambda m: f"CAST(strftime('{_EXTRACT_FORMATS[m.group(1).lower()]}', {m.group(2)}) AS INTEGER)", s)
+    s = _replace_date_trunc(s)
+    s = re.sub(r"\bILIKE\b", "LIKE", s, flags=re.IGNORECASE)
+    return s
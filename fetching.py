@@ -1,24 +1,40 @@
 # retrieve.py
+import asyncio
+import contextvars
 import json
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request
-from supabase import create_client, Client
-from dotenv import load_dotenv
-import numpy as np
+from fastapi.responses import StreamingResponse
 from embeddingCreation import get_gemini_embedding  
-from llmResponse import get_llm_answer, build_context_from_records, classify_query_intent, generate_sql_from_query  # your LLM function
-
-load_dotenv()
-SUPABASE_URL: str = os.getenv("SUPABASE_URL")
-SUPABASE_KEY: str = os.getenv("SUPABASE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Supabase credentials not found in .env")
-
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+from embeddingCache import embedding_cache
+from vectorStore import get_backend
+from answerCache import answer_cache, context_digest, ANSWER_CACHE_ENABLED
+from sqlPlanCache import get_sql_plan_cache
+from queryParser import parse_query
+from sessionMemory import session_memory, session_key
+from rollups import get_rollup_store, describe, ROLLUPS_ENABLED, ROLLUP_TEMPLATE_ANSWERS
+import contextBuilder
+from analytics import analyze, facts_to_text
+from hybridRetrieval import hybrid_retrieve
+import metrics
+from structuredLog import log_event, preview_rows, LOG_PREVIEW_CHARS
+from llmResponse import get_llm_answer, stream_llm_answer, classify_query_intent, generate_sql_from_query  # your LLM function
+
+from clients import supabase, genai, lazy  # shared lazy clients
+
+retrieval_backend = lazy(lambda: get_backend(supabase))  # built on first use, or warmed by main's lifespan
+rollup_store = lazy(get_rollup_store)
+sql_plan_cache = lazy(get_sql_plan_cache)  # reads its file on first use
 
 app = FastAPI(title="RAG Retrieval API")
 
+# blocking Supabase/Gemini calls of /retrieve run here, off the event loop
+RETRIEVE_CONCURRENCY = int(os.getenv("RETRIEVE_CONCURRENCY", "32"))
+_executor = ThreadPoolExecutor(max_workers=RETRIEVE_CONCURRENCY, thread_name_prefix="retrieve")
+
 def _sanitize_sql(sql: str) -> str:
     """Remove markdown fences, language tags, trailing semicolon and whitespace."""
     if not sql:
@@ -29,33 +45,15 @@ def _sanitize_sql(sql: str) -> str:
     s = s.rstrip().rstrip(";")
     return s.strip()
 
+@metrics.timed("match")
 def match_documents_online(query_embedding, userId, accountId, top_k=5):
     """
-    Query Supabase (pgvector) for top-K embeddings matching query_embedding,
-    filtered by userId and accountId.
+    Top-K embeddings matching query_embedding, filtered by userId and accountId.
+    Served by the configured retrieval backend (Supabase pgvector RPC or the local index).
     """
-    # np array to pgvector list
-    if isinstance(query_embedding, np.ndarray):
-        query_embedding = query_embedding.tolist()
-    emb_str = "[" + ",".join([str(x) for x in query_embedding]) + "]"
-
-    
-    res = supabase.rpc(
-        "match_embeddings",
-        {
-            "query_embedding": query_embedding,
-            "user_id": userId,
-            "account_id": accountId,
-            "top_k": top_k
-        }
-    ).execute()
-
-    if hasattr(res, "error") and res.error:
-        raise Exception(f"Supabase RPC error: {res.error}")
-    if isinstance(res, dict) and "error" in res and res["error"]:
-        raise Exception(f"Supabase RPC error: {res['error']}")
-    data = res.data
-    return data
+    docs = retrieval_backend.match(query_embedding, userId, accountId, top_k=top_k)
+    metrics.count(metrics.ROWS_RETURNED, len(docs or []), stage="match")
+    return docs
 
 # # FastAPI endpoint
 # # ------------ FIX: PERIOD-AWARE SEMANTIC FETCHING ------------
@@ -216,90 +214,293 @@ def semantic_period_fetch(query, user_id, account_id):
 
     return rows
 
-@app.post("/retrieve")
-async def retrieve(request: Request):
-    data = await request.json()
+def _cache_lookup(user_id, account_id, query, session, query_embedding):
+    """
+    Answer-cache lookup. Returns (cached or None, token); the token is the data version and
+    session-context digest the answer is cached under by _cache_answer.
+    """
+    token = (answer_cache.current_version(user_id), context_digest(query, session_memory.history(session)))
+    cached = answer_cache.get(user_id, account_id, query, query_embedding, version=token[0], context=token[1])
+    return cached, token
+
+def _cache_answer(user_id, account_id, query, response, token, embedding_future=None):
+    """Remember a successful response, with the query embedding so paraphrases hit too."""
+    if not ANSWER_CACHE_ENABLED or not response.get("answer") or token is None or token[0] is None:
+        return
+    if embedding_future is not None:
+        embedding = embedding_future.result()
+    else:
+        embedding = get_gemini_embedding(query, dim=384)
+    answer_cache.put(user_id, account_id, query, response, query_embedding=embedding,
+                     version=token[0], context=token[1])
+
+@app.get("/cache/embeddings")
+def embedding_cache_stats():
+    return embedding_cache.stats()
+
+@app.get("/cache/answers")
+def answer_cache_stats():
+    return answer_cache.stats()
+
+@app.get("/cache/sql-plans")
+def sql_plan_cache_stats():
+    return sql_plan_cache.stats()
+
+@app.get("/context")
+def context_stats():
+    return contextBuilder.stats()
+
+@app.get("/sessions")
+def session_stats():
+    return session_memory.stats()
+
+@app.get("/rollups")
+def rollup_stats():
+    return rollup_store.stats()
+
+def _rollup_response(query, parsed, user_id, account_id, session):
+    """/retrieve's analytical response computed from the monthly rollups, or None to take the SQL path."""
+    if not ROLLUPS_ENABLED or parsed is None:
+        return None
+    with metrics.span("rollup"):
+        rows = rollup_store.answer(parsed, user_id, account_id)
+    if rows is None:
+        return None
+    log_event("rollup.hit", aggregate=parsed.aggregate, value=next(iter(rows[0].values())))
+    if ROLLUP_TEMPLATE_ANSWERS:
+        answer = describe(parsed, rows[0])
+        if session:
+            session_memory.append(session, query, answer)
+    else:
+        answer = get_llm_answer(query, rows, session=session)
+    # sql_query is what the SQL path would have run, for clients that display it
+    return {"mode": "analytical", "query": query, "sql_query": parsed.to_sql(), "sql_source": "rollup",
+            "raw_result": rows, "answer": answer}
+
+@metrics.timed("sql_plan")
+def _resolve_sql(query, parsed=None):
+    """(sanitized SQL, source) for an analytical question."""
+    # 🔹 Common question shapes → rule-based parser, then learned SQL templates, then the LLM
+    parsed = parsed or parse_query(query)
+    sql_query, sql_source = None, "llm"
+    if parsed.confident:
+        sql_query, sql_source = parsed.to_sql(), "parser"
+    else:
+        log_event("sql.parser_unsure", confidence=parsed.confidence, reasons=parsed.reasons)
+        sql_query = sql_plan_cache.lookup(query)
+        if sql_query:
+            sql_source = "plan_cache"
+    if not sql_query:
+        sql_query = generate_sql_from_query(query, table_name="transactions")
+
+    sql_query = _sanitize_sql(sql_query)
+    log_event("sql.plan", source=sql_source, sql=sql_query)
+    if not sql_query.lower().startswith("select"):
+        raise ValueError("Only SELECT queries are allowed.")
+    return sql_query, sql_source
+
+@metrics.timed("execute_sql")
+def _run_sql(query, sql_query, sql_source, user_id, account_id):
+    """Execute through execute_sql_wrapper (which adds the user/account filters) and return rows."""
+    payload = {
+        "query": sql_query,
+        "user_id": user_id,
+        "account_id": account_id
+    }
+    log_event("sql.execute", user_id=user_id, account_id=account_id)
+    exec_res = supabase.rpc("execute_sql_wrapper", payload).execute()
+
+    if isinstance(exec_res, dict):
+        err = exec_res.get("error")
+        data = exec_res.get("data")
+    else:
+        err = getattr(exec_res, "error", None)
+        data = getattr(exec_res, "data", None)
+
+    if err:
+        raise Exception(f"Supabase execute_sql RPC error: {err}")
+    if sql_source == "llm":
+        sql_plan_cache.learn(query, sql_query)
+
+    if data is None:
+        result_rows = []
+    elif isinstance(data, str):
+        try:
+            result_rows = json.loads(data)
+        except Exception:
+            result_rows = [data]
+    elif isinstance(data, (list, tuple)):
+        result_rows = list(data)
+    else:
+        result_rows = [data]
+
+    # 🔹 Row count plus a capped preview; the full result set is never serialized for logging
+    log_event("sql.rows", count=len(result_rows), preview=preview_rows(result_rows))
+    metrics.count(metrics.ROWS_RETURNED, len(result_rows), stage="execute_sql")
+    return result_rows
+
+def _comparative_facts(query, rows):
+    """Locally computed comparison facts for comparative questions, else (None, None)."""
+    try:
+        facts = analyze(query, rows)
+    except Exception as e:
+        log_event("analytics.failed", logging.WARNING, error=str(e))
+        return None, None
+    return (facts, facts_to_text(facts)) if facts else (None, None)
+
+def _retrieve_documents(query, user_id, account_id, top_k, query_embedding=None, parsed=None):
+    if query_embedding is None:
+        query_embedding = get_gemini_embedding(query, dim=384)
+    # 🔹 Dates/categories/amounts in the question → rank only the transactions that match them
+    try:
+        with metrics.span("hybrid"):
+            docs = hybrid_retrieve(supabase, retrieval_backend, query, query_embedding, parsed or parse_query(query),
+                                   user_id, account_id, top_k=top_k)
+    except Exception as e:
+        log_event("hybrid.failed", logging.WARNING, error=str(e))
+        docs = None
+    if docs is not None:
+        # an empty list means no transaction passes the filters; an unfiltered match would answer
+        # "food in march" with whatever else is nearest, so the answer step gets no records instead
+        log_event("hybrid.documents", count=len(docs))
+        metrics.count(metrics.ROWS_RETURNED, len(docs), stage="hybrid")
+        return docs
+    return match_documents_online(query_embedding, user_id, account_id, top_k=top_k)
+
+def _is_hybrid(parsed):
+    """
+    Analytical questions that also benefit from vector retrieval: free-text description
+    terms ("my goa trip"), or shapes the parser couldn't pin down, where the matched
+    documents are the fallback if the generated SQL fails or finds nothing.
+    """
+    return bool(parsed.keywords) or not parsed.confident
+
+def _submit(fn, *args, **kwargs):
+    """Submit to the retrieve executor, carrying the request's metrics context along."""
+    return _executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+async def _offload(fn, *args, **kwargs):
+    """Run a blocking SDK call on the bounded retrieve executor."""
+    return await asyncio.wrap_future(_submit(fn, *args, **kwargs))
+
+def _parse_request(data):
     query = data.get("query")
     user_id = data.get("userid", "2896d2d5-915e-463b-85c5-fe1dcd141486")
     account_id = data.get("accountid", "ba67685c-4878-4d5c-bb0f-75bcdb4c763b")
     top_k = data.get("top_k", 5)
+    # conversation history is kept per user and chat session (sessionMemory)
+    session = session_key(user_id, data.get("session_id"))
+    return query, user_id, account_id, top_k, session
+
+@app.post("/retrieve")
+async def retrieve(request: Request):
+    metrics.begin_request("retrieve")
+    response = await _retrieve(request)
+    metrics.end_request("error" if response.get("status") else "cache" if response.get("cache") else "ok")
+    return response
+
+async def _retrieve(request):
+    """
+    Stages run as a small DAG on the retrieve executor:
+
+        classify ─┬─ embedding (speculative) ─┬─ answer cache ─┐
+                  │                           └─ vector match ─┼─ LLM answer
+                  └─ SQL plan ── execute_sql ──────────────────┘
+
+    The query embedding starts as soon as the request is classified, so the answer-cache
+    lookup, the vector match and the final cache write reuse it. For hybrid analytical
+    questions the SQL branch and the vector branch run side by side.
+    """
+    data = await request.json()
+    query, user_id, account_id, top_k, session = _parse_request(data)
 
     if not query or not user_id or not account_id:
         return {"status": "Missing required fields: query, userId, accountId"}
 
+    embedding_future = None
     try:
-        
         intent = classify_query_intent(query)
-        print(f"Detected intent: {intent}")
+        metrics.set_intent(intent)
+        log_event("retrieve.intent", intent=intent)
+        parsed = parse_query(query) if intent == "analytical" else None
+        hybrid = parsed is not None and _is_hybrid(parsed)
+
+        # 🔹 Simple totals / counts / averages straight from the rollups: no embedding, SQL or LLM round trip
+        if parsed is not None and not hybrid:
+            response = await _offload(_rollup_response, query, parsed, user_id, account_id, session)
+            if response:
+                return response
+
+        if ANSWER_CACHE_ENABLED or intent != "analytical" or hybrid:
+            embedding_future = _submit(get_gemini_embedding, query, dim=384)
+
+        # 🔹 Answer cache: exact query first, then paraphrases (waits for the embedding only on exact miss)
+        cache_token = None
+        if ANSWER_CACHE_ENABLED:
+            with metrics.span("answer_cache"):
+                cached, cache_token = await _offload(_cache_lookup, user_id, account_id, query, session,
+                                                     embedding_future.result)
+            if cached:
+                response, kind = cached
+                log_event("answer_cache.hit", kind=kind)
+                return {**response, "cache": kind}
+
+        async def documents():
+            query_embedding = await asyncio.wrap_future(embedding_future)
+            return await _offload(_retrieve_documents, query, user_id, account_id, top_k, query_embedding, parsed)
 
         
         if intent == "analytical":
-            sql_query = generate_sql_from_query(query, table_name="transactions")
-
-            print("Generated SQL:", sql_query)
-
-            sql_query = _sanitize_sql(sql_query)
-
-            
-            print("Sanitized SQL:", sql_query)
-            if not sql_query.lower().startswith("select"):
-                raise ValueError("Only SELECT queries are allowed.")
-            userid = user_id
-            accountid = account_id
-            payload = {
-                "query": sql_query,
-                "user_id": userid,
-                "account_id": accountid
-            }
-            print("Calling execute_sql with payload:", payload)
-            exec_res = supabase.rpc("execute_sql_wrapper", payload).execute()
-
-            
-            if isinstance(exec_res, dict):
-                err = exec_res.get("error")
-                data = exec_res.get("data")
-            else:
-                err = getattr(exec_res, "error", None)
-                data = getattr(exec_res, "data", None)
-
-            if err:
-                raise Exception(f"Supabase execute_sql RPC error: {err}")
-            
-            result_rows = []
-            if data is None:
-                result_rows = []
-            elif isinstance(data, str):
-                try:
-                    result_rows = json.loads(data)
-                except Exception:
-                    result_rows = [data]
-            elif isinstance(data, (list, tuple)):
-                result_rows = list(data)
+            async def sql_branch():
+                sql_query, sql_source = await _offload(_resolve_sql, query, parsed)
+                rows = await _offload(_run_sql, query, sql_query, sql_source, user_id, account_id)
+                return sql_query, sql_source, rows
+
+            if hybrid:
+                sql_result, top_docs = await asyncio.gather(sql_branch(), documents(), return_exceptions=True)
+                if isinstance(top_docs, Exception):
+                    log_event("hybrid.vector_failed", logging.WARNING, error=str(top_docs))
+                    top_docs = None
+                if isinstance(sql_result, Exception):
+                    if not top_docs:
+                        raise sql_result
+                    # the SQL branch failed; the documents fetched alongside it still answer the question
+                    log_event("hybrid.sql_failed", logging.WARNING, error=str(sql_result))
+                    answer = await _offload(get_llm_answer, query, top_docs, session=session)
+                    response = {"mode": "semantic", "query": query, "answer": answer,
+                                "top_k_results": top_docs, "fallback_from": "analytical"}
+                    await _offload(_cache_answer, user_id, account_id, query, response, cache_token,
+                                   embedding_future)
+                    return response
             else:
-                result_rows = [data]
+                sql_result, top_docs = await sql_branch(), None
+            sql_query, sql_source, result_rows = sql_result
+
+            # 🔹 Comparisons are computed here; the LLM only phrases the numbers
+            facts, facts_text = _comparative_facts(query, result_rows)
+            context_rows = result_rows if result_rows or not top_docs else top_docs
 
-            
-            try:
-                summary_text = build_context_from_records(result_rows)
-            except Exception:
-                
-                summary_text = json.dumps(result_rows, default=str, indent=2)
-            print("SQL query result rows:", len(result_rows))
-            print(result_rows)
             answer = ""
             try:
-                answer = get_llm_answer(query, result_rows)
+                answer = await _offload(get_llm_answer, query, context_rows, session=session, facts=facts_text)
             except Exception as e:
-                print("LLM call failed for analytical route:", e)
+                log_event("llm.failed", logging.WARNING, route="analytical", error=str(e))
                 answer = ""
 
-            return {
+            response = {
                 "mode": "analytical",
                 "query": query,
                 "sql_query": sql_query,
+                "sql_source": sql_source,
                 "raw_result": result_rows,
                 "answer": answer
             }
+            if facts:
+                response["analytics"] = facts
+            if top_docs:
+                response["top_k_results"] = top_docs
+            await _offload(_cache_answer, user_id, account_id, query, response, cache_token, embedding_future)
+            return response
         else:
             # userid = user_id
             # accountid = account_id
@@ -318,21 +519,143 @@ async def retrieve(request: Request):
             #     }
 
             #Semantic route
-            query_embedding = get_gemini_embedding(query, dim=384)
-            top_docs = match_documents_online(query_embedding, user_id, account_id, top_k=top_k)
-            answer = get_llm_answer(query, top_docs)
+            top_docs = await documents()
+            answer = await _offload(get_llm_answer, query, top_docs, session=session)
 
-            print("llm answer: \n", answer)
+            log_event("llm.answer", chars=len(answer or ""), preview=(answer or "")[:LOG_PREVIEW_CHARS])
 
-            return {
+            response = {
                 "mode": "semantic",
                 "query": query,
                 "answer": answer,
                 "top_k_results": top_docs
             }
+            await _offload(_cache_answer, user_id, account_id, query, response, cache_token, embedding_future)
+            return response
 
     except Exception as e:
         return {"status": "error", "error": str(e)}
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _ms_since(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def _stream_retrieve(query, user_id, account_id, top_k, session):
+    """
+    Server-Sent Events for one question, in the order the work finishes:
+    intent → (cached | sql [analytics] [documents] | documents) → token* → done, or error
+    at any point. As in /retrieve, the query embedding and, for semantic or hybrid
+    questions, the vector match are started before the SQL stage and run alongside it.
+    The final `done` event carries the same JSON body /retrieve would have returned,
+    plus per-stage timings in milliseconds.
+    """
+    started = time.perf_counter()
+    timings = {}
+    try:
+        intent = classify_query_intent(query)
+        metrics.set_intent(intent)
+        timings["intent_ms"] = _ms_since(started)
+        yield _sse("intent", {"mode": intent, "elapsed_ms": timings["intent_ms"]})
+
+        parsed = parse_query(query) if intent == "analytical" else None
+        hybrid = parsed is not None and _is_hybrid(parsed)
+        if parsed is not None and not hybrid:
+            response = _rollup_response(query, parsed, user_id, account_id, session)
+            if response:
+                timings["query_ms"] = _ms_since(started)
+                sql_event = {k: v for k, v in response.items() if k != "answer"}
+                yield _sse("sql", {**sql_event, "elapsed_ms": timings["query_ms"]})
+                yield _sse("token", {"text": response["answer"]})
+                timings["total_ms"] = _ms_since(started)
+                metrics.end_request("ok")
+                yield _sse("done", {**response, "timings": timings})
+                return
+        embedding_future = docs_future = None
+        if ANSWER_CACHE_ENABLED or intent != "analytical" or hybrid:
+            embedding_future = _submit(get_gemini_embedding, query, dim=384)
+
+        cache_token = None
+        if ANSWER_CACHE_ENABLED:
+            with metrics.span("answer_cache"):
+                cached, cache_token = _cache_lookup(user_id, account_id, query, session, embedding_future.result)
+            if cached:
+                response, kind = cached
+                timings["total_ms"] = _ms_since(started)
+                metrics.end_request("cache")
+                yield _sse("done", {**response, "cache": kind, "timings": timings})
+                return
+
+        if intent != "analytical" or hybrid:
+            docs_future = _submit(
+                lambda: _retrieve_documents(query, user_id, account_id, top_k, embedding_future.result(), parsed))
+
+        facts_text, records, response = None, [], None
+        if intent == "analytical":
+            try:
+                sql_query, sql_source = _resolve_sql(query, parsed)
+                timings["sql_ms"] = _ms_since(started)
+                records = _run_sql(query, sql_query, sql_source, user_id, account_id)
+            except Exception as e:
+                if docs_future is None:
+                    raise
+                log_event("hybrid.sql_failed", logging.WARNING, error=str(e))
+                sql_query = None
+            if sql_query is not None:
+                timings["query_ms"] = _ms_since(started)
+                response = {"mode": "analytical", "query": query, "sql_query": sql_query,
+                            "sql_source": sql_source, "raw_result": records}
+                yield _sse("sql", {**response, "elapsed_ms": timings["query_ms"]})
+                facts, facts_text = _comparative_facts(query, records)
+                if facts:
+                    response["analytics"] = facts
+                    timings["analytics_ms"] = _ms_since(started)
+                    yield _sse("analytics", facts)
+            else:
+                response = {"mode": "semantic", "query": query, "fallback_from": "analytical"}
+                records = []
+
+        if docs_future is not None:
+            top_docs = docs_future.result()
+            timings["retrieval_ms"] = _ms_since(started)
+            response = response if intent == "analytical" else {"mode": "semantic", "query": query}
+            response["top_k_results"] = top_docs
+            yield _sse("documents", {"top_k_results": top_docs, "elapsed_ms": timings["retrieval_ms"]})
+            if not records:
+                records = top_docs
+        parts = []
+        for text in stream_llm_answer(query, records, session=session, facts=facts_text):
+            if not parts:
+                timings["first_token_ms"] = _ms_since(started)
+            parts.append(text)
+            yield _sse("token", {"text": text})
+        response["answer"] = "".join(parts).strip()
+        timings["total_ms"] = _ms_since(started)
+
+        _cache_answer(user_id, account_id, query, response, cache_token, embedding_future)
+        metrics.end_request("ok")
+        yield _sse("done", {**response, "timings": timings})
+    except Exception as e:
+        metrics.end_request("error")
+        yield _sse("error", {"status": "error", "error": str(e), "timings": timings})
+
+@app.post("/retrieve/stream")
+async def retrieve_stream(request: Request):
+    data = await request.json()
+    query, user_id, account_id, top_k, session = _parse_request(data)
+
+    if not query or not user_id or not account_id:
+        return {"status": "Missing required fields: query, userId, accountId"}
+
+    metrics.begin_request("retrieve_stream")
+    # a sync generator: Starlette iterates it in the threadpool, so the blocking
+    # Supabase/Gemini calls don't stall the event loop
+    return StreamingResponse(
+        _stream_retrieve(query, user_id, account_id, top_k, session),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 #Fpr local testin
 # if __name__ == "__main__":
 #     import uvicorn
@@ -0,0 +1,166 @@
+# hybridRetrieval.py
+"""
+Hybrid retrieval: structured pre-filter, then vector and keyword ranking inside it.
+
+For a question like "what were my large travel expenses in October" the query parser
+already knows the structured part (category travel, month 10, type EXPENSE). Instead
+of choosing between all-SQL and all-vector, one plan runs:
+
+1. match    the match_filtered_embeddings RPC runs the parser's filter, the pgvector
+            ORDER BY embedding <=> query and the limit as one query, returning the
+            HYBRID_RERANK_CANDIDATES nearest transactions that pass the filter.
+            Backends that keep raw vectors (local index) instead get the ids from
+            execute_sql_wrapper (at most HYBRID_MAX_CANDIDATES) and score them in memory.
+2. rank     cosine similarity to the query embedding, plus BM25 over chunk_text,
+            fused with reciprocal rank fusion (HYBRID_BM25_WEIGHT, 0 = vectors only).
+
+hybrid_retrieve() returns None when the question has no structured filter, or when the
+parse isn't confident (a stray "may" or "rent" in a semantic question is no reason to
+drop recall), so the caller falls back to the plain top-k vector match; it returns []
+when nothing passes a trusted filter.
+"""
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from vectorCodec import encode_vector
+
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") != "0"
+HYBRID_MAX_CANDIDATES = int(os.getenv("HYBRID_MAX_CANDIDATES", "2000"))
+HYBRID_RERANK_CANDIDATES = int(os.getenv("HYBRID_RERANK_CANDIDATES", "50"))
+HYBRID_BM25_WEIGHT = float(os.getenv("HYBRID_BM25_WEIGHT", "0.5"))
+RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_QUERY_STOPWORDS = set("""
+a an the i me my we our you your is are was were be been do did does have has had how much many what which
+when where who why show list give tell of on in for at to from by with and or this that these those last
+past previous current than more less over under above below spent spend spending expense expenses
+transaction transactions money amount paid total all any
+""".split())
+
+
+def tokenize(text):
+    return _TOKEN.findall(str(text).lower())
+
+
+def bm25_scores(query, documents, k1=BM25_K1, b=BM25_B):
+    """BM25 of each document (a string) against the query terms; zeros when nothing matches."""
+    terms = [t for t in dict.fromkeys(tokenize(query)) if t not in _QUERY_STOPWORDS]
+    scores = np.zeros(len(documents), dtype=np.float64)
+    if not terms or not documents:
+        return scores
+    docs = [Counter(tokenize(d)) for d in documents]
+    lengths = np.array([sum(c.values()) for c in docs], dtype=np.float64)
+    avg_len = lengths.mean() or 1.0
+    norm = k1 * (1 - b + b * lengths / avg_len)
+    n = len(docs)
+    for term in terms:
+        tf = np.array([c.get(term, 0) for c in docs], dtype=np.float64)
+        df = int(np.count_nonzero(tf))
+        if df == 0:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        scores += idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def _ranks(scores):
+    """1-based rank of each score, best first."""
+    order = np.argsort(-scores, kind="stable")
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[order] = np.arange(1, len(scores) + 1)
+    return ranks
+
+
+def fuse(vector_scores, keyword_scores, keyword_weight=HYBRID_BM25_WEIGHT):
+    """Reciprocal rank fusion; documents without a keyword match get no keyword term."""
+    fused = 1.0 / (RRF_K + _ranks(vector_scores))
+    if keyword_weight > 0 and keyword_scores.any():
+        bonus = keyword_weight / (RRF_K + _ranks(keyword_scores))
+        fused = fused + np.where(keyword_scores > 0, bonus, 0.0)
+    return fused
+
+
+def _rpc_rows(res):
+    err = getattr(res, "error", None)
+    if err:
+        raise Exception(f"Supabase RPC error: {err}")
+    rows = res.data or []
+    if isinstance(rows, str):
+        rows = json.loads(rows)
+    return [r for r in rows if isinstance(r, dict)]
+
+
+def _candidate_ids(client, parsed, user_id, account_id, limit):
+    res = client.rpc("execute_sql_wrapper", {
+        "query": parsed.filter_sql(limit),
+        "user_id": user_id,
+        "account_id": account_id,
+    }).execute()
+    return [r["id"] for r in _rpc_rows(res) if r.get("id")]
+
+
+def _nearest_filtered(client, query_embedding, parsed, user_id, account_id, limit):
+    """(doc, similarity) for the nearest transactions passing the filter, from one pgvector query."""
+    res = client.rpc("match_filtered_embeddings", {
+        "query_vector": encode_vector(query_embedding),
+        "filter_query": parsed.filter_sql(),
+        "user_id": user_id,
+        "account_id": account_id,
+        "top_k": limit,
+    }).execute()
+    rows = _rpc_rows(res)
+    return [({k: v for k, v in r.items() if k != "similarity"}, float(r.get("similarity") or 0.0)) for r in rows]
+
+
+def _nearest_in_memory(client, backend, query_embedding, parsed, user_id, account_id, limit):
+    """Same as _nearest_filtered, scored against the vectors a local backend keeps."""
+    ids = _candidate_ids(client, parsed, user_id, account_id, limit)
+    pairs = backend.vectors_for(ids, user_id, account_id) if ids else []
+    if not pairs:
+        return []
+    matrix = np.asarray([vec for _, vec in pairs], dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    q = np.asarray(query_embedding, dtype=np.float32)
+    q /= max(float(np.linalg.norm(q)), 1e-12)
+    return [(doc, float(sim)) for (doc, _), sim in zip(pairs, matrix @ q)]
+
+
+def hybrid_retrieve(client, backend, query, query_embedding, parsed, user_id, account_id, top_k=5,
+                    max_candidates=HYBRID_MAX_CANDIDATES, keyword_weight=HYBRID_BM25_WEIGHT):
+    """
+    Top-k documents (match_embeddings row shape plus "bm25" and "score") among the
+    transactions passing the question's structured filters; [] when none pass them, and
+    None when the question has no filters or its parse isn't confident.
+    """
+    if not HYBRID_RETRIEVAL or parsed is None or not parsed.confident or not parsed.has_filters():
+        return None
+
+    if backend.keeps_vectors:
+        scored = _nearest_in_memory(client, backend, query_embedding, parsed, user_id, account_id, max_candidates)
+    else:
+        scored = _nearest_filtered(client, query_embedding, parsed, user_id, account_id,
+                                   max(HYBRID_RERANK_CANDIDATES, top_k))
+    if not scored:
+        return []
+
+    docs = [doc for doc, _ in scored]
+    similarity = np.asarray([sim for _, sim in scored], dtype=np.float64)
+    keyword = bm25_scores(query, [d.get("chunk_text") or "" for d in docs])
+    fused = fuse(similarity, keyword, keyword_weight)
+
+    k = min(top_k, len(docs))
+    best = np.argpartition(-fused, k - 1)[:k]
+    best = best[np.argsort(-fused[best], kind="stable")]
+    return [
+        {**docs[i], "similarity": float(similarity[i]), "bm25": round(float(keyword[i]), 4),
+         "score": round(float(fused[i]), 6)}
+        for i in best
+    ]
@@ -0,0 +1,170 @@
+# ingestQueue.py
+"""
+Durable, SQLite-backed queue for webhook events.
+
+The webhook handler only appends the validated payload here and returns; a consumer
+pool in worker.py claims events, processes them and either acks them, schedules a
+retry with backoff, or moves them to the dead-letter table after too many attempts.
+Claimed events carry a lease, so events held by a crashed process become visible again.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+QUEUE_DB = os.getenv("INGEST_QUEUE_DB", "ingest_queue.db")
+LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "300"))
+
+
+@dataclass
+class Job:
+    id: int
+    payload: dict
+    attempts: int
+    enqueued_at: float
+
+
+class IngestQueue:
+    def __init__(self, path=QUEUE_DB, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                leased_until REAL,
+                enqueued_at REAL NOT NULL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS events_available ON events (available_at);
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                error TEXT
+            );
+        """)
+
+    def put(self, payload):
+        now = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO events (payload, available_at, enqueued_at) VALUES (?, ?, ?)",
+                (json.dumps(payload, default=str), now, now),
+            )
+            return cur.lastrowid
+
+    def claim(self, limit=1):
+        """Lease up to `limit` due events. Expired leases are reclaimable."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.conn.execute(
+                    """SELECT id, payload, attempts, enqueued_at FROM events
+                       WHERE available_at <= ? AND (leased_until IS NULL OR leased_until < ?)
+                       ORDER BY id LIMIT ?""",
+                    (now, now, limit),
+                ).fetchall()
+                if rows:
+                    self.conn.executemany(
+                        "UPDATE events SET leased_until = ? WHERE id = ?",
+                        [(now + self.lease_seconds, r[0]) for r in rows],
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return [Job(r[0], json.loads(r[1]), r[2], r[3]) for r in rows]
+
+    def ack(self, job_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM events WHERE id = ?", (job_id,))
+
+    def retry(self, job_id, error, delay):
+        with self.lock:
+            self.conn.execute(
+                """UPDATE events SET attempts = attempts + 1, available_at = ?,
+                   leased_until = NULL, last_error = ? WHERE id = ?""",
+                (time.time() + delay, str(error), job_id),
+            )
+
+    def dead_letter(self, job_id, error):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    """INSERT OR REPLACE INTO dead_letters (id, payload, attempts, enqueued_at, failed_at, error)
+                       SELECT id, payload, attempts + 1, enqueued_at, ?, ? FROM events WHERE id = ?""",
+                    (time.time(), str(error), job_id),
+                )
+                self.conn.execute("DELETE FROM events WHERE id = ?", (job_id,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def requeue_dead_letters(self):
+        """Move every dead-lettered event back onto the queue with a fresh attempt count."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self.conn.execute(
+                    """INSERT INTO events (payload, available_at, enqueued_at)
+                       SELECT payload, ?, enqueued_at FROM dead_letters""",
+                    (now,),
+                )
+                self.conn.execute("DELETE FROM dead_letters")
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            return cur.rowcount
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            pending, in_flight, oldest = self.conn.execute(
+                """SELECT
+                       COALESCE(SUM(CASE WHEN leased_until IS NULL OR leased_until < ? THEN 1 ELSE 0 END), 0),
+                       COALESCE(SUM(CASE WHEN leased_until >= ? THEN 1 ELSE 0 END), 0),
+                       MIN(enqueued_at)
+                   FROM events""",
+                (now, now),
+            ).fetchone()
+            dead = self.conn.execute("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+        return {
+            "pending": pending,
+            "in_flight": in_flight,
+            "dead_letters": dead,
+            "oldest_age_seconds": round(now - oldest, 3) if oldest else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_ingest_queue():
+    """Process-wide queue, opened on first use rather than at import."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = IngestQueue()
+    return _queue
@@ -1,13 +1,15 @@
-import os
-from dotenv import load_dotenv
-import google.generativeai as genai 
+import metrics
+from structuredLog import log_event
+from clients import get_model, generate_options  # shared lazy Gemini client
+from sessionMemory import session_memory
+from contextBuilder import build_context, estimate_tokens
 
-load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in .env")
 
-genai.configure(api_key=GEMINI_API_KEY)
+def _count_prompt(call, prompt):
+    metrics.count(metrics.PROMPT_CHARS, len(prompt), call=call)
+    metrics.count(metrics.PROMPT_TOKENS, estimate_tokens(prompt), call=call)
+
+@metrics.timed("generate_sql")
 def generate_sql_from_query(user_query, table_name="transactions"):
     schema_hint = """
 You are generating SQL for the following PostgreSQL table:
@@ -138,10 +140,12 @@ Q: "how much did i spend on goa trip?"
     """
 
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    response = model.generate_content(prompt)
+    model = get_model("gemini-2.0-flash")
+    _count_prompt("generate_sql", prompt)
+    response = model.generate_content(prompt, request_options=generate_options())
     return response.text.strip()
 
+@metrics.timed("classify")
 def classify_query_intent(user_query: str) -> str:
     query = user_query.lower()
 
@@ -168,24 +172,14 @@ def classify_query_intent(user_query: str) -> str:
 
 def build_context_from_records(records):
     """
-    Convert list of record dictionaries into a clean, readable text format for the LLM.
+    Convert list of record dictionaries into a compact, token-budgeted text for the LLM
+    (projected CSV, pre-aggregated with NumPy when the rows don't fit; see contextBuilder).
     """
-    if not records:
-        return "No records were found."
-
-    if isinstance(records, dict):
-        records = [records]
-
-    context_lines = []
-    for i, rec in enumerate(records, 1):
-        if isinstance(rec, dict):
-            line = ", ".join(f"{k}: {v}" for k, v in rec.items())
-        else:
-            line = str(rec)
-        context_lines.append(f"Record {i}: {line}")
-
-    return "\n".join(context_lines)
-conversation_history = [] 
+    built = build_context(records)
+    if built.rows:
+        log_event("context.built", rows=built.rows, rows_included=built.rows_included, tokens=built.tokens,
+                  tokens_saved=built.tokens_saved, aggregated=built.aggregated)
+    return built.text
 # def get_llm_answer(user_query, records):
 #     global conversation_history
 #     """
@@ -255,13 +249,26 @@ conversation_history = []
 #     conversation_history.append({"user": user_query, "assistant": answer})
 
 #     return answer
-def get_llm_answer(user_query, records):
-    global conversation_history
+ANSWER_FALLBACK = "I can help with that. Could you clarify your question a bit?"
 
-    trimmed_history = conversation_history[-5:] 
-    context = build_context_from_records(records)
 
-    prompt = f"""
+RECORDS_HEADING = """RECORDS YOU MUST USE (CSV, first line is the header):
+If the records begin with a SUMMARY, its totals cover every matching row. Use them for totals instead of adding up the rows listed below it."""
+FACTS_HEADING = """FACTS YOU MUST USE (computed exactly from the user's transactions):
+Do not recompute or adjust these numbers. Explain them in words, naming the categories that drove any change."""
+
+
+def build_answer_prompt(user_query, records, history, facts=None):
+    """
+    The answer prompt shared by get_llm_answer and stream_llm_answer. `facts` is
+    analytics.facts_to_text output; when given it replaces the raw records.
+    """
+    if facts:
+        heading, context = FACTS_HEADING, facts
+    else:
+        heading, context = RECORDS_HEADING, build_context_from_records(records)
+
+    return f"""
 You are a reliable financial assistant. Your answers must always be clear, correct, and based ONLY on the records provided.
 NEVER return an empty answer.
 NEVER say "I don't have data" or "I don't have access to data."
@@ -273,8 +280,8 @@ IMPORTANT FORMAT RULES:
 - Do NOT use bullets, asterisks (*), dashes (-), plus signs (+), or code fences.
 - Write in short, natural sentences.
 
-CONVERSATION HISTORY (last 5 messages):
-{trimmed_history}
+CONVERSATION HISTORY:
+{history}
 
 YOUR SKILLS:
 1. Greeting queries:
@@ -306,7 +313,7 @@ Example query structure:
 USER QUESTION:
 {user_query}
 
-RECORDS YOU MUST USE:
+{heading}
 {context}
 
 Now produce the best possible answer using only these records.
@@ -314,13 +321,53 @@ If the question is comparative, compute totals for each period and explain the d
 Never leave the answer blank.
 """
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    response = model.generate_content(prompt)
-    answer = response.text.strip() if hasattr(response, "text") else str(response)
 
+def _history(session):
+    return session_memory.history(session) if session else "None"
+
+
+def _remember_answer(user_query, answer, session):
     # safety: never return empty answer
     if not answer or not answer.strip():
-        answer = "I can help with that. Could you clarify your question a bit?"
-
-    conversation_history.append({"user": user_query, "assistant": answer})
+        answer = ANSWER_FALLBACK
+    if session:
+        session_memory.append(session, user_query, answer)
     return answer
+
+
+@metrics.timed("llm_answer")
+def get_llm_answer(user_query, records, session=None, facts=None):
+    """`session` is a sessionMemory.session_key; without one the answer has no history."""
+    prompt = build_answer_prompt(user_query, records, _history(session), facts=facts)
+    _count_prompt("answer", prompt)
+
+    model = get_model("gemini-2.0-flash")
+    response = model.generate_content(prompt, request_options=generate_options())
+    answer = response.text.strip() if hasattr(response, "text") else str(response)
+    return _remember_answer(user_query, answer, session)
+
+
+def stream_llm_answer(user_query, records, session=None, facts=None):
+    """
+    Same answer as get_llm_answer, yielded as text chunks while Gemini generates it.
+    The full answer is added to the session's history once the stream ends.
+    """
+    prompt = build_answer_prompt(user_query, records, _history(session), facts=facts)
+    _count_prompt("answer", prompt)
+
+    model = get_model("gemini-2.0-flash")
+    parts = []
+    with metrics.span("llm_answer"):
+        for chunk in model.generate_content(prompt, stream=True, request_options=generate_options()):
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # chunk without text parts (e.g. only safety ratings)
+            if text:
+                parts.append(text)
+                yield text
+
+    answer = "".join(parts).strip()
+    if not answer:
+        yield ANSWER_FALLBACK
+    _remember_answer(user_query, answer, session)
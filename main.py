@@ -1,25 +1,113 @@
+import logging
+import os
+import threading
+import time
+
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from worker import app as worker_app
+from fastapi.responses import JSONResponse, PlainTextResponse
+from worker import app as worker_app, start_consumers, stop_consumers
+from clients import init_clients, close_clients, supabase
 from fetching import app as fetching_app
+from vectorStore import get_backend
+from answerCache import answer_cache
+from trafficCapture import CAPTURE_ENABLED, RequestRecorder, capture_writer
+from structuredLog import log_event, start_logging, stop_logging
+import metrics
+
+# 🔹 Import-time budget: nothing above may build clients or touch the network
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+IMPORT_MS = (time.perf_counter() - _import_started) * 1000
+if IMPORT_MS > IMPORT_BUDGET_MS:
+    log_event("startup.slow_import", logging.WARNING, import_ms=round(IMPORT_MS), budget_ms=round(IMPORT_BUDGET_MS))
+
+# 🔹 Readiness: clients are warmed in a background thread so /live answers immediately
+_startup = {"ready": False, "error": None, "warm_ms": None}
+_warming = threading.Lock()
+
+
+def _warm():
+    started = time.perf_counter()
+    try:
+        init_clients()              # Supabase + Gemini
+        get_backend(supabase)       # retrieval backend (loads the local index, if any)
+        answer_cache.probe_versions()  # data_versions reachable, or fall back to local versions
+        _startup["ready"], _startup["error"] = True, None
+    except Exception as e:
+        _startup["error"] = f"{type(e).__name__}: {e}"
+        log_event("startup.warmup_failed", logging.ERROR, error=_startup["error"])
+    finally:
+        _startup["warm_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        _warming.release()
+
+
+def start_warmup():
+    """Warm the clients in a background thread unless a warm-up is already running."""
+    if _warming.acquire(blocking=False):
+        threading.Thread(target=_warm, name="warm-clients", daemon=True).start()
+
 
-app = FastAPI(title="RAG Full Backend")
+@asynccontextmanager
+async def lifespan(app):
+    # mounted sub-apps don't get lifespan events, so run the webhook consumers from here
+    start_logging()
+    start_warmup()
+    await start_consumers()
+    yield
+    await stop_consumers()
+    close_clients()
+    capture_writer.close()
+    stop_logging()
 
-# CORS 
+
+app = FastAPI(title="RAG Full Backend", lifespan=lifespan)
+
+# CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
-        "http://localhost:3000",  
-        "https://chat-bot-welth.vercel.app",  
+        "http://localhost:3000",
+        "https://chat-bot-welth.vercel.app",
     ],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# 🔹 Opt-in traffic capture (REQUEST_CAPTURE=1) for replay.py
+if CAPTURE_ENABLED:
+    app.add_middleware(RequestRecorder)
+
 app.mount("/webhook", worker_app)   # webhook endpoint: /webhook/webhook
 app.mount("/api", fetching_app)     # retrieval endpoint: /api/retrieve
 
 @app.get("/")
 def root():
-    return {"message": "Backend running successfully!!!!!"}
\ No newline at end of file
+    return {"message": "Backend running successfully!!!!!"}
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Stage latencies, counters and queue gauges in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/live")
+def live():
+    """Liveness: the process is up and serving, whatever the state of its clients."""
+    return {"status": "alive"}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness: 503 until the Supabase/Gemini clients have been built; a failed warm-up is retried."""
+    if _startup["error"]:
+        start_warmup()
+    body = {"status": "ready" if _startup["ready"] else "starting",
+            "import_ms": round(IMPORT_MS, 1), **_startup}
+    if _startup["error"]:
+        body["status"] = "failed"
+    return body if _startup["ready"] else JSONResponse(body, status_code=503)
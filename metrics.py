@@ -0,0 +1,290 @@
+# metrics.py
+"""
+In-process metrics, exported in the Prometheus text format on main.app's /metrics.
+
+Every stage of /api/retrieve and of the webhook consumers runs inside a span():
+
+    classify, answer_cache, rollup, sql_plan, generate_sql, execute_sql, embed, match,
+    hybrid, llm_answer, process_event, rollup_apply
+
+Its latency lands in rag_stage_seconds{stage, route, intent} and its failures in
+rag_stage_errors_total. route and intent come from the request context set by
+begin_request() / set_intent(). It is a contextvar holding one mutable dict, so
+executor threads started with a copied context (fetching._submit) and Starlette's
+threadpool see the intent once it is known. Counters cover rows returned, prompt
+size and embedding calls. Gauges for queue depth are read at scrape time.
+
+A span costs two perf_counter() calls and one locked bucket increment. Set
+METRICS_ENABLED=0 to turn spans and counters into no-ops.
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+STAGE_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+LAG_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900]
+
+
+class Histogram:
+    """Fixed-bucket histogram (cumulative upper bounds, like Prometheus)."""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            cumulative, running = {}, 0
+            for bound, c in zip(self.buckets + ["+Inf"], self.counts):
+                running += c
+                cumulative[str(bound)] = running
+            return {
+                "buckets": cumulative,
+                "count": self.count,
+                "sum": round(self.total, 3),
+                "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            }
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total, count = list(self.counts), self.total, self.count
+        running = 0
+        for bound, c in zip(self.buckets + ["+Inf"], counts):
+            running += c
+            yield f"{name}_bucket", {**labels, "le": str(bound)}, running
+        yield f"{name}_sum", labels, total
+        yield f"{name}_count", labels, count
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class _Family:
+    """One metric name and its children, one per label-value tuple."""
+
+    def __init__(self, name, help_text, kind, labelnames, factory):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.get(key)
+                if child is None:
+                    child = self.children[key] = self.factory()
+        return child
+
+    def samples(self):
+        for key, child in list(self.children.items()):
+            yield from child.samples(self.name, dict(zip(self.labelnames, key)))
+
+
+class _Gauge:
+    """Read at scrape time: fn() returns a number, or {label-value tuple: number}."""
+
+    def __init__(self, name, help_text, fn, labelnames):
+        self.name = name
+        self.help = help_text
+        self.kind = "gauge"
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, v in value.items():
+                yield self.name, dict(zip(self.labelnames, key)), v
+        elif value is not None:
+            yield self.name, {}, value
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def _add(self, family):
+        with self.lock:
+            existing = self.families.get(family.name)
+            if existing is not None:
+                return existing
+            self.families[family.name] = family
+            return family
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(_Family(name, help_text, "counter", labelnames, Counter))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=STAGE_BUCKETS):
+        return self._add(_Family(name, help_text, "histogram", labelnames, lambda: Histogram(buckets)))
+
+    def register_histogram(self, name, help_text, histogram):
+        """Export an existing unlabelled Histogram (e.g. the embedding batcher's)."""
+        family = self._add(_Family(name, help_text, "histogram", (), lambda: histogram))
+        family.children[()] = histogram
+        return family
+
+    def gauge(self, name, help_text, fn, labelnames=()):
+        with self.lock:
+            self.families[name] = _Gauge(name, help_text, fn, labelnames)  # re-registering replaces fn
+
+    def render(self):
+        lines = []
+        for family in list(self.families.values()):
+            try:
+                samples = list(family.samples())
+            except Exception as e:  # a failing gauge must not break the scrape
+                lines.append(f"# {family.name} unavailable: {e}")
+                continue
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value) if value == value else "NaN"
+    return str(value)
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "rag_stage_seconds", "Latency of one pipeline stage", ["stage", "route", "intent"])
+STAGE_ERRORS = registry.counter(
+    "rag_stage_errors_total", "Stages that raised", ["stage", "route", "intent"])
+REQUEST_SECONDS = registry.histogram(
+    "rag_request_seconds", "End-to-end latency of /api/retrieve requests", ["route", "intent", "outcome"])
+ROWS_RETURNED = registry.counter(
+    "rag_rows_returned_total", "Rows returned by SQL and documents returned by vector search",
+    ["stage", "route", "intent"])
+PROMPT_CHARS = registry.counter(
+    "rag_prompt_chars_total", "Prompt characters sent to Gemini", ["call", "route", "intent"])
+PROMPT_TOKENS = registry.counter(
+    "rag_prompt_tokens_total", "Estimated prompt tokens sent to Gemini", ["call", "route", "intent"])
+EMBEDDING_CALLS = registry.counter(
+    "rag_embedding_calls_total", "Gemini embed_content calls", ["kind"])
+EMBEDDING_TEXTS = registry.counter(
+    "rag_embedding_texts_total", "Texts embedded, by where the vector came from", ["source"])
+WEBHOOK_EVENTS = registry.counter(
+    "rag_webhook_events_total", "Webhook deliveries", ["type", "status"])
+INGEST_EVENTS = registry.counter(
+    "rag_ingest_events_total", "Ingest queue events handled by the consumers", ["result"])
+INGEST_LAG = registry.histogram(
+    "rag_ingest_lag_seconds", "Webhook received to event processed", buckets=LAG_BUCKETS)
+
+
+# 🔹 Request context
+
+_context = contextvars.ContextVar("metrics_context", default=None)
+_BACKGROUND = {"route": "background", "intent": "none"}
+
+
+def begin_request(route, intent="unknown"):
+    """Label every span in the current context (and contexts copied from it) with route/intent."""
+    labels = {"route": route, "intent": intent, "started": time.perf_counter()}
+    _context.set(labels)
+    return labels
+
+
+def set_intent(intent):
+    labels = _context.get()
+    if labels is not None:
+        labels["intent"] = intent
+
+
+def context_labels():
+    labels = _context.get() or _BACKGROUND
+    return {"route": labels["route"], "intent": labels["intent"]}
+
+
+def end_request(outcome="ok"):
+    labels = _context.get()
+    if not METRICS_ENABLED or labels is None or "started" not in labels:
+        return
+    REQUEST_SECONDS.labels(outcome=outcome, **context_labels()).observe(time.perf_counter() - labels["started"])
+
+
+@contextmanager
+def span(stage):
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage=stage, **context_labels()).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage=stage, **context_labels()).observe(time.perf_counter() - started)
+
+
+def timed(stage):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(counter, amount=1, **labels):
+    """Increment a counter whose route/intent labels come from the request context."""
+    if METRICS_ENABLED and amount:
+        counter.labels(**labels, **context_labels()).inc(amount)
+
+
+def inc(counter, amount=1, **labels):
+    """Increment a counter with explicit labels only."""
+    if METRICS_ENABLED and amount:
+        counter.labels(**labels).inc(amount)
+
+
+def render():
+    return registry.render()
@@ -0,0 +1,539 @@
+# queryParser.py
+"""
+Rule-based parser for analytical questions about the `transactions` table.
+
+parse_query() pulls out what generate_sql_from_query's prompt would otherwise ask
+Gemini to infer: the aggregate (SUM/COUNT/AVG/MAX/MIN or a row listing), the
+transaction type, categories from the known category list, months, explicit dates,
+relative periods (today, last week, this month, last 30 days, ...), date ranges
+(between/from ... and/to, before, after, since, until, first/last week of a month),
+exclusions (not including, except, excluding, other than), amount thresholds, grouping
+and description keywords. ParsedQuery.to_sql() emits the same SQL shapes the prompt
+describes, so the route can skip the LLM.
+
+Every parse carries a confidence; fetching only uses the parser when it is at least
+PARSER_MIN_CONFIDENCE and falls back to the plan cache / LLM otherwise. A range or
+negation word (RANGE_WORDS), a balance word (BALANCE_WORDS), a comparison it didn't
+parse ("how much more") or any other content word left over after parsing drops the
+confidence below that threshold by itself, so wording the parser can't express never
+runs as a looser filter.
+Literals in the SQL come from fixed vocabularies or are reduced to [a-z0-9 ] before use.
+"""
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+PARSER_MIN_CONFIDENCE = float(os.getenv("PARSER_MIN_CONFIDENCE", "0.75"))
+
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "jun": 6, "jul": 7, "aug": 8,
+    "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+
+# the category list from generate_sql_from_query's schema hint, plus common surface forms
+CATEGORIES = [
+    "food", "housing", "groceries", "entertainment", "utilities", "transportation", "healthcare",
+    "education", "personal care", "travel", "gifts & donations", "insurance", "bills & fees",
+    "investments", "other expenses",
+]
+CATEGORY_ALIASES = {
+    "grocery": "groceries", "gifts": "gifts & donations", "donations": "gifts & donations",
+    "bills": "bills & fees", "fees": "bills & fees", "investment": "investments",
+    "transport": "transportation", "health": "healthcare", "utility": "utilities",
+    "rent": "housing", "movies": "entertainment", "dining": "food", "restaurants": "food",
+    "eating out": "food",
+}
+
+_COMPARATIVE = re.compile(
+    r"\b(compare|compared|comparison|difference|versus|vs|increase[sd]?|decrease[sd]?|why did|"
+    r"most(?! expensive)|least|higher|lower|trend|more than last|less than last)\b"
+)
+
+_AGGREGATES = [
+    ("AVG", re.compile(r"\b(average|avg|mean)\b")),
+    # "total transactions" counts them; "total spent on transactions" still sums
+    ("COUNT", re.compile(r"\b(how many|count|number of)\b|\btotal (?:\w+ )?(?:transactions|purchases|payments)\b")),
+    ("MAX", re.compile(r"\b(largest|biggest|highest|maximum|max|most expensive)\b")),
+    ("MIN", re.compile(r"\b(smallest|lowest|minimum|min|cheapest)\b")),
+    ("SUM", re.compile(r"\b(how much|total|sum|spent|spend|spending|earned|earn|paid)\b")),
+]
+_LIST_WORDS = re.compile(r"\b(show|list|display|what were|which|transactions|expenses on|purchases)\b")
+_INCOME_WORDS = re.compile(r"\b(income|earn|earned|earning|earnings|salary|received|credited)\b")
+_EXPENSE_WORDS = re.compile(r"\b(spend|spent|spending|expense|expenses|paid|pay|cost|bought|purchase[sd]?)\b")
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+_MONTH_DAY = re.compile(rf"\b({_MONTH_NAMES})\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}}))?")
+_DAY_MONTH = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_MONTH_NAMES})\b(?:,?\s+(\d{{4}}))?")
+_MONTH = re.compile(rf"\b({_MONTH_NAMES})\b(?:\s+(\d{{4}}))?")
+_YEAR = re.compile(r"\b(?:in|of|during)\s+(20\d{2})\b")
+_LAST_N = re.compile(r"\b(?:last|past|previous)\s+(\d{1,3})\s+(day|week|month)s?\b")
+_RELATIVE = [
+    ("today", re.compile(r"\btoday\b")),
+    ("yesterday", re.compile(r"\byesterday\b")),
+    ("this_week", re.compile(r"\bthis week\b")),
+    ("last_week", re.compile(r"\b(last|previous|past) week\b")),
+    ("this_month", re.compile(r"\b(this|current) month\b")),
+    ("last_month", re.compile(r"\b(last|previous|past) month\b")),
+    ("this_year", re.compile(r"\b(this|current) year\b")),
+    ("last_year", re.compile(r"\b(last|previous|past) year\b")),
+]
+_THRESHOLD = re.compile(
+    r"\b(greater than|more than|over|above|at least|less than|under|below|at most)\s+(?:rs\.?\s*|₹|\$)?(\d+(?:\.\d+)?)\b"
+)
+_GROUP_BY = [
+    ("month", re.compile(r"\b(per|by|each|every) month\b|\bmonthly\b")),
+    ("category", re.compile(r"\b(per|by|each|every) category\b|\bcategory ?wise\b")),
+    ("day", re.compile(r"\b(per|by|each|every) day\b|\bdaily\b")),
+]
+# 🔹 Ranges and exclusions
+# an endpoint: 2025-03-05 | march | march 5 | march 5, 2025 | 5th of march 2025
+_POINT = (rf"(?:\d{{4}}-\d{{2}}-\d{{2}}|(?:\d{{1,2}}(?:st|nd|rd|th)?\s+(?:of\s+)?)?(?:{_MONTH_NAMES})"
+          rf"(?:\s+\d{{1,2}}(?:st|nd|rd|th)?\b)?(?:,?\s+\d{{4}})?)")
+_BETWEEN = re.compile(rf"\b(?:between|from)\s+({_POINT})\s+(?:and|to|till|until|through|-)\s+({_POINT})\b")
+_BOUND = re.compile(rf"\b(before|after|since|until|till)\s+({_POINT})\b")
+_PART_OF_MONTH = re.compile(
+    rf"\b(first|last)\s+(week|(\d{{1,2}})\s+days?)\s+of\s+({_MONTH_NAMES})(?:\s+(\d{{4}}))?\b")
+_NEGATION = re.compile(
+    r"\b(?:not including|not counting|but not|not|except(?: for)?|excluding|other than|apart from|without)"
+    r"\s+(?:my\s+|the\s+|any\s+)?([a-z][a-z&]*(?: [a-z&]+)?)"
+)
+# never stopwords or keywords: if one survives parsing, the question had a range or
+# exclusion the SQL would not express
+RANGE_WORDS = {"between", "before", "after", "since", "until", "till", "not", "except", "excluding",
+               "without", "first", "last"}
+# the same for balances ("how much money do i have"): transactions can't answer them
+BALANCE_WORDS = {"have", "has", "had", "left", "balance", "balances", "worth", "remaining"}
+# "how much more did i spend": a comparison the question doesn't spell out; thresholds
+# ("more than 500") are consumed before this is checked
+_UNPARSED_COMPARISON = re.compile(r"\b(more|less|fewer|than|compared)\b")
+# "have" as an auxiliary ("how much have i spent") is not a balance question
+_AUXILIARY_HAVE = re.compile(
+    r"\b(?:have|has|had)(?=(?:\s+(?:i|we|you|not|never|already|ever))*"
+    r"\s+(?:\w+ed|spent|paid|got|made|bought|been|done)\b)")
+
+_KEYWORD_PHRASE = re.compile(r"\b(?:on|for|at|from|to)\s+(?:my\s+|the\s+|a\s+)?([a-z][a-z0-9 ]{1,40}?)(?=\s+(?:in|on|during|this|last|for|from|since|at|per|by)\b|$)")
+
+_STOPWORDS = set("""
+a an the i me my mine we our you your it its is are was were be been am do did does done
+how much many what which when where who whom why show list display give tell please total sum of on in
+for at to from by with and or per each every during this that these those past previous current
+than more less over under above below least most spend spent spending expense expenses transaction
+transactions money amount amounts paid pay cost income earn earned earning salary received all any
+average avg mean count number largest biggest highest smallest lowest maximum minimum max min so far
+ago day days week weeks month months year years today yesterday monthly daily wise
+category categories were purchase purchases bought rs whats what's trip stuff things overall
+make made get got buy spend expensive compare compared comparison versus vs difference
+product products item items goods thing out
+""".split())
+# nouns that say nothing about the description: never ILIKE keywords
+_GENERIC_KEYWORDS = {"trip", "purchase", "purchases", "stuff", "things", "thing", "expenses", "expense", "spending",
+                     "money", "shopping", "transactions", "payments", "payment", "bill", "product", "products",
+                     "item", "items", "goods", "out"}
+
+_OPERATORS = {
+    "greater than": ">", "more than": ">", "over": ">", "above": ">", "at least": ">=",
+    "less than": "<", "under": "<", "below": "<", "at most": "<=",
+}
+
+
+def _sql_text(value):
+    """Keywords go into ILIKE patterns; keep them to letters, digits and spaces."""
+    return re.sub(r"[^a-z0-9 ]", "", value.lower()).strip()
+
+
+def _safe_date(year, month, day):
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def _month_span(year, month):
+    return date(year, month, 1), date(year + (month == 12), month % 12 + 1, 1)
+
+
+def _point(text, default_year):
+    """
+    (first day, day after the end, month or None, explicit year or None) of a range
+    endpoint: a whole month or one day. None if the text isn't a valid endpoint.
+    """
+    m = _ISO_DATE.fullmatch(text)
+    if m:
+        d = _safe_date(*m.groups())
+        return (d, d + timedelta(days=1), None, d.year) if d else None
+    for pattern, order in ((_MONTH_DAY, ("m", "d", "y")), (_DAY_MONTH, ("d", "m", "y"))):
+        m = pattern.fullmatch(text)
+        if m:
+            values = dict(zip(order, m.groups()))
+            year = int(values["y"]) if values["y"] else None
+            d = _safe_date(year or default_year, MONTHS[values["m"]], values["d"])
+            return (d, d + timedelta(days=1), None, year) if d else None
+    m = _MONTH.fullmatch(text)
+    if m:
+        year = int(m.group(2)) if m.group(2) else None
+        month = MONTHS[m.group(1)]
+        return (*_month_span(year or default_year, month), month, year)
+    return None
+
+
+@dataclass
+class ParsedQuery:
+    text: str
+    intent: str = "aggregate"              # aggregate | list | comparative | unknown
+    aggregate: str = None                  # SUM | COUNT | AVG | MAX | MIN
+    txn_type: str = "EXPENSE"              # EXPENSE | INCOME | None (both)
+    categories: list = field(default_factory=list)
+    months: list = field(default_factory=list)
+    year: int = None
+    dates: list = field(default_factory=list)
+    date_from: date = None                 # inclusive lower bound (after, since, between ...)
+    date_to: date = None                   # exclusive upper bound (before, until, between ...)
+    period: str = None                     # today, last_month, last_30_day, ...
+    amount_filters: list = field(default_factory=list)  # [(operator, value)]
+    group_by: str = None                   # month | category | day
+    keywords: list = field(default_factory=list)
+    excluded_categories: list = field(default_factory=list)
+    excluded_keywords: list = field(default_factory=list)
+    confidence: float = 0.0
+    reasons: list = field(default_factory=list)
+
+    @property
+    def confident(self):
+        return self.confidence >= PARSER_MIN_CONFIDENCE
+
+    # ---- SQL -----------------------------------------------------------------
+
+    def _select(self):
+        alias = "total_income" if self.txn_type == "INCOME" else "total_spent"
+        expressions = {
+            "SUM": f"SUM(amount) AS {alias}",
+            "COUNT": "COUNT(*) AS transaction_count",
+            "AVG": "AVG(amount) AS average_amount",
+            "MAX": "MAX(amount) AS largest_amount",
+            "MIN": "MIN(amount) AS smallest_amount",
+        }
+        return expressions[self.aggregate]
+
+    def _period_conditions(self):
+        p = self.period
+        if p is None:
+            return []
+        if p == "today":
+            return ["date >= CURRENT_DATE", "date < CURRENT_DATE + INTERVAL '1 day'"]
+        if p == "yesterday":
+            return ["date >= CURRENT_DATE - INTERVAL '1 day'", "date < CURRENT_DATE"]
+        if p.startswith("last_") and p.split("_")[1].isdigit():
+            _, n, unit = p.split("_")
+            return [f"date >= CURRENT_DATE - INTERVAL '{int(n)} {unit}s'"]
+        unit = p.split("_")[1]
+        if p.startswith("this_"):
+            return [f"date_trunc('{unit}', date) = date_trunc('{unit}', CURRENT_DATE)"]
+        return [f"date_trunc('{unit}', date) = date_trunc('{unit}', CURRENT_DATE - INTERVAL '1 {unit}')"]
+
+    def _conditions(self, with_time=True, with_type=True, with_keywords=True):
+        conditions = []
+        if self.txn_type and with_type:
+            conditions.append(f"type = '{self.txn_type}'")
+        if self.categories:
+            parts = [f"category ILIKE '%{c}%'" for c in self.categories]
+            conditions.append(parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")")
+        if self.keywords and with_keywords:
+            parts = [f"description ILIKE '%{_sql_text(k)}%'" for k in self.keywords]
+            conditions.append(parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")")
+        for c in self.excluded_categories:
+            conditions.append(f"COALESCE(category, '') NOT ILIKE '%{c}%'")
+        for k in self.excluded_keywords:
+            conditions.append(f"COALESCE(description, '') NOT ILIKE '%{_sql_text(k)}%'")
+        for op, value in self.amount_filters:
+            conditions.append(f"amount {op} {value}")
+        if not with_time:
+            return conditions
+
+        if self.dates:
+            parts = [f"(date >= '{d.isoformat()}' AND date < '{(d + timedelta(days=1)).isoformat()}')"
+                     for d in self.dates]
+            conditions.append(parts[0][1:-1] if len(parts) == 1 else "(" + " OR ".join(parts) + ")")
+        elif self.months:
+            if self.year:
+                parts = []
+                for m in self.months:
+                    start = date(self.year, m, 1)
+                    end = date(self.year + (m == 12), m % 12 + 1, 1)
+                    parts.append(f"(date >= '{start.isoformat()}' AND date < '{end.isoformat()}')")
+                conditions.append(parts[0][1:-1] if len(parts) == 1 else "(" + " OR ".join(parts) + ")")
+            elif len(self.months) == 1:
+                conditions.append(f"EXTRACT(MONTH FROM date) = {self.months[0]}")
+            else:
+                conditions.append(f"EXTRACT(MONTH FROM date) IN ({', '.join(str(m) for m in self.months)})")
+        elif self.year:
+            conditions.append(f"EXTRACT(YEAR FROM date) = {self.year}")
+        if self.date_from:
+            conditions.append(f"date >= '{self.date_from.isoformat()}'")
+        if self.date_to:
+            conditions.append(f"date < '{self.date_to.isoformat()}'")
+        conditions.extend(self._period_conditions())
+        return conditions
+
+    def has_filters(self):
+        """Whether the question narrows transactions by category, time or amount."""
+        return bool(self.categories or self.months or self.dates or self.year or self.period or self.amount_filters
+                    or self.date_from or self.date_to or self.excluded_categories or self.excluded_keywords)
+
+    def filter_sql(self, limit=None):
+        """
+        Ids of the transactions matching the structured filters; description words are left to
+        ranking. Without a limit it is a subquery for match_filtered_embeddings.
+        """
+        conditions = self._conditions(with_keywords=False)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        if limit is None:
+            return f"SELECT id FROM transactions{where}"
+        return f"SELECT id FROM transactions{where} ORDER BY date DESC LIMIT {int(limit)}"
+
+    def to_sql(self):
+        if self.intent == "comparative":
+            # same contract as rule 12 of the LLM prompt: broad rows, the answer step compares
+            conditions = self._conditions(with_time=False, with_type=False)
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            return f"SELECT * FROM transactions{where} ORDER BY date"
+
+        conditions = self._conditions()
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        if self.intent == "list" or self.aggregate is None:
+            return f"SELECT * FROM transactions{where} ORDER BY date"
+
+        if self.group_by == "month":
+            return (f"SELECT date_trunc('month', date) AS month, {self._select()} FROM transactions{where} "
+                    f"GROUP BY 1 ORDER BY 1")
+        if self.group_by == "day":
+            return (f"SELECT date_trunc('day', date) AS day, {self._select()} FROM transactions{where} "
+                    f"GROUP BY 1 ORDER BY 1")
+        if self.group_by == "category":
+            return (f"SELECT category, {self._select()} FROM transactions{where} "
+                    f"GROUP BY category ORDER BY 2 DESC")
+        return f"SELECT {self._select()} FROM transactions{where}"
+
+
+def is_comparative(query):
+    """Comparison / trend / ranking questions (rule 12 of the LLM prompt)."""
+    return bool(_COMPARATIVE.search(query.lower()))
+
+
+def parse_query(query, today=None):
+    today = today or date.today()
+    text = re.sub(r"\s+", " ", query.lower()).strip().rstrip("?.! ")
+    parsed = ParsedQuery(text=text)
+    consumed = text  # spans recognised below are blanked out to find leftover words
+
+    def consume(span):
+        nonlocal consumed
+        consumed = consumed.replace(span, " ", 1)
+
+    # ---- intent / aggregate ----
+    if _COMPARATIVE.search(text):
+        parsed.intent = "comparative"
+    else:
+        for name, pattern in _AGGREGATES:
+            if pattern.search(text):
+                parsed.aggregate = name
+                break
+        if parsed.aggregate is None:
+            parsed.intent = "list" if _LIST_WORDS.search(text) else "unknown"
+
+    # ---- type: spending is the default (rule 7 of the LLM prompt) unless nothing implies it ----
+    income, expense = _INCOME_WORDS.search(text), _EXPENSE_WORDS.search(text)
+    if income and not expense:
+        parsed.txn_type = "INCOME"
+    elif income and expense:
+        parsed.txn_type = None
+    elif not expense and parsed.aggregate != "SUM":
+        parsed.txn_type = None  # "how many transactions ...", "show transactions above 500"
+
+    year_hint = today.year if "this year" in text else (today.year - 1 if "last year" in text else None)
+    default_year = year_hint or today.year
+
+    # ---- ranges: between/from A and/to B, before/after/since/until A, first/last week of a month ----
+    for m in _BETWEEN.finditer(consumed):
+        start, end = _point(m.group(1), default_year), _point(m.group(2), default_year)
+        if not start or not end:
+            continue
+        if start[2] and end[2] and not start[3] and not end[3]:
+            # "between march and june": whole months of any year, like "in march"
+            months = [(start[2] - 1 + i) % 12 + 1 for i in range((end[2] - start[2]) % 12 + 1)]
+            parsed.months.extend(mo for mo in months if mo not in parsed.months)
+        else:
+            if end[3] and not start[3]:
+                start = _point(m.group(1), end[3])  # "march 5 to april 2, 2025"
+            lower, upper = start[0], end[1]
+            if lower >= upper and not start[3]:
+                lower = lower.replace(year=lower.year - 1)  # "between november 20 and january 5"
+            parsed.date_from, parsed.date_to = lower, upper
+        consume(m.group(0))
+    for m in _BOUND.finditer(consumed):
+        point = _point(m.group(2), default_year)
+        if not point:
+            continue
+        word = m.group(1)
+        if word == "before":
+            parsed.date_to = point[0]
+        elif word in ("until", "till"):
+            parsed.date_to = point[1]
+        elif word == "after":
+            parsed.date_from = point[1]
+        else:
+            parsed.date_from = point[0]
+        consume(m.group(0))
+    for m in _PART_OF_MONTH.finditer(consumed):
+        first_day, next_month = _month_span(int(m.group(5)) if m.group(5) else default_year, MONTHS[m.group(4)])
+        days = 7 if m.group(2) == "week" else int(m.group(3))
+        if not 0 < days <= (next_month - first_day).days:
+            continue
+        if m.group(1) == "first":
+            parsed.date_from, parsed.date_to = first_day, first_day + timedelta(days=days)
+        else:
+            parsed.date_from, parsed.date_to = next_month - timedelta(days=days), next_month
+        consume(m.group(0))
+
+    # ---- exclusions: "not including dining", "except rent", "excluding starbucks" ----
+    category_words = sorted(set(CATEGORIES) | set(CATEGORY_ALIASES), key=len, reverse=True)
+    for m in _NEGATION.finditer(consumed):
+        phrase = m.group(1)
+        word = next((w for w in category_words if re.match(rf"{re.escape(w)}\b", phrase)), None)
+        if word:
+            canonical = CATEGORY_ALIASES.get(word, word)
+            if canonical not in parsed.excluded_categories:
+                parsed.excluded_categories.append(canonical)
+            consume(m.group(0)[:m.start(1) - m.start(0)] + word)
+            continue
+        word = phrase.split()[0]
+        if word in _STOPWORDS or word in _GENERIC_KEYWORDS or word in RANGE_WORDS or not _sql_text(word):
+            continue  # left in place: the confidence check below sees the negation
+        if word not in parsed.excluded_keywords:
+            parsed.excluded_keywords.append(word)
+        consume(m.group(0)[:m.start(1) - m.start(0)] + word)
+
+    # ---- explicit dates ----
+    for m in _ISO_DATE.finditer(consumed):
+        d = _safe_date(*m.groups())
+        if d:
+            parsed.dates.append(d)
+            consume(m.group(0))
+    for pattern, order in ((_MONTH_DAY, ("m", "d", "y")), (_DAY_MONTH, ("d", "m", "y"))):
+        for m in pattern.finditer(consumed):
+            values = dict(zip(order, m.groups()))
+            year = int(values["y"]) if values["y"] else (year_hint or today.year)
+            d = _safe_date(year, MONTHS[values["m"]], values["d"])
+            if d:
+                parsed.dates.append(d)
+                consume(m.group(0))
+    if parsed.dates and year_hint:
+        consume("this year" if "this year" in consumed else "last year")
+
+    # ---- months / years ----
+    explicit_years = set()
+    for m in _MONTH.finditer(consumed):
+        month = MONTHS[m.group(1)]
+        if m.group(1) == "may" and re.search(r"\bmay (i|you|we)\b", text):
+            continue  # the verb
+        if month not in parsed.months:
+            parsed.months.append(month)
+        if m.group(2):
+            parsed.year = int(m.group(2))
+            explicit_years.add(parsed.year)
+        consume(m.group(0))
+    year_match = _YEAR.search(consumed)
+    if year_match:
+        parsed.year = int(year_match.group(1))
+        explicit_years.add(parsed.year)
+        consume(year_match.group(0))
+    if parsed.months and year_hint and not parsed.year:
+        parsed.year = year_hint
+        consume("this year" if "this year" in consumed else "last year")
+
+    # ---- relative periods ----
+    last_n = _LAST_N.search(consumed)
+    if last_n:
+        parsed.period = f"last_{int(last_n.group(1))}_{last_n.group(2)}"
+        consume(last_n.group(0))
+    else:
+        for name, pattern in _RELATIVE:
+            m = pattern.search(consumed)
+            if m:
+                parsed.period = name
+                consume(m.group(0))
+                break
+
+    # ---- amounts / grouping ----
+    for m in _THRESHOLD.finditer(consumed):
+        parsed.amount_filters.append((_OPERATORS[m.group(1)], float(m.group(2)) if "." in m.group(2) else int(m.group(2))))
+        consume(m.group(0))
+    for name, pattern in _GROUP_BY:
+        m = pattern.search(consumed)
+        if m:
+            parsed.group_by = name
+            consume(m.group(0))
+            break
+
+    # ---- categories ----
+    for word in category_words:
+        if re.search(rf"\b{re.escape(word)}\b", consumed):
+            canonical = CATEGORY_ALIASES.get(word, word)
+            if canonical not in parsed.categories:
+                parsed.categories.append(canonical)
+            consume(word)
+
+    # ---- description keywords: "on goa trip", "at starbucks" ----
+    for m in _KEYWORD_PHRASE.finditer(consumed):
+        words = [w for w in m.group(1).split() if w not in _STOPWORDS and w not in _GENERIC_KEYWORDS
+                 and w not in RANGE_WORDS and w not in BALANCE_WORDS and not w.isdigit()]
+        for w in words:
+            if _sql_text(w) and w not in parsed.keywords:
+                parsed.keywords.append(w)
+                consume(w)
+
+    # ---- confidence ----
+    consumed = _AUXILIARY_HAVE.sub(" ", consumed)
+    leftover = [w for w in re.findall(r"[a-z0-9']+", consumed) if w not in _STOPWORDS]
+    unparsed_ranges = [w for w in leftover if w in RANGE_WORDS]
+    balance = [w for w in leftover if w in BALANCE_WORDS]
+    leftover = [w for w in leftover if w not in RANGE_WORDS and w not in BALANCE_WORDS]
+    comparison = parsed.intent != "comparative" and _UNPARSED_COMPARISON.search(consumed)
+    confidence = 1.0
+    if parsed.intent == "unknown":
+        confidence = 0.2
+        parsed.reasons.append("no aggregate or listing intent")
+    if parsed.intent == "comparative" and (parsed.keywords or parsed.amount_filters):
+        confidence -= 0.3
+        parsed.reasons.append("comparative question with extra filters")
+    if leftover:
+        # one is enough: "tax", "cash", "refund" would otherwise vanish into a plain total
+        confidence -= 0.3 * len(leftover)
+        parsed.reasons.append(f"unrecognised words: {' '.join(leftover)}")
+    if len(explicit_years) > 1:
+        # ParsedQuery has one year for all of its months
+        confidence -= 0.5
+        parsed.reasons.append(f"months in different years: {', '.join(str(y) for y in sorted(explicit_years))}")
+    if parsed.months and parsed.period:
+        confidence -= 0.3
+        parsed.reasons.append("both a month and a relative period")
+    if unparsed_ranges:
+        confidence -= 0.5
+        parsed.reasons.append(f"range or negation not understood: {' '.join(unparsed_ranges)}")
+    if balance:
+        confidence -= 0.5
+        parsed.reasons.append(f"asks for a balance, not transactions: {' '.join(balance)}")
+    if comparison:
+        confidence -= 0.5
+        parsed.reasons.append(f"comparison not understood: {comparison.group(0)}")
+    if set(parsed.categories) & set(parsed.excluded_categories):
+        confidence -= 0.5
+        parsed.reasons.append("excludes part of a category it also includes")
+    if (parsed.date_from or parsed.date_to) and (parsed.months or parsed.dates or parsed.period or parsed.year):
+        confidence -= 0.3
+        parsed.reasons.append("a date range and another time filter")
+    parsed.confidence = max(0.0, round(confidence, 2))
+    return parsed
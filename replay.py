@@ -0,0 +1,201 @@
+# replay.py
+"""
+Replay a traffic capture (see trafficCapture.py) against a running instance.
+
+Requests are re-sent at their original pacing, scaled by --speed (2 = twice as fast,
+0 = all at once, bounded by --concurrency). Each request is scheduled relative to the
+first one in the capture, so webhook bursts and query mixes arrive as they did in production.
+Records whose body was not captured (too large or invalid JSON) are skipped. Captures are
+pseudonymized by default, so replay them against data seeded under the same hashed ids,
+or capture with CAPTURE_PSEUDONYMIZE=0 on a staging copy.
+
+The report has, per path: requests, HTTP errors, app errors, p50/p90/p99/max latency,
+time to first byte for streamed answers and how late the replay fell behind the
+schedule. An app error is a 200 whose body reports a failure: a retrieve that returns
+"status", a webhook that is not "queued", or a stream that ends in an error event.
+
+Usage:
+    python replay.py captures/requests-2026-10-16.jsonl
+    python replay.py captures/requests-2026-10-16.jsonl --base-url http://staging:8000 --speed 4 --out replay.json
+    python replay.py captures/requests-*.jsonl --speed 0 --concurrency 32 --paths /api/retrieve
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import httpx
+import numpy as np
+
+
+def load_capture(files, paths=None, limit=None):
+    """Captured requests from one or more files in timestamp order; unreplayable lines are skipped."""
+    records, skipped = [], 0
+    for name in [files] if isinstance(files, str) else files:
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    skipped += 1
+                    continue
+                if not isinstance(record, dict) or not record.get("path") or record.get("body") is None:
+                    skipped += 1
+                    continue
+                if paths and record["path"] not in paths:
+                    continue
+                records.append(record)
+    records.sort(key=lambda r: r.get("ts", 0))
+    if limit:
+        records = records[:limit]
+    return records, skipped
+
+
+def _app_error(path, status, text):
+    if status >= 400:
+        return False  # counted as an HTTP error
+    if path.endswith("/stream"):
+        return "event: error" in text or "event: done" not in text
+    try:
+        body = json.loads(text)
+    except ValueError:
+        return True
+    if path.startswith("/webhook"):
+        return body.get("status") != "queued"
+    return isinstance(body, dict) and "status" in body
+
+
+async def _send(client, record):
+    result = {"path": record["path"], "ttfb_ms": None}
+    started = time.perf_counter()
+    try:
+        async with client.stream(record.get("method", "POST"), record["path"], json=record["body"]) as response:
+            chunks = []
+            async for chunk in response.aiter_text():
+                if result["ttfb_ms"] is None:
+                    result["ttfb_ms"] = (time.perf_counter() - started) * 1000
+                chunks.append(chunk)
+        result["status"] = response.status_code
+        result["http_error"] = response.status_code >= 400
+        result["app_error"] = _app_error(record["path"], response.status_code, "".join(chunks))
+    except httpx.HTTPError as e:
+        result.update(status=None, http_error=True, app_error=False, exception=type(e).__name__)
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+async def replay(records, base_url, speed=1.0, concurrency=64, timeout=120.0):
+    semaphore = asyncio.Semaphore(concurrency)
+    t0 = records[0].get("ts", 0) if records else 0
+    results = []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        started = time.perf_counter()
+
+        async def one(record):
+            due = (record.get("ts", t0) - t0) / speed if speed > 0 else 0.0
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with semaphore:
+                lag = max(0.0, (time.perf_counter() - started) - due) * 1000
+                result = await _send(client, record)
+            result["lag_ms"] = lag
+            results.append(result)
+
+        await asyncio.gather(*(one(r) for r in records))
+        wall = time.perf_counter() - started
+    return results, wall
+
+
+def _quantiles(values):
+    if not values:
+        return {}
+    arr = np.asarray(values)
+    p50, p90, p99 = np.percentile(arr, [50, 90, 99])
+    return {"p50": round(float(p50), 1), "p90": round(float(p90), 1),
+            "p99": round(float(p99), 1), "max": round(float(arr.max()), 1)}
+
+
+def summarize(results, wall, captured_span):
+    by_path = {}
+    for r in results:
+        by_path.setdefault(r["path"], []).append(r)
+    paths = {}
+    for path, rs in sorted(by_path.items()):
+        n = len(rs)
+        http_errors = sum(r["http_error"] for r in rs)
+        app_errors = sum(r["app_error"] for r in rs)
+        entry = {
+            "requests": n,
+            "http_errors": http_errors,
+            "app_errors": app_errors,
+            "error_rate": round((http_errors + app_errors) / n, 4),
+            "latency_ms": _quantiles([r["latency_ms"] for r in rs]),
+            "lag_ms": _quantiles([r["lag_ms"] for r in rs]),
+        }
+        if path.endswith("/stream"):
+            entry["ttfb_ms"] = _quantiles([r["ttfb_ms"] for r in rs if r["ttfb_ms"] is not None])
+        paths[path] = entry
+    total = len(results)
+    errors = sum(r["http_error"] or r["app_error"] for r in results)
+    return {
+        "requests": total,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "wall_s": round(wall, 3),
+        "captured_span_s": round(captured_span, 3),
+        "throughput_rps": round(total / wall, 2) if wall else 0.0,
+        "latency_ms": _quantiles([r["latency_ms"] for r in results]),
+        "paths": paths,
+    }
+
+
+def _print_report(report):
+    print(f"{report['requests']} requests in {report['wall_s']}s (captured over {report['captured_span_s']}s), "
+          f"{report['throughput_rps']} req/s, error rate {report['error_rate']:.2%}")
+    print(f"{'path':<24}{'n':>7}{'http err':>10}{'app err':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'lag p99':>9}")
+    for path, e in report["paths"].items():
+        lat = e["latency_ms"]
+        print(f"{path:<24}{e['requests']:>7}{e['http_errors']:>10}{e['app_errors']:>9}"
+              f"{lat['p50']:>9}{lat['p90']:>9}{lat['p99']:>9}{lat['max']:>9}{e['lag_ms']['p99']:>9}")
+        if e.get("ttfb_ms"):
+            print(f"{'  first byte':<24}{'':>26}{e['ttfb_ms']['p50']:>9}{e['ttfb_ms']['p90']:>9}"
+                  f"{e['ttfb_ms']['p99']:>9}{e['ttfb_ms']['max']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request capture against a running instance")
+    parser.add_argument("capture", nargs="+", help="JSONL files written by the REQUEST_CAPTURE middleware")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="pacing multiplier; 0 sends everything at once")
+    parser.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    parser.add_argument("--paths", nargs="+", help="only replay these paths")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--out", help="write the report as JSON")
+    args = parser.parse_args()
+
+    records, skipped = load_capture(args.capture, set(args.paths) if args.paths else None, args.limit)
+    files = ", ".join(args.capture)
+    if not records:
+        print(f"no captured requests in {files} ({skipped} lines skipped)")
+        sys.exit(1)
+    span = records[-1].get("ts", 0) - records[0].get("ts", 0)
+    print(f"replaying {len(records)} requests from {files} at {args.speed}x "
+          f"({skipped} lines skipped) against {args.base_url}")
+
+    results, wall = asyncio.run(replay(records, args.base_url, args.speed, args.concurrency, args.timeout))
+    report = summarize(results, wall, span)
+    _print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"capture": args.capture, "config": vars(args), **report}, f, indent=2)
+        print(f"report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+# rollups.py
+"""
+Per-user monthly aggregates of `transactions`, for answering simple totals without SQL.
+
+The store keeps one cell per (user, account, month, category, type) with the sum, count,
+min and max of the amounts, in SQLite next to the ingest queue:
+
+  - backfill.py seeds it with a bulk build over the whole table (build()).
+  - worker applies every webhook event incrementally (apply_event()). Each row's last
+    applied contribution and version are kept in `row_state`. An event first subtracts
+    the old contribution and then adds the new one. For UPDATE and DELETE in order, the
+    old contribution is exactly the old_record. Replayed events are no-ops, and events
+    older than what was applied (by row_version) are ignored. DELETE leaves a tombstone
+    versioned by when the event was received (old_record may carry only the id), so a
+    late INSERT or UPDATE cannot bring the row back.
+  - fetching asks answer() before going to SQL. It handles SUM/COUNT/AVG/MIN/MAX
+    questions that the parser is confident about, filtered only by type, categories,
+    whole months/years or this/last month/year. It returns rows shaped like the SQL
+    result, or None when the rollups can't answer (keywords, amount filters, exact
+    dates, day-based periods, grouping) or may be incomplete.
+
+The store is local to one host and fed only by this process's webhooks, so it is off
+unless ROLLUPS=1, which says this instance receives every transactions webhook. Even
+then it answers only while complete(): the last build started after this process began
+consuming webhooks (start_feeding()), and no event failed to apply since. Any event sent
+while the server was down, or to another instance, would otherwise be silently missing.
+
+min/max can't be decremented. When an update or delete removes a cell's current
+extreme, the cell is flagged and MIN/MAX over it go back to SQL until the next build.
+Category filters use the same substring match as the parser's `category ILIKE '%x%'`.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+from embeddingCreation import row_version, tombstone_version
+
+ROLLUP_DB = os.getenv("ROLLUP_DB", "rollups.db")
+# only for a deployment where this instance receives every transactions webhook
+ROLLUPS_ENABLED = os.getenv("ROLLUPS", "0") == "1"
+# answer rollup hits with describe() instead of a Gemini call
+ROLLUP_TEMPLATE_ANSWERS = os.getenv("ROLLUP_TEMPLATE_ANSWERS", "0") == "1"
+
+_RESULT_COLUMNS = {
+    "COUNT": "transaction_count",
+    "AVG": "average_amount",
+    "MAX": "largest_amount",
+    "MIN": "smallest_amount",
+}
+
+
+def _contribution(row):
+    """(user, account, month, category, type, amount) a transaction adds to its cell, or None."""
+    if not isinstance(row, dict):
+        return None
+    user_id, day, txn_type = row.get("userId"), str(row.get("date") or ""), row.get("type")
+    try:
+        amount = float(row.get("amount"))
+    except (TypeError, ValueError):
+        return None
+    if not user_id or len(day) < 7 or not txn_type:
+        return None
+    return (user_id, row.get("accountId") or "", day[:7], (row.get("category") or "").lower(),
+            str(txn_type).upper(), amount)
+
+
+def _shift_month(today, months_back):
+    index = today.year * 12 + today.month - 1 - months_back
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+class RollupStore:
+    def __init__(self, path=ROLLUP_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rollups (
+                user_id TEXT NOT NULL,
+                account_id TEXT NOT NULL,
+                month TEXT NOT NULL,
+                category TEXT NOT NULL,
+                type TEXT NOT NULL,
+                total REAL NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                min REAL,
+                max REAL,
+                extrema_exact INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (user_id, account_id, month, category, type)
+            );
+            CREATE TABLE IF NOT EXISTS row_state (
+                source_id TEXT PRIMARY KEY,
+                user_id TEXT, account_id TEXT, month TEXT, category TEXT, type TEXT, amount REAL,
+                version INTEGER NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.built_at = self._meta("built_at")
+        self.feeding_since = None  # when this process started applying webhook events
+        self.gap_at = None         # last time an event failed to apply
+        self.applied = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return float(row[0]) if row else None
+
+    def start_feeding(self):
+        """Called when this process starts consuming webhooks; builds from before then may have gaps."""
+        self.feeding_since = time.time()
+
+    def complete(self):
+        """
+        Whether every transactions change since the last build has been applied here: the build
+        (possibly by backfill.py in another process) started after this process began consuming
+        webhooks, and no event has failed since.
+        """
+        with self.lock:
+            self.built_at = self._meta("built_at")
+        return (self.built_at is not None and self.feeding_since is not None
+                and self.built_at >= self.feeding_since
+                and (self.gap_at is None or self.built_at > self.gap_at))
+
+    # ---- writes (caller holds the lock and an open transaction) ----------------
+
+    def _add(self, cell, amount):
+        self.conn.execute(
+            """INSERT INTO rollups (user_id, account_id, month, category, type, total, count, min, max)
+               VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+               ON CONFLICT (user_id, account_id, month, category, type) DO UPDATE SET
+                   total = total + excluded.total,
+                   count = count + 1,
+                   min = CASE WHEN min IS NULL OR excluded.min < min THEN excluded.min ELSE min END,
+                   max = CASE WHEN max IS NULL OR excluded.max > max THEN excluded.max ELSE max END""",
+            (*cell, amount, amount, amount),
+        )
+
+    def _subtract(self, cell, amount):
+        self.conn.execute(
+            """UPDATE rollups SET
+                   total = total - ?,
+                   count = count - 1,
+                   extrema_exact = CASE WHEN ? <= min OR ? >= max THEN 0 ELSE extrema_exact END
+               WHERE user_id = ? AND account_id = ? AND month = ? AND category = ? AND type = ?""",
+            (amount, amount, amount, *cell),
+        )
+        self.conn.execute(
+            """DELETE FROM rollups WHERE count <= 0
+               AND user_id = ? AND account_id = ? AND month = ? AND category = ? AND type = ?""",
+            cell,
+        )
+
+    def _apply(self, source_id, new_row, version, deleted):
+        """Replace source_id's contribution with new_row's (None removes it). Returns False if stale."""
+        state = self.conn.execute(
+            "SELECT user_id, account_id, month, category, type, amount, version, deleted "
+            "FROM row_state WHERE source_id = ?", (source_id,),
+        ).fetchone()
+        if state is not None:
+            stored_version, was_deleted = state[6], state[7]
+            if deleted:
+                # deletes win over anything applied, even with a skewed clock behind the event version
+                version = max(version, stored_version)
+            elif version < stored_version or (was_deleted and version <= stored_version):
+                return False  # older than what is applied, or a late write to a deleted row
+            if not was_deleted and state[0] is not None:
+                self._subtract(state[:5], state[5])
+        contribution = None if deleted else _contribution(new_row)
+        if contribution is not None:
+            self._add(contribution[:5], contribution[5])
+        values = contribution or (None,) * 6
+        self.conn.execute(
+            """INSERT OR REPLACE INTO row_state
+               (source_id, user_id, account_id, month, category, type, amount, version, deleted)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (source_id, *values, version, 1 if deleted else 0),
+        )
+        return True
+
+    def _transaction(self, fn):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def apply_event(self, event_type, record, old_record=None, received_at=None):
+        """
+        Fold one INSERT/UPDATE/DELETE of a transactions row into the rollups. received_at is
+        when the webhook arrived (epoch seconds, default now): the row was deleted before
+        then, so it versions the tombstone when old_record carries no timestamps.
+        """
+        row = record or old_record
+        if not isinstance(row, dict) or not row.get("id"):
+            return False
+        deleted = event_type == "DELETE"
+        version = tombstone_version(row, received_at) if deleted else row_version(row)
+        try:
+            applied = self._transaction(
+                lambda: self._apply(str(row["id"]), None if deleted else record, version, deleted))
+        except Exception:
+            self.gap_at = time.time()  # answers wait for the next build
+            raise
+        if applied:
+            self.applied += 1
+        else:
+            self.skipped += 1
+        return applied
+
+    def build(self, pages, rebuild=True):
+        """
+        Bulk build from an iterable of row pages (e.g. backfill's keyset pages). With
+        rebuild the store is cleared first. Webhook events applied while it runs are kept,
+        because each page goes through the same version check as apply_event.
+        """
+        started = time.time()
+        if rebuild:
+            def clear():
+                for table in ("rollups", "row_state", "meta"):
+                    self.conn.execute(f"DELETE FROM {table}")
+            self._transaction(clear)
+            self.built_at = None
+
+        loaded = 0
+        for page in pages:
+            rows = [r for r in page if isinstance(r, dict) and r.get("id")]
+
+            def load():
+                for r in rows:
+                    self._apply(str(r["id"]), r, row_version(r), False)
+            self._transaction(load)
+            loaded += len(rows)
+
+        self._transaction(lambda: self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(started),)))
+        self.built_at = started
+        return loaded
+
+    # ---- reads ----------------------------------------------------------------
+
+    def _month_condition(self, parsed, today):
+        """SQL over `month` for the question's time filter, ("", []) for none, or None if not month-aligned."""
+        if parsed.dates or (parsed.months and parsed.period):
+            return None
+        if parsed.months:
+            if parsed.year:
+                keys = [f"{parsed.year:04d}-{m:02d}" for m in parsed.months]
+                return f"month IN ({', '.join('?' * len(keys))})", keys
+            return " OR ".join(["month LIKE ?"] * len(parsed.months)), [f"%-{m:02d}" for m in parsed.months]
+        if parsed.year and not parsed.period:
+            return "month LIKE ?", [f"{parsed.year:04d}-%"]
+        if parsed.period == "this_month":
+            return "month = ?", [_shift_month(today, 0)]
+        if parsed.period == "last_month":
+            return "month = ?", [_shift_month(today, 1)]
+        if parsed.period in ("this_year", "last_year"):
+            return "month LIKE ?", [f"{today.year - (parsed.period == 'last_year'):04d}-%"]
+        if parsed.period is None:
+            return "", []
+        return None
+
+    def answer(self, parsed, user_id, account_id, today=None):
+        """Result rows as execute_sql_wrapper would return them, or None if the rollups can't answer."""
+        if (parsed is None or not parsed.confident or parsed.intent != "aggregate"
+                or parsed.aggregate is None or parsed.group_by or parsed.keywords or parsed.amount_filters
+                or parsed.date_from or parsed.date_to or parsed.excluded_categories or parsed.excluded_keywords):
+            return None
+        if not self.complete():
+            self.misses += 1
+            return None
+        months = self._month_condition(parsed, today or date.today())
+        if months is None:
+            return None
+
+        conditions, params = ["user_id = ?", "account_id = ?"], [user_id, account_id]
+        if parsed.txn_type:
+            conditions.append("type = ?")
+            params.append(parsed.txn_type)
+        if parsed.categories:
+            conditions.append("(" + " OR ".join(["category LIKE ?"] * len(parsed.categories)) + ")")
+            params += [f"%{c}%" for c in parsed.categories]
+        if months[0]:
+            conditions.append(f"({months[0]})")
+            params += months[1]
+
+        with self.lock:
+            total, count, low, high, exact = self.conn.execute(
+                f"""SELECT SUM(total), COALESCE(SUM(count), 0), MIN(min), MAX(max), MIN(extrema_exact)
+                    FROM rollups WHERE {' AND '.join(conditions)}""",
+                params,
+            ).fetchone()
+        if parsed.aggregate in ("MIN", "MAX") and exact == 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        if parsed.aggregate == "SUM":
+            alias = "total_income" if parsed.txn_type == "INCOME" else "total_spent"
+            return [{alias: round(total, 2) if count else None}]
+        value = {
+            "COUNT": count,
+            "AVG": round(total / count, 2) if count else None,
+            "MAX": high,
+            "MIN": low,
+        }[parsed.aggregate]
+        return [{_RESULT_COLUMNS[parsed.aggregate]: value}]
+
+    def stats(self):
+        complete = self.complete()
+        with self.lock:
+            cells = self.conn.execute("SELECT COUNT(*) FROM rollups").fetchone()[0]
+            rows = self.conn.execute("SELECT COUNT(*) FROM row_state WHERE deleted = 0").fetchone()[0]
+        return {"enabled": ROLLUPS_ENABLED, "built_at": self.built_at, "feeding_since": self.feeding_since,
+                "complete": complete, "cells": cells, "rows": rows,
+                "events_applied": self.applied, "events_skipped": self.skipped,
+                "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# 🔹 Plain-text answers for rollup hits, so they need no Gemini call
+
+_MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July", "August",
+                "September", "October", "November", "December"]
+_PERIODS = {"this_month": "this month", "last_month": "last month", "this_year": "this year",
+            "last_year": "last year"}
+
+
+def _when(parsed):
+    if parsed.months:
+        names = [_MONTH_NAMES[m - 1] for m in parsed.months]
+        text = names[0] if len(names) == 1 else ", ".join(names[:-1]) + " and " + names[-1]
+        return f" in {text}{f' {parsed.year}' if parsed.year else ''}"
+    if parsed.period:
+        return f" {_PERIODS[parsed.period]}"
+    if parsed.year:
+        return f" in {parsed.year}"
+    return ""
+
+
+def describe(parsed, row):
+    """One-sentence answer for a rollup result row."""
+    value = next(iter(row.values()))
+    on = f" on {' and '.join(parsed.categories)}" if parsed.categories else ""
+    when = _when(parsed)
+    kind = {"EXPENSE": "expense", "INCOME": "income"}.get(parsed.txn_type, "transaction")
+    if parsed.aggregate == "COUNT":
+        noun = "transaction" if value == 1 else "transactions"
+        what = f"{kind} {noun}" if parsed.txn_type else noun
+        return f"You have {value} {what}{on}{when}."
+    if value is None:
+        return f"There are no {kind} transactions{on}{when}."
+    amount = f"{value:,.2f}"
+    if parsed.aggregate == "SUM":
+        verb = {"EXPENSE": "spent", "INCOME": "received"}.get(parsed.txn_type, "transacted")
+        return f"You {verb} {amount}{on}{when}."
+    label = {"AVG": "average", "MAX": "largest", "MIN": "smallest"}[parsed.aggregate]
+    return f"Your {label} {kind}{on}{when} was {amount}."
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_rollup_store():
+    """Process-wide store, opened on first use rather than at import."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = RollupStore()
+    return _store
@@ -0,0 +1,124 @@
+# sessionMemory.py
+"""
+Conversation memory for the answer prompt, scoped per (user, session).
+
+Each session keeps its last SESSION_MAX_TURNS exchanges in a ring buffer. A turn that
+falls out of the ring is folded into a short rolling summary (its question and the
+start of its answer) capped at SESSION_SUMMARY_CHARS, so old context fades out
+instead of growing the prompt. Idle sessions expire after SESSION_TTL_SECONDS and at
+most SESSION_MAX_SESSIONS are kept (LRU), which bounds memory per process.
+
+The store is per process: with several uvicorn workers each one has its own
+sessions, and a user's history never leaks into another user's prompt.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "5"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "600"))
+SESSION_TURN_CHARS = int(os.getenv("SESSION_TURN_CHARS", "400"))
+
+
+def session_key(user_id, session_id=None):
+    return f"{user_id}:{session_id or 'default'}"
+
+
+def _clip(text, limit):
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+class _Session:
+    __slots__ = ("turns", "summary", "last_used")
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ""
+        self.last_used = time.monotonic()
+
+
+class SessionMemory:
+    def __init__(self, max_turns=SESSION_MAX_TURNS, ttl_seconds=SESSION_TTL_SECONDS,
+                 max_sessions=SESSION_MAX_SESSIONS, summary_chars=SESSION_SUMMARY_CHARS,
+                 turn_chars=SESSION_TURN_CHARS):
+        self.max_turns = max_turns
+        self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self.summary_chars = summary_chars
+        self.turn_chars = turn_chars
+        self.sessions = OrderedDict()   # key -> _Session, least recently used first
+        self.lock = threading.Lock()
+        self.counters = {"turns": 0, "compacted": 0, "expired": 0, "evicted": 0}
+
+    def _expire(self, now):
+        while self.sessions:
+            key, session = next(iter(self.sessions.items()))
+            if now - session.last_used < self.ttl:
+                break
+            del self.sessions[key]
+            self.counters["expired"] += 1
+
+    def _session(self, key, create=False):
+        now = time.monotonic()
+        self._expire(now)
+        session = self.sessions.get(key)
+        if session is None and create:
+            session = self.sessions[key] = _Session(self.max_turns)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.counters["evicted"] += 1
+        if session is not None:
+            session.last_used = now
+            self.sessions.move_to_end(key)
+        return session
+
+    def _compact(self, session, turn):
+        """Fold a turn leaving the ring into the summary, dropping the oldest text first."""
+        line = f"Q: {_clip(turn['user'], 120)} A: {_clip(turn['assistant'], 120)}"
+        lines = (session.summary.split(" | ") if session.summary else []) + [line]
+        while len(lines) > 1 and len(" | ".join(lines)) > self.summary_chars:
+            lines.pop(0)
+        session.summary = _clip(" | ".join(lines), self.summary_chars)
+        self.counters["compacted"] += 1
+
+    def append(self, key, user_query, answer):
+        turn = {"user": _clip(user_query, self.turn_chars), "assistant": _clip(answer, self.turn_chars)}
+        with self.lock:
+            session = self._session(key, create=True)
+            if len(session.turns) == session.turns.maxlen:
+                self._compact(session, session.turns[0])
+            session.turns.append(turn)
+            self.counters["turns"] += 1
+
+    def history(self, key):
+        """Prompt-ready text: the rolling summary, then the recent turns in order."""
+        with self.lock:
+            session = self._session(key)
+            if session is None:
+                return "None"
+            lines = [f"Earlier in this conversation: {session.summary}"] if session.summary else []
+            for turn in session.turns:
+                lines.append(f"User: {turn['user']}")
+                lines.append(f"Assistant: {turn['assistant']}")
+            return "\n".join(lines) or "None"
+
+    def clear(self, key):
+        with self.lock:
+            self.sessions.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            self._expire(time.monotonic())
+            return {
+                **self.counters,
+                "sessions": len(self.sessions),
+                "max_turns": self.max_turns,
+                "ttl_seconds": self.ttl,
+            }
+
+
+session_memory = SessionMemory()
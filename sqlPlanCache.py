@@ -0,0 +1,226 @@
+# sqlPlanCache.py
+"""
+Template cache for the NL-to-SQL step of the analytical route.
+
+After generate_sql_from_query produced SQL that execute_sql_wrapper ran successfully,
+learn() pulls the literal slots out of the question (months, ISO dates, years,
+categories, numbers), finds where each one shows up in the SQL and stores both sides
+with the slots replaced by placeholders:
+
+    "how much did i spend on <category> in <month>"
+      -> SELECT SUM(amount) AS total_spent FROM transactions WHERE type = 'EXPENSE'
+         AND category ILIKE '%{category0}%' AND EXTRACT(MONTH FROM date) = {month0}
+
+lookup() maps a new question to the same template key and fills the placeholders
+locally, with no LLM call. A template is only learned when every question slot was
+found in the SQL, so a cached plan can never silently ignore part of a question, and
+only when no date or year literal is left in it that no slot produced: "this year" or
+"yesterday" rendered as 2026 or '2026-10-15' would be replayed unchanged next year.
+Slot values come from fixed vocabularies or strict patterns, so filling is injection-safe.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date, timedelta
+
+from queryParser import MONTHS, CATEGORIES, CATEGORY_ALIASES
+from structuredLog import log_event
+
+SQL_PLAN_CACHE_FILE = os.getenv("SQL_PLAN_CACHE_FILE", ".sql_plan_cache.json")
+SQL_PLAN_CACHE_MAX = int(os.getenv("SQL_PLAN_CACHE_MAX", "2000"))
+
+_CATEGORY_WORDS = sorted(set(CATEGORIES) | set(CATEGORY_ALIASES), key=len, reverse=True)
+_SLOT_PATTERN = re.compile(
+    r"(?P<date>\b\d{4}-\d{2}-\d{2}\b)"
+    r"|(?P<year>\b20\d{2}\b)"
+    r"|(?P<month>\b(?:" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\b)"
+    r"|(?P<category>\b(?:" + "|".join(re.escape(c) for c in _CATEGORY_WORDS) + r")\b)"
+    r"|(?P<number>\b\d+(?:\.\d+)?\b)"
+)
+_WHITESPACE = re.compile(r"\s+")
+# dates and years still in a template after parameterization: fixed by the LLM, not the question
+_UNBOUND_DATE = re.compile(r"\b\d{4}-\d{2}-\d{2}\b|(?<![\w.{])(?:19|20)\d{2}(?![\w.}])")
+
+
+def _normalize(question):
+    return _WHITESPACE.sub(" ", question.lower()).strip().rstrip("?.! ")
+
+
+def extract_slots(question):
+    """(template key, [(slot type, surface text, value), ...]) for a question."""
+    text = _normalize(question)
+    slots, parts, last = [], [], 0
+    for match in _SLOT_PATTERN.finditer(text):
+        kind = match.lastgroup
+        surface = match.group(kind)
+        if kind == "date":
+            try:
+                value = date.fromisoformat(surface)
+            except ValueError:
+                continue
+        elif kind == "month":
+            value = MONTHS[surface]
+        elif kind == "category":
+            value = surface
+        else:
+            value = surface
+        parts.append(text[last:match.start()])
+        parts.append(f"<{kind}>")
+        last = match.end()
+        slots.append((kind, surface, value))
+    parts.append(text[last:])
+    return "".join(parts), slots
+
+
+def _month_clause_pattern(value):
+    # EXTRACT(MONTH FROM date) = 9   /   EXTRACT(MONTH FROM date) IN (9, 10)
+    return re.compile(
+        r"(EXTRACT\s*\(\s*MONTH\s+FROM\s+\"?date\"?\s*\)\s*(?:=\s*|IN\s*\((?:[^)]*?[\s,])?))" + str(value) + r"\b",
+        re.IGNORECASE,
+    )
+
+
+def _parameterize(sql, slots):
+    """Replace every slot's rendering in the SQL with a placeholder, or return None."""
+    template = sql.replace("{", "{{").replace("}", "}}")
+    counters = {}
+    for kind, surface, value in slots:
+        idx = counters.get(kind, 0)
+        counters[kind] = idx + 1
+        name = f"{kind}{idx}"
+
+        if kind == "month":
+            pattern = _month_clause_pattern(value)
+            if not pattern.search(template):
+                return None
+            template = pattern.sub(lambda m: m.group(1) + "{" + name + "}", template, count=1)
+
+        elif kind == "date":
+            literal = f"'{value.isoformat()}'"
+            if literal not in template:
+                return None
+            template = template.replace(literal, "'{" + name + "}'")
+            following = f"'{(value + timedelta(days=1)).isoformat()}'"
+            template = template.replace(following, "'{" + name + "_next}'")
+
+        elif kind == "category":
+            canonical = CATEGORY_ALIASES.get(value, value)
+            for form, suffix in ((surface, ""), (canonical, "_canonical")):
+                literal = f"%{form}%"
+                hit = re.search(re.escape(literal), template, re.IGNORECASE)
+                if hit:
+                    template = template[:hit.start()] + "%{" + name + suffix + "}%" + template[hit.end():]
+                    break
+            else:
+                return None
+
+        else:  # year / number: a standalone literal
+            pattern = re.compile(r"(?<![\w.'-])" + re.escape(surface) + r"(?![\w.'-])")
+            if not pattern.search(template):
+                return None
+            template = pattern.sub("{" + name + "}", template, count=1)
+
+    if _UNBOUND_DATE.search(template):
+        return None
+    return template
+
+
+def _fill_values(slots):
+    values, counters = {}, {}
+    for kind, surface, value in slots:
+        idx = counters.get(kind, 0)
+        counters[kind] = idx + 1
+        name = f"{kind}{idx}"
+        if kind == "date":
+            values[name] = value.isoformat()
+            values[f"{name}_next"] = (value + timedelta(days=1)).isoformat()
+        elif kind == "category":
+            values[name] = surface
+            values[f"{name}_canonical"] = CATEGORY_ALIASES.get(value, value)
+        else:
+            values[name] = value
+    return values
+
+
+class SqlPlanCache:
+    def __init__(self, path=SQL_PLAN_CACHE_FILE, max_templates=SQL_PLAN_CACHE_MAX):
+        self.path = path
+        self.max_templates = max_templates
+        self.templates = {}
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "learned": 0, "unlearnable": 0}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.templates = json.load(f)
+        except Exception as e:
+            log_event("sql_plan_cache.unreadable", logging.WARNING, path=self.path, error=str(e))
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.templates, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def lookup(self, question):
+        """SQL for a question that matches a learned template, else None."""
+        key, slots = extract_slots(question)
+        with self.lock:
+            template = self.templates.get(key)
+            if template is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+        try:
+            return template.format(**_fill_values(slots))
+        except (KeyError, IndexError, ValueError):
+            return None
+
+    def learn(self, question, sql):
+        """Remember the template behind a question/SQL pair that executed successfully."""
+        key, slots = extract_slots(question)
+        template = _parameterize(sql, slots)
+        with self.lock:
+            if template is None:
+                self.counters["unlearnable"] += 1
+                return False
+            if key not in self.templates and len(self.templates) >= self.max_templates:
+                self.templates.pop(next(iter(self.templates)))
+            self.templates[key] = template
+            self.counters["learned"] += 1
+            try:
+                self._save()
+            except OSError as e:
+                log_event("sql_plan_cache.write_failed", logging.WARNING, path=self.path, error=str(e))
+            return True
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "templates": len(self.templates),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_sql_plan_cache():
+    """Process-wide cache, read from SQL_PLAN_CACHE_FILE on first use rather than at import."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SqlPlanCache()
+    return _cache
@@ -0,0 +1,101 @@
+# startupBenchmark.py
+"""
+Startup benchmark for main.app.
+
+Reports how long `import main` takes in a fresh interpreter (the cold-start cost
+paid on every new instance), then starts the app in-process and times the first
+/live, /ready and, optionally, /api/retrieve requests. Readiness is polled until
+the background client warm-up finishes or --ready-timeout passes.
+
+Usage:
+    python startupBenchmark.py
+    python startupBenchmark.py --runs 5 --budget-ms 800
+    python startupBenchmark.py --query "how much did I spend on food" --user-id u1 --account-id a1
+
+Exits with status 1 when the median import time is over --budget-ms.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+_IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print((time.perf_counter() - t) * 1000)"
+
+
+def measure_import(runs):
+    """Wall time of `import main` in `runs` fresh interpreters, in ms."""
+    times = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _IMPORT_SNIPPET], cwd=HERE,
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def _timed(call):
+    started = time.perf_counter()
+    response = call()
+    return response, (time.perf_counter() - started) * 1000
+
+
+def measure_first_requests(query=None, user_id=None, account_id=None, ready_timeout=30.0):
+    from fastapi.testclient import TestClient
+
+    sys.path.insert(0, HERE)
+    import main
+
+    results = {}
+    started = time.perf_counter()
+    with TestClient(main.app) as client:
+        results["lifespan_ms"] = (time.perf_counter() - started) * 1000
+        response, results["first_live_ms"] = _timed(lambda: client.get("/live"))
+        results["live_status"] = response.status_code
+
+        deadline = time.perf_counter() + ready_timeout
+        while True:
+            response, elapsed = _timed(lambda: client.get("/ready"))
+            results.setdefault("first_ready_ms", elapsed)
+            body = response.json()
+            if response.status_code == 200 or body.get("status") == "failed" or time.perf_counter() > deadline:
+                break
+            time.sleep(0.05)
+        results["ready_status"] = body.get("status")
+        results["ready_after_ms"] = (time.perf_counter() - started) * 1000
+        results["warm_ms"] = body.get("warm_ms")
+        if body.get("error"):
+            results["ready_error"] = body["error"]
+
+        if query:
+            response, results["first_retrieve_ms"] = _timed(lambda: client.post(
+                "/api/retrieve", json={"query": query, "userId": user_id, "accountId": account_id}))
+            results["retrieve_status"] = response.status_code
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and first-request latency of main.app")
+    parser.add_argument("--runs", type=int, default=3, help="fresh-interpreter imports to time")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail when the median import is slower")
+    parser.add_argument("--query", default=None, help="also time a first /api/retrieve call")
+    parser.add_argument("--user-id", default=None)
+    parser.add_argument("--account-id", default=None)
+    parser.add_argument("--ready-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    imports = measure_import(args.runs)
+    median = statistics.median(imports)
+    print(f"import main: median {median:.0f} ms, min {min(imports):.0f} ms, max {max(imports):.0f} ms ({args.runs} runs)")
+
+    for name, value in measure_first_requests(args.query, args.user_id, args.account_id, args.ready_timeout).items():
+        print(f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}")
+
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"❌ import time {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# structuredLog.py
+"""
+Structured, non-blocking logging for the request and webhook hot paths.
+
+fetching and worker used to print() full SQL result sets and webhook payloads
+synchronously from inside async handlers, and the embedding ingest path printed a
+line per row. They now call log_event(), which:
+
+  - drops the event straight away if its level is disabled or it is sampled out
+    (LOG_SAMPLE_RATES="sql.rows=0.1,webhook.received=0.05"; WARNING and above are never sampled)
+  - puts the record on a bounded queue (QueueHandler) and returns. A QueueListener thread
+    formats and writes it. When the queue is full, records are dropped and counted, so
+    callers never block.
+  - formats one line per event, as text or JSON (LOG_FORMAT), after redacting secrets.
+    Values under secret-looking keys, JWTs and the configured API keys are replaced by
+    [redacted].
+
+preview_rows() caps what a row list contributes: the first LOG_PREVIEW_ROWS rows,
+each cut to LOG_PREVIEW_CHARS characters. It is cheap enough to call on every request.
+
+    from structuredLog import log_event, preview_rows
+    log_event("sql.rows", count=len(rows), preview=preview_rows(rows))
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from dotenv import load_dotenv
+
+load_dotenv()  # the key values below are redacted wherever they show up
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PREVIEW_ROWS = int(os.getenv("LOG_PREVIEW_ROWS", "3"))
+LOG_PREVIEW_CHARS = int(os.getenv("LOG_PREVIEW_CHARS", "300"))
+
+
+def _parse_rates(spec):
+    rates = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+# per-row ingest events, one per embedded row; LOG_SAMPLE_RATES overrides these per event
+DEFAULT_SAMPLE_RATES = {"embedding.upserted": 0.1, "embedding.stale": 0.1, "embedding.batch_upserted": 0.1}
+LOG_SAMPLE_RATES = {**DEFAULT_SAMPLE_RATES, **_parse_rates(os.getenv("LOG_SAMPLE_RATES", ""))}
+
+# 🔹 Redaction
+# key names like password, client_secret, access_token, x-api-key (but not "tokens" or "author")
+SECRET_KEY = re.compile(
+    r"(^|[_-])(pass(word|wd)?|secret|token|api[_-]?key|apikey|authorization|auth|cookie|credentials?)$",
+    re.IGNORECASE)
+_JWT = re.compile(r"eyJ[\w-]{8,}\.[\w-]{8,}\.[\w-]+")
+_SECRET_VALUES = [v for v in (os.getenv(name) for name in ("SUPABASE_KEY", "GEMINI_API_KEY")) if v and len(v) >= 8]
+REDACTED = "[redacted]"
+
+
+def redact(value, key=None):
+    """Copy of value with secrets replaced; non-JSON types are turned into strings."""
+    if key is not None and SECRET_KEY.search(str(key)):
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    for secret in _SECRET_VALUES:
+        if secret in text:
+            text = text.replace(secret, REDACTED)
+    return _JWT.sub(REDACTED, text)
+
+
+def preview_rows(rows, limit=None, max_chars=None):
+    """First `limit` rows of a result set, each cut to `max_chars` characters of JSON."""
+    if not isinstance(rows, (list, tuple)):
+        rows = [rows]
+    limit = LOG_PREVIEW_ROWS if limit is None else limit
+    max_chars = LOG_PREVIEW_CHARS if max_chars is None else max_chars
+    preview = []
+    for row in rows[:limit]:
+        text = json.dumps(row, default=str)
+        preview.append(text if len(text) <= max_chars else text[:max_chars] + "…")
+    return preview
+
+
+# 🔹 Formatting (runs on the listener thread)
+
+class _StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt):
+        super().__init__()
+        self.fmt = fmt
+
+    def format(self, record):
+        fields = redact(getattr(record, "fields", None) or {})
+        event = getattr(record, "event", None) or record.getMessage()
+        if self.fmt == "json":
+            line = {"ts": round(record.created, 6), "level": record.levelname, "logger": record.name,
+                    "event": event, **fields}
+            if record.exc_text:
+                line["exc"] = record.exc_text
+            return json.dumps(line, default=str)
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        parts = [f"{stamp}.{int(record.msecs):03d}", record.levelname, event]
+        parts += [f"{k}={v if isinstance(v, str) and ' ' not in v else json.dumps(v, default=str)}"
+                  for k, v in fields.items()]
+        text = " ".join(parts)
+        return f"{text}\n{record.exc_text}" if record.exc_text else text
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped and counted."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the message is the event name; fields are formatted later on the listener thread
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_handler = _DroppingQueueHandler(_queue)
+_listener = None
+
+logger = logging.getLogger("rag")
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(_handler)
+logger.propagate = False
+_lock = threading.Lock()
+
+
+def start_logging():
+    """Start the listener thread (idempotent; log_event calls it on first use)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(_StructuredFormatter(LOG_FORMAT))
+        _listener = QueueListener(_queue, output, respect_handler_level=False)
+        _listener.start()
+
+
+def stop_logging():
+    """Flush queued records and stop the listener (called from main's lifespan and at exit)."""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+atexit.register(stop_logging)
+
+
+def _sampled(event, level):
+    if level >= logging.WARNING:
+        return True
+    rate = LOG_SAMPLE_RATES.get(event)
+    return rate is None or random.random() < rate
+
+
+def log_event(event, level=logging.INFO, exc_info=None, **fields):
+    """Log one structured event: a dotted name plus key=value fields."""
+    if not logger.isEnabledFor(level) or not _sampled(event, level):
+        return
+    if _listener is None:
+        start_logging()
+    logger.log(level, event, exc_info=exc_info, extra={"event": event, "fields": fields})
+
+
+def log_stats():
+    return {"queued": _queue.qsize(), "dropped": _handler.dropped, "format": LOG_FORMAT,
+            "level": LOG_LEVEL, "sample_rates": LOG_SAMPLE_RATES}
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the modules live at the repository root, next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# state files the modules open by default go to a scratch directory, never the checkout
+_SCRATCH = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("EMBED_CACHE_DISK", "0")
+os.environ.setdefault("INGEST_QUEUE_DB", os.path.join(_SCRATCH, "ingest_queue.db"))
+os.environ.setdefault("SQL_PLAN_CACHE_FILE", os.path.join(_SCRATCH, "sql_plans.json"))
+os.environ.setdefault("VECTOR_INDEX_DIR", os.path.join(_SCRATCH, "vector_index"))
+os.environ.setdefault("ANN_INDEX_DIR", os.path.join(_SCRATCH, "ann_index"))
+os.environ.setdefault("ROLLUP_DB", os.path.join(_SCRATCH, "rollups.db"))
+
+
+@pytest.fixture
+def fake_clients():
+    """FakeSupabase and FakeGenAI installed as the shared clients for one test."""
+    import clients
+    from fakes import FakeGenAI, FakeSupabase
+
+    supabase, genai = FakeSupabase(), FakeGenAI()
+    clients.install(supabase_client=supabase, genai_module=genai)
+    yield supabase, genai
+    clients.close_clients()
+    clients._genai = None
+    clients._models.clear()
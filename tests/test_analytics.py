@@ -0,0 +1,58 @@
+from datetime import date
+
+from analytics import TransactionFrame, analyze, detect_periods, facts_to_text, month_label
+
+TODAY = date(2026, 10, 16)
+
+
+def _rows():
+    rows = []
+    for day, category, amount in [("2026-07-03", "food", 120.0), ("2026-07-19", "travel", 300.0),
+                                  ("2026-08-02", "food", 90.0), ("2026-08-21", "travel", 40.0)]:
+        rows.append({"id": day, "type": "EXPENSE", "amount": amount, "date": day, "category": category,
+                     "description": category})
+    return rows
+
+
+def test_named_months_in_the_data_are_compared():
+    frame = TransactionFrame.from_records(_rows())
+    first, second = detect_periods("compare july and august spending", frame, today=TODAY)
+    assert (month_label(first), month_label(second)) == ("2026-07", "2026-08")
+
+
+def test_named_months_missing_from_the_data_are_not_swapped_for_other_months():
+    frame = TransactionFrame.from_records(_rows())
+    first, second = detect_periods("compare march and june spending", frame, today=TODAY)
+    assert (month_label(first), month_label(second)) == ("2026-03", "2026-06")
+
+    facts = analyze("compare march and june spending", _rows(), today=TODAY)
+    comparison = facts["comparison"]
+    assert (comparison["from"], comparison["to"]) == ("2026-03", "2026-06")
+    assert comparison["total_from"] == comparison["total_to"] == 0
+    assert comparison["transactions_from"] == comparison["transactions_to"] == 0
+    assert "Spending 2026-03: 0.00 over 0 transactions" in facts_to_text(facts)
+
+
+def test_single_missing_month_compares_with_the_month_before():
+    frame = TransactionFrame.from_records(_rows())
+    first, second = detect_periods("why did my spending increase in september", frame, today=TODAY)
+    assert (month_label(first), month_label(second)) == ("2026-08", "2026-09")
+
+
+def test_unnamed_periods_fall_back_to_the_latest_months():
+    frame = TransactionFrame.from_records(_rows())
+    first, second = detect_periods("how has my spending changed", frame, today=TODAY)
+    assert (month_label(first), month_label(second)) == ("2026-07", "2026-08")
+
+
+def test_named_months_are_resolved_together_against_today():
+    rows = [{"id": day, "type": "EXPENSE", "amount": 50.0, "date": day, "category": "food"}
+            for day in ("2024-09-10", "2024-10-10", "2025-09-10")]
+    frame = TransactionFrame.from_records(rows)
+    today = date(2025, 10, 2)
+    first, second = detect_periods("compare my spending in september vs october", frame, today=today)
+    assert (month_label(first), month_label(second)) == ("2025-09", "2025-10")
+    first, second = detect_periods("compare my spending in october vs september", frame, today=today)
+    assert (month_label(first), month_label(second)) == ("2025-09", "2025-10")
+    first, second = detect_periods("compare december and january", frame, today=today)
+    assert (month_label(first), month_label(second)) == ("2024-12", "2025-01")
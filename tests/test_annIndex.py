@@ -0,0 +1,76 @@
+import threading
+
+import numpy as np
+
+from annIndex import AnnVectorIndex, IVFPQIndex, synthetic_embeddings
+
+
+def _record(i, user="u1"):
+    return {"source_table": "transactions", "source_id": f"t{i}", "user_id": user, "account_id": "a1",
+            "chunk_text": f"row {i}", "metadata": {}}
+
+
+def test_refined_search_recalls_most_of_the_exact_top_k():
+    data = synthetic_embeddings(3000, seed=1)
+    index = IVFPQIndex(nlist=16, nprobe=8, refine=4, train_size=len(data))
+    index.add(range(len(data)), data)
+    assert index.trained
+
+    queries = data[np.random.default_rng(2).choice(len(data), 50, replace=False)]
+    hits = 0
+    for q in queries:
+        exact = set(np.argpartition(-(data @ q), 9)[:10].tolist())
+        hits += len(exact & {key for key, _ in index.search(q, k=10)})
+    assert hits / (10 * len(queries)) >= 0.85
+
+
+def test_remove_and_compaction_keep_deleted_keys_out_of_results():
+    data = synthetic_embeddings(1200, seed=3)
+    index = IVFPQIndex(nlist=8, nprobe=8, train_size=1000)
+    index.add(range(len(data)), data)
+    for key in range(0, 600):
+        index.remove(key)
+    found = {key for q in data[:20] for key, _ in index.search(q, k=10)}
+    assert found and all(key >= 600 for key in found)
+    assert len(index) == 600
+
+
+def test_training_runs_off_the_upsert_thread(tmp_path, monkeypatch):
+    release, started = threading.Event(), threading.Event()
+    fit = IVFPQIndex.fit
+
+    def slow_fit(self, *args):
+        started.set()
+        release.wait(10)
+        return fit(self, *args)
+    monkeypatch.setattr(IVFPQIndex, "fit", slow_fit)
+
+    data = synthetic_embeddings(320, seed=4)
+    backend = AnnVectorIndex(directory=str(tmp_path), flush_seconds=0, nlist=4, train_size=300)
+    for i, vec in enumerate(data):
+        backend.upsert(_record(i), vec)  # returns while the partition trains
+    assert started.wait(5) and ("u1", "a1") in backend.training
+    assert backend.match(data[0], "u1", "a1", top_k=1)[0]["source_id"] == "t0"
+
+    release.set()
+    backend.drain(10)
+    index, _ = backend.partitions[("u1", "a1")]
+    assert index.trained and len(index) == len(data)
+
+
+def test_snapshot_restores_upserts_and_removals(tmp_path):
+    data = synthetic_embeddings(400, seed=5)
+    backend = AnnVectorIndex(directory=str(tmp_path), nlist=4, train_size=300)
+    for i, vec in enumerate(data):
+        backend.upsert(_record(i), vec)
+    backend.remove("t0")
+    backend.patch_metadata("t1", {"note": "patched"})
+    backend.drain(30)
+    backend.flush()
+
+    restored = AnnVectorIndex(directory=str(tmp_path))
+    index, docs = restored.partitions[("u1", "a1")]
+    assert index.trained and len(index) == len(data) - 1 and "t0" not in docs
+    hit = restored.match(data[1], "u1", "a1", top_k=1)[0]
+    assert hit["source_id"] == "t1" and hit["metadata"] == {"note": "patched"}
+    assert all(h["source_id"] != "t0" for h in restored.match(data[0], "u1", "a1", top_k=5))
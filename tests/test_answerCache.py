@@ -0,0 +1,100 @@
+import pytest
+
+import answerCache
+from answerCache import AnswerCache
+
+EMB = [1.0, 0.0, 0.0]
+
+
+def _cached(cache, query, version, embedding=None):
+    return cache.get("u1", "a1", query, embedding, version=version)
+
+
+def test_paraphrases_hit_but_other_months_do_not():
+    cache = AnswerCache(versions="local")
+    version = cache.current_version("u1")
+    cache.put("u1", "a1", "How much did I spend in September?", {"answer": "100"}, EMB, version=version)
+    assert _cached(cache, "how much did i spend in september", version) == ({"answer": "100"}, "exact")
+    assert _cached(cache, "what did I spend in september", version, EMB)[1] == "semantic"
+    assert _cached(cache, "what did I spend in october", version, EMB) is None
+
+
+def test_invalidate_drops_the_account_and_retires_the_version():
+    cache = AnswerCache(versions="local")
+    before = cache.current_version("u1")
+    cache.put("u1", "a1", "total spent", {"answer": "1"}, version=before)
+    cache.put("u1", "a2", "total spent", {"answer": "2"}, version=before)
+    cache.invalidate("u1", "a1")
+    after = cache.current_version("u1")
+    assert after != before
+    assert cache.get("u1", "a1", "total spent", version=after) is None
+    assert cache.get("u1", "a2", "total spent", version=after) is None  # the user's version moved on
+
+    # an answer computed from data read before the invalidation is not stored
+    cache.put("u1", "a1", "total spent", {"answer": "stale"}, version=before)
+    assert cache.get("u1", "a1", "total spent", version=after) is None
+
+
+def test_follow_ups_are_keyed_by_the_conversation():
+    cache = AnswerCache(versions="local")
+    cache.put("u1", "a1", "and last month?", {"answer": "food"}, version=0, context="aaa")
+    assert cache.get("u1", "a1", "and last month?", version=0, context="aaa")
+    assert cache.get("u1", "a1", "and last month?", version=0, context="bbb") is None
+
+
+def test_a_missing_data_versions_table_falls_back_to_local_once(monkeypatch):
+    calls = []
+
+    def missing():
+        calls.append(1)
+        raise Exception('relation "data_versions" does not exist')
+    monkeypatch.setattr(answerCache, "_probe_data_versions", missing)
+    monkeypatch.setattr(answerCache, "_supabase_version", lambda user_id: pytest.fail("queried per request"))
+
+    cache = AnswerCache(versions="supabase")
+    assert cache.current_version("u1") == 0
+    assert cache.current_version("u2") == 0
+    assert cache.versions == "local" and len(calls) == 1
+
+
+def test_supabase_versions_follow_the_trigger(fake_clients):
+    supabase, _ = fake_clients
+    cache = AnswerCache(versions="supabase")
+    assert cache.probe_versions() == "supabase"
+    before = cache.current_version("u1")
+    supabase.add_transactions([{"id": "t1", "userId": "u1", "accountId": "a1", "amount": 1.0}])
+    assert cache.current_version("u1") != before
+
+
+def test_invalidation_leaves_other_users_alone():
+    cache = AnswerCache(versions="local")
+    for user in ("u1", "u2"):
+        cache.put(user, "a1", "total spent", {"answer": user}, version=cache.current_version(user))
+    cache.invalidate("u1")
+    assert cache.get("u2", "a1", "total spent", version=cache.current_version("u2")) == ({"answer": "u2"}, "exact")
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_generations_are_bounded_with_the_users():
+    cache = AnswerCache(versions="local", max_users=3)
+    for i in range(20):
+        user = f"u{i}"
+        cache.put(user, "a1", "total spent", {"answer": i}, version=cache.current_version(user))
+        cache.invalidate(user)
+        cache.invalidate(f"gone{i}")  # a user with nothing cached
+    assert len(cache.users) == len(cache.generations) == 3
+
+
+def test_an_answer_computed_before_an_invalidation_is_not_stored_after_eviction():
+    cache = AnswerCache(versions="local", max_users=1)
+    stale = cache.current_version("u1")  # an answer for u1 starts computing
+    cache.invalidate("u1")               # u1 has nothing cached
+    cache.put("u1", "a1", "total spent", {"answer": "stale"}, version=stale)
+    assert cache.get("u1", "a1", "total spent", version=cache.current_version("u1")) is None
+
+    version = cache.current_version("u1")
+    cache.put("u1", "a1", "total spent", {"answer": "1"}, version=version)
+    cache.invalidate("u1")
+    cache.put("u2", "a1", "total spent", {"answer": "2"}, version=cache.current_version("u2"))  # evicts u1
+    cache.put("u1", "a1", "total spent", {"answer": "stale"}, version=version)
+    assert cache.get("u1", "a1", "total spent", version=cache.current_version("u1")) is None
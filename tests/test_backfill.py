@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import backfill
+
+IDS = [f"{i:02d}" for i in range(0, 50, 2)]  # even ids, so there is room to add rows between them
+
+
+def _txn(id):
+    return {"id": id, "type": "EXPENSE", "amount": 10.0, "description": f"backfill row {id}", "date": "2026-03-05",
+            "category": "food", "userId": "u1", "accountId": "a1", "createdAt": "2026-03-05T10:00:00"}
+
+
+def _run(tmp_path, **kwargs):
+    backfill.run_backfill(tables=["transactions"], workers=2, rpm=1e6, page_size=10, batch_size=3,
+                          checkpoint_path=str(tmp_path / "checkpoint.json"), rollups=False, **kwargs)
+    with open(tmp_path / "checkpoint.json") as f:
+        return json.load(f)["transactions"]
+
+
+def _embedded(supabase):
+    return sorted(source_id for (_, source_id), row in supabase.embeddings.items() if not row["deleted"])
+
+
+@pytest.fixture
+def source(fake_clients):
+    supabase, _ = fake_clients
+    supabase.add_transactions([_txn(id) for id in IDS])
+    return supabase
+
+
+def test_every_page_is_embedded_and_rows_with_an_embedding_are_skipped(source, tmp_path):
+    source.seed_embeddings([_txn("04"), _txn("30")], lambda text: [1.0] * 384)
+    state = _run(tmp_path)
+    assert _embedded(source) == IDS
+    assert state == {"last_id": IDS[-1], "done": True}
+    assert source.calls["transactions.select"] == 3  # 25 rows in pages of 10
+    assert source.embeddings[("transactions", "04")]["version"] == 0  # not embedded again
+
+
+def test_the_diff_is_chunked(source):
+    source.seed_embeddings([_txn(id) for id in IDS[:7]], lambda text: [1.0] * 384)
+    assert backfill.existing_source_ids("transactions", IDS, chunk_size=4) == set(IDS[:7])
+    assert source.calls["embeddingsnew.select"] == 7  # ceil(25 / 4)
+
+
+def test_a_failed_batch_holds_the_checkpoint_and_is_retried(source, tmp_path, monkeypatch):
+    embed_batch = backfill.embed_batch
+
+    def flaky(table_name, rows, limiter, **kwargs):
+        if any(row["id"] == "26" for row in rows):
+            raise RuntimeError("rate limited")
+        return embed_batch(table_name, rows, limiter, **kwargs)
+
+    monkeypatch.setattr(backfill, "embed_batch", flaky)
+    state = _run(tmp_path)
+    # page two is 20..38 in batches of three: 20 22 24 | 26 28 30 | ...
+    assert state == {"last_id": "24", "done": False}
+    assert "26" not in _embedded(source) and "48" in _embedded(source)  # later pages still ran
+
+    monkeypatch.setattr(backfill, "embed_batch", embed_batch)
+    state = _run(tmp_path)
+    assert _embedded(source) == IDS
+    assert state == {"last_id": IDS[-1], "done": True}
+
+
+def test_an_interrupted_run_resumes_after_the_last_finished_page(source, tmp_path, monkeypatch):
+    fetch_page = backfill.fetch_page
+    fetched = []
+
+    def failing(table_name, after_id, page_size=backfill.PAGE_SIZE):
+        fetched.append(after_id)
+        if after_id == "18":
+            raise ConnectionError("supabase unreachable")
+        return fetch_page(table_name, after_id, page_size)
+
+    monkeypatch.setattr(backfill, "fetch_page", failing)
+    assert _run(tmp_path) == {"last_id": "18", "done": False}
+    assert _embedded(source) == IDS[:10]
+
+    fetched.clear()
+    monkeypatch.setattr(backfill, "fetch_page", lambda *args: fetched.append(args[1]) or fetch_page(*args))
+    assert _run(tmp_path) == {"last_id": IDS[-1], "done": True}
+    assert fetched[0] == "18"
+    assert _embedded(source) == IDS
+
+
+def test_rows_added_after_a_complete_run_are_found_wherever_their_id_sorts(source, tmp_path):
+    _run(tmp_path)
+    source.add_transactions([_txn("03"), _txn("99")])  # uuids don't arrive in id order
+    state = _run(tmp_path)
+    assert _embedded(source) == sorted(IDS + ["03", "99"])
+    assert state == {"last_id": "99", "done": True}
@@ -0,0 +1,43 @@
+from contextBuilder import build_context, estimate_tokens
+
+
+def _txn(i, day, amount=10.0, category="food"):
+    return {"id": f"t{i}", "userId": "u1", "accountId": "a1", "type": "EXPENSE", "amount": amount,
+            "description": f"purchase {i}", "date": f"{day}T00:00:00", "category": category,
+            "receiptUrl": None, "createdAt": "2026-01-01T00:00:00"}
+
+
+def test_small_results_are_one_projected_csv_table():
+    built = build_context([_txn(1, "2026-03-02"), _txn(2, "2026-03-01", 25.5, "travel")])
+    assert built.text.splitlines() == [
+        "date,type,amount,category,description",
+        "2026-03-02,EXPENSE,10,food,purchase 1",
+        "2026-03-01,EXPENSE,25.5,travel,purchase 2",
+    ]
+    assert not built.aggregated and built.rows_included == 2
+    assert built.tokens < built.legacy_tokens
+
+
+def test_large_results_are_summarised_and_capped_to_the_budget():
+    records = [_txn(i, f"2026-{1 + i % 6:02d}-{1 + i % 28:02d}", amount=i, category=("food", "rent")[i % 2])
+               for i in range(400)]
+    built = build_context(records, budget=400)
+    assert built.aggregated
+    assert built.tokens <= 400
+    assert 0 < built.rows_included < 400
+    assert built.text.startswith("SUMMARY (computed over all 400 rows):")
+    assert f"{400 - built.rows_included} more rows not shown; they are included in the summary" in built.text
+    assert f"EXPENSE,400,{sum(range(400)):.2f}" in built.text  # the totals cover every row
+
+
+def test_the_rows_kept_are_the_most_recent():
+    records = [_txn(i, f"2026-03-{1 + i:02d}") for i in range(28)]
+    built = build_context(records, budget=estimate_tokens(build_context(records).text) // 2)
+    section = built.text.split("ROWS:\n", 1)[1].splitlines()
+    dates = [line.split(",")[0] for line in section[1:] if line.startswith("2026-")]
+    assert dates == sorted(dates, reverse=True)
+    assert dates[0] == "2026-03-28" and len(dates) == built.rows_included
+
+
+def test_no_records():
+    assert build_context([]).text == "No records were found."
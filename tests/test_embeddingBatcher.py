@@ -0,0 +1,65 @@
+import pytest
+
+from embeddingBatcher import EmbeddingBatcher
+
+
+def _txn(id, description):
+    return {"id": id, "type": "EXPENSE", "amount": 10.0, "description": description, "date": "2026-03-05",
+            "category": "food", "userId": "u1", "accountId": "a1", "updatedAt": "2026-03-05T10:00:00"}
+
+
+def _submit(batcher, *rows):
+    return [batcher.submit("transactions", row, row["description"]) for row in rows]
+
+
+@pytest.fixture
+def batcher():
+    return EmbeddingBatcher(max_items=3, max_wait_ms=1000)
+
+
+def test_an_empty_embedding_fails_only_its_own_row(fake_clients, batcher, monkeypatch):
+    supabase, genai = fake_clients
+    embed = genai.embed_content
+
+    def embed_content(content=None, **kwargs):
+        result = embed(content=content, **kwargs)
+        result["embedding"] = [[] if "broken" in text else emb for text, emb in zip(content, result["embedding"])]
+        return result
+
+    monkeypatch.setattr(genai, "embed_content", embed_content)
+    ok, broken, also_ok = _submit(batcher, _txn("b1", "partial lunch"), _txn("b2", "partial broken"),
+                                  _txn("b3", "partial dinner"))
+    assert ok.result(timeout=5) and also_ok.result(timeout=5)
+    with pytest.raises(RuntimeError, match="empty embedding for b2"):
+        broken.result(timeout=5)
+    assert {key[1] for key in supabase.embeddings} == {"b1", "b3"}
+
+
+def test_a_failed_batch_call_fails_every_row(fake_clients, batcher, monkeypatch):
+    supabase, genai = fake_clients
+
+    def embed_content(**kwargs):
+        raise ConnectionError("gemini unreachable")
+
+    monkeypatch.setattr(genai, "embed_content", embed_content)
+    futures = _submit(batcher, _txn("f1", "failing lunch"), _txn("f2", "failing dinner"), _txn("f3", "failing tea"))
+    for future in futures:
+        with pytest.raises(RuntimeError, match="batch embedding failed for 3 rows"):
+            future.result(timeout=5)
+    assert supabase.embeddings == {}
+
+
+def test_a_raising_listener_does_not_fail_the_rows_or_the_other_listeners(fake_clients, batcher):
+    supabase, _ = fake_clients
+    seen = []
+
+    def broken_listener(record, embedding):
+        raise ValueError("index unavailable")
+
+    batcher.add_listener(broken_listener)
+    batcher.add_listener(lambda record, embedding: seen.append(record["source_id"]))
+    futures = _submit(batcher, _txn("l1", "listener lunch"), _txn("l2", "listener dinner"),
+                      _txn("l3", "listener tea"))
+    assert [future.result(timeout=5) for future in futures] == [True, True, True]
+    assert sorted(seen) == ["l1", "l2", "l3"]
+    assert len(supabase.embeddings) == 3
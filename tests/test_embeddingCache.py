@@ -0,0 +1,69 @@
+import os
+import threading
+
+from embeddingCache import EmbeddingCache
+
+MODEL, TASK, DIM = "gemini-embedding-001", "retrieval_document", 4
+
+
+def _vec(i):
+    return [float(i), 1.0, 2.0, 3.0]
+
+
+def _cache(tmp_path, **kwargs):
+    return EmbeddingCache(directory=str(tmp_path), **{"disk": True, **kwargs})
+
+
+def test_the_least_recently_used_entry_is_evicted(tmp_path):
+    cache = _cache(tmp_path, max_entries=2, disk=False)
+    cache.put(MODEL, TASK, DIM, "a", _vec(1))
+    cache.put(MODEL, TASK, DIM, "b", _vec(2))
+    assert cache.get(MODEL, TASK, DIM, "a") == _vec(1)  # b is now the oldest
+    cache.put(MODEL, TASK, DIM, "c", _vec(3))
+
+    assert cache.get(MODEL, TASK, DIM, "b") is None
+    assert cache.get(MODEL, TASK, DIM, "a") == _vec(1)
+    assert cache.get(MODEL, TASK, DIM, "c") == _vec(3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_vectors_are_read_back_from_disk_after_a_restart(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put(MODEL, TASK, DIM, "coffee  at the cafe", _vec(1))
+    cache.put(MODEL, TASK, DIM, "rent", _vec(2))
+
+    restarted = _cache(tmp_path)
+    assert restarted.get(MODEL, TASK, DIM, "coffee at the cafe") == _vec(1)  # same normalized text
+    assert restarted.get(MODEL, TASK, DIM, "rent") == _vec(2)
+    assert restarted.get(MODEL, TASK, DIM, "groceries") is None
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["misses"]) == (2, 1)
+    assert restarted.get(MODEL, TASK, DIM, "rent") == _vec(2)
+    assert restarted.stats()["memory_hits"] == 1  # promoted into memory
+
+
+def test_a_full_disk_tier_is_compacted_to_its_newest_vectors(tmp_path):
+    cache = _cache(tmp_path, disk_max_entries=4)
+    other = _cache(tmp_path, disk_max_entries=4)   # a second process sharing the directory
+    assert other.get(MODEL, TASK, DIM, "t0") is None
+    for i in range(5):
+        cache.put(MODEL, TASK, DIM, f"t{i}", _vec(i))
+
+    assert os.path.getsize(tmp_path / f"vectors_{DIM}.f32") == 3 * DIM * 4
+    restarted = _cache(tmp_path)
+    assert [restarted.get(MODEL, TASK, DIM, f"t{i}") for i in range(5)] == [None, None, _vec(2), _vec(3), _vec(4)]
+    # the other process re-reads the compacted files instead of trusting its old slots
+    assert other.get(MODEL, TASK, DIM, "t4") == _vec(4)
+    assert other.get(MODEL, TASK, DIM, "t0") is None
+
+
+def test_disk_io_does_not_hold_up_memory_hits(tmp_path):
+    cache = _cache(tmp_path)
+    cache.put(MODEL, TASK, DIM, "cached", _vec(1))
+    tier = cache.disk[DIM]
+    hits = []
+    with tier.lock:  # a slow disk read or write in progress
+        reader = threading.Thread(target=lambda: hits.append(cache.get(MODEL, TASK, DIM, "cached")))
+        reader.start()
+        reader.join(timeout=2)
+        assert hits == [_vec(1)]
@@ -0,0 +1,70 @@
+import json
+import uuid
+
+import pytest
+
+import fetching
+from answerCache import AnswerCache
+
+QUESTION = "what did i buy at starbucks"
+
+
+def _txn(id, description):
+    return {"id": id, "type": "EXPENSE", "amount": 4.5, "description": description, "date": "2026-03-05",
+            "category": "food", "userId": "u1", "accountId": "a1", "createdAt": "2026-03-05T10:00:00"}
+
+
+def _events(stream):
+    """Parse the SSE frames: every frame is `event: <name>` and one `data: <json>` line."""
+    frames = "".join(stream).split("\n\n")
+    assert frames[-1] == ""
+    events = []
+    for frame in frames[:-1]:
+        event, data = frame.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@pytest.fixture
+def stream(fake_clients, monkeypatch):
+    supabase, genai = fake_clients
+    rows = [_txn("t1", "starbucks latte"), _txn("t2", "uber ride")]
+    supabase.add_transactions(rows)
+    supabase.seed_embeddings(rows, lambda text: genai.embedder(text, 384))
+    monkeypatch.setattr(fetching, "answer_cache", AnswerCache(versions="local"))
+    session = f"u1:{uuid.uuid4()}"  # the session memory is shared by the module
+    return lambda query=QUESTION: _events(fetching._stream_retrieve(query, "u1", "a1", 2, session))
+
+
+def test_a_semantic_answer_is_streamed_as_events(stream):
+    events = stream()
+    names = [name for name, _ in events]
+    assert names[:2] == ["intent", "documents"] and names[-1] == "done"
+    assert set(names[2:-1]) == {"token"} and len(names) > 4
+
+    intent, documents, done = events[0][1], events[1][1], events[-1][1]
+    assert intent["mode"] == "semantic"
+    assert documents["top_k_results"][0]["source_id"] == "t1"
+    assert done["answer"] == "".join(data["text"] for name, data in events if name == "token").strip()
+    assert {"intent_ms", "retrieval_ms", "first_token_ms", "total_ms"} <= set(done["timings"])
+
+
+def test_a_repeated_question_is_answered_from_the_cache(stream, fake_clients):
+    _, genai = fake_clients
+    first = stream()[-1][1]
+    calls = genai.generate_calls
+
+    events = stream()
+    assert [name for name, _ in events] == ["intent", "done"]
+    done = events[-1][1]
+    assert done["cache"] == "exact" and done["answer"] == first["answer"]
+    assert genai.generate_calls == calls
+
+
+def test_a_failure_ends_the_stream_with_an_error_event(stream, monkeypatch):
+    def unavailable(query):
+        raise ConnectionError("gemini unreachable")
+
+    monkeypatch.setattr(fetching, "classify_query_intent", unavailable)
+    assert stream() == [("error", {"status": "error", "error": "gemini unreachable", "timings": {}})]
@@ -0,0 +1,60 @@
+from datetime import date, datetime
+
+import pytest
+
+from fakes import FakeGenAI, FakeSupabase, synthetic_transactions
+from hybridRetrieval import hybrid_retrieve
+from queryParser import parse_query
+from vectorStore import LocalVectorIndex, SupabaseBackend
+
+TODAY = date(2026, 10, 16)
+ROWS = synthetic_transactions(600, n_users=1, today=datetime(2026, 10, 16, 12))
+USER, ACCOUNT = ROWS[0]["userId"], ROWS[0]["accountId"]
+
+
+def _setup():
+    genai = FakeGenAI()
+    client = FakeSupabase(ROWS)
+    client.seed_embeddings(ROWS, genai.embedder)
+    return client, genai
+
+
+def _retrieve(client, backend, genai, query):
+    return hybrid_retrieve(client, backend, query, genai.embedder(query), parse_query(query, today=TODAY),
+                           USER, ACCOUNT, top_k=3)
+
+
+def test_filtered_match_is_one_rpc_and_respects_the_filter():
+    client, genai = _setup()
+    docs = _retrieve(client, SupabaseBackend(client), genai, "what did I spend on food in march")
+    assert docs and all(d["metadata"]["columns"]["category"] == "food" for d in docs)
+    assert all(d["metadata"]["columns"]["date"][5:7] == "03" for d in docs)
+    assert client.calls == {"match_filtered_embeddings": 1}
+
+
+def test_nothing_passing_the_filter_returns_no_documents():
+    client, genai = _setup()
+    assert _retrieve(client, SupabaseBackend(client), genai, "what did I spend on food in march 1999") == []
+
+
+def test_local_index_scores_the_filtered_ids_in_memory(tmp_path):
+    client, genai = _setup()
+    index = LocalVectorIndex(directory=str(tmp_path))
+    for key, row in client.embeddings.items():
+        index.upsert({k: v for k, v in row.items() if k != "embedding"}, row["embedding"])
+    docs = _retrieve(client, index, genai, "what did I spend on food in march")
+    assert docs and all(d["metadata"]["columns"]["category"] == "food" for d in docs)
+    assert "match_filtered_embeddings" not in client.calls
+
+
+@pytest.mark.parametrize("query", [
+    "find the transaction where I may have been double charged",
+    "did I pay my rent on time",
+    "tell me about the gifts I bought for mom",
+])
+def test_unconfident_parses_rank_the_whole_scope(query):
+    client, genai = _setup()
+    parsed = parse_query(query, today=TODAY)
+    assert parsed.has_filters() and not parsed.confident
+    assert _retrieve(client, SupabaseBackend(client), genai, query) is None
+    assert not client.calls
@@ -0,0 +1,81 @@
+import time
+
+import worker
+from ingestQueue import IngestQueue
+
+
+def _event(id):
+    return {"type": "INSERT", "table": "transactions", "record": {"id": id}, "old_record": None}
+
+
+def test_an_expired_lease_makes_the_event_claimable_again(tmp_path):
+    queue = IngestQueue(str(tmp_path / "queue.db"), lease_seconds=0.05)
+    queue.put(_event("t1"))
+    [job] = queue.claim()
+    assert queue.claim() == []  # leased to the first consumer
+    assert queue.stats()["in_flight"] == 1
+
+    time.sleep(0.1)
+    [again] = queue.claim()
+    assert (again.id, again.payload) == (job.id, job.payload)
+
+
+def test_a_retried_event_waits_out_its_delay(tmp_path):
+    queue = IngestQueue(str(tmp_path / "queue.db"))
+    queue.put(_event("t1"))
+    [job] = queue.claim()
+    queue.retry(job.id, RuntimeError("gemini down"), delay=60)
+    assert queue.claim() == []
+    assert queue.stats()["pending"] == 1  # not leased, just not due yet
+
+    queue.retry(job.id, RuntimeError("gemini down"), delay=0)
+    [again] = queue.claim()
+    assert again.attempts == 2
+
+
+def test_backoff_grows_with_the_attempts_and_is_capped(monkeypatch):
+    monkeypatch.setattr(worker.random, "random", lambda: 1.0)  # no jitter
+    monkeypatch.setattr(worker, "INGEST_BACKOFF_BASE", 2.0)
+    monkeypatch.setattr(worker, "INGEST_BACKOFF_MAX", 30.0)
+    assert [worker._backoff(n) for n in range(5)] == [2.0, 4.0, 8.0, 16.0, 30.0]
+
+    monkeypatch.setattr(worker.random, "random", lambda: 0.0)
+    assert worker._backoff(1) == 2.0  # jitter takes off at most half
+
+
+def test_dead_letters_are_kept_and_can_be_requeued(tmp_path):
+    queue = IngestQueue(str(tmp_path / "queue.db"))
+    queue.put(_event("t1"))
+    [job] = queue.claim()
+    queue.retry(job.id, RuntimeError("first"), delay=0)
+    [job] = queue.claim()
+    queue.dead_letter(job.id, RuntimeError("second"))
+    assert queue.claim() == []
+    stats = queue.stats()
+    assert (stats["pending"], stats["in_flight"], stats["dead_letters"]) == (0, 0, 1)
+    attempts, error = queue.conn.execute("SELECT attempts, error FROM dead_letters").fetchone()
+    assert (attempts, error) == (2, "second")
+
+    assert queue.requeue_dead_letters() == 1
+    [again] = queue.claim()
+    assert (again.payload, again.attempts) == (_event("t1"), 0)
+    assert queue.stats()["dead_letters"] == 0
+
+
+def test_events_survive_a_restart(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue = IngestQueue(path, lease_seconds=0.05)
+    queue.put(_event("t1"))
+    queue.put(_event("t2"))
+    queue.claim()  # t1 was being processed when the process died
+    queue.close()
+
+    time.sleep(0.1)
+    reopened = IngestQueue(path)
+    jobs = reopened.claim(limit=10)
+    assert [job.payload["record"]["id"] for job in jobs] == ["t1", "t2"]
+    reopened.ack(jobs[0].id)
+    reopened.close()
+
+    stats = IngestQueue(path).stats()
+    assert (stats["pending"], stats["in_flight"]) == (0, 1)  # t2's lease outlives the restart
@@ -0,0 +1,76 @@
+import contextvars
+import threading
+
+import pytest
+
+import metrics
+from metrics import Registry
+
+
+def _value(family, **labels):
+    return {tuple(sorted(l.items())): v for _, l, v in family.samples()}.get(tuple(sorted(labels.items())))
+
+
+def test_spans_are_labelled_from_the_request_context():
+    registry = Registry()
+    family = registry.histogram("test_stage_seconds", "test", ["stage", "route", "intent"])
+    errors = registry.counter("test_stage_errors_total", "test", ["stage", "route", "intent"])
+
+    def request():
+        metrics.begin_request("retrieve")
+        metrics.set_intent("analytical")  # known only after classification
+        labels = metrics.context_labels()
+        family.labels(stage="sql", **labels).observe(0.01)
+
+        # an executor thread started with a copied context sees the same labels
+        seen = []
+        thread = threading.Thread(target=contextvars.copy_context().run,
+                                  args=(lambda: seen.append(metrics.context_labels()),))
+        thread.start()
+        thread.join()
+        return labels, seen[0]
+
+    labels, in_thread = contextvars.copy_context().run(request)
+    assert labels == in_thread == {"route": "retrieve", "intent": "analytical"}
+    assert metrics.context_labels() == {"route": "background", "intent": "none"}  # not leaked to this context
+    assert _value(family, stage="sql", route="retrieve", intent="analytical", le="0.01") == 1
+    assert _value(errors, stage="sql", route="retrieve", intent="analytical") is None
+
+
+def test_a_raising_span_counts_an_error_and_still_records_its_latency():
+    def request():
+        metrics.begin_request("webhook", "INSERT")
+        with pytest.raises(ValueError):
+            with metrics.span("test_failing_stage"):
+                raise ValueError("boom")
+
+    before = _value(metrics.STAGE_ERRORS, stage="test_failing_stage", route="webhook", intent="INSERT") or 0
+    contextvars.copy_context().run(request)
+    assert _value(metrics.STAGE_ERRORS, stage="test_failing_stage", route="webhook", intent="INSERT") == before + 1
+    assert _value(metrics.STAGE_SECONDS, stage="test_failing_stage", route="webhook", intent="INSERT",
+                  le="+Inf") == before + 1
+
+
+def test_the_text_exposition_format():
+    registry = Registry()
+    registry.counter("test_events_total", "Events seen", ["type"]).labels(type='say "hi"\n').inc(2)
+    registry.histogram("test_seconds", "Latency", buckets=[0.1, 1]).labels().observe(0.5)
+    registry.gauge("test_queue_depth", "Queued", lambda: {("pending",): 3}, ["state"])
+    registry.gauge("test_broken", "Fails", lambda: 1 / 0)
+
+    assert registry.render().splitlines() == [
+        "# HELP test_events_total Events seen",
+        "# TYPE test_events_total counter",
+        'test_events_total{type="say \\"hi\\"\\n"} 2',
+        "# HELP test_seconds Latency",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{le="0.1"} 0',
+        'test_seconds_bucket{le="1"} 1',
+        'test_seconds_bucket{le="+Inf"} 1',
+        "test_seconds_sum 0.5",
+        "test_seconds_count 1",
+        "# HELP test_queue_depth Queued",
+        "# TYPE test_queue_depth gauge",
+        'test_queue_depth{state="pending"} 3',
+        "# test_broken unavailable: division by zero",
+    ]
@@ -0,0 +1,198 @@
+from datetime import date
+
+import pytest
+
+from fakes import FakeSupabase
+from queryParser import RANGE_WORDS, parse_query
+
+TODAY = date(2026, 10, 16)
+
+
+def _txn(id, day, category="food", description="lunch", amount=10.0, type="EXPENSE"):
+    return {"id": id, "type": type, "amount": amount, "description": description, "date": day,
+            "category": category, "isRecurring": False, "recurringInterval": None, "status": "COMPLETED",
+            "userId": "u1", "accountId": "a1", "createdAt": day, "updatedAt": day}
+
+
+ROWS = [
+    _txn("feb", "2026-02-20"),
+    _txn("mar1", "2026-03-01"),
+    _txn("mar5", "2026-03-05"),
+    _txn("mar6", "2026-03-06"),
+    _txn("mar8", "2026-03-08"),
+    _txn("jun30", "2026-06-30"),
+    _txn("jul", "2026-07-01"),
+    _txn("aug31", "2026-08-31"),
+    _txn("sep1", "2026-09-01"),
+    _txn("rent", "2026-03-03", category="housing", description="rent"),
+    _txn("coffee", "2026-03-04", description="starbucks coffee"),
+]
+
+
+def _matching_ids(parsed):
+    sql = parsed.filter_sql(limit=100)
+    return {r["id"] for r in FakeSupabase(ROWS)._run_sql(sql, "u1", "a1")}
+
+
+def test_between_two_months_covers_every_month_in_between():
+    parsed = parse_query("how much did I spend between march and june", today=TODAY)
+    assert parsed.confident
+    assert parsed.months == [3, 4, 5, 6]
+    assert "EXTRACT(MONTH FROM date) IN (3, 4, 5, 6)" in parsed.to_sql()
+    assert _matching_ids(parsed) == {"mar1", "mar5", "mar6", "mar8", "jun30", "rent", "coffee"}
+
+
+def test_between_wraps_the_year_end():
+    parsed = parse_query("how much did I spend between november and february", today=TODAY)
+    assert parsed.confident
+    assert parsed.months == [11, 12, 1, 2]
+
+
+def test_before_a_month_is_an_upper_bound():
+    parsed = parse_query("how much did I spend before september", today=TODAY)
+    assert parsed.confident
+    assert parsed.date_to == date(2026, 9, 1) and parsed.date_from is None
+    assert "date < '2026-09-01'" in parsed.to_sql()
+    assert "sep1" not in _matching_ids(parsed) and "aug31" in _matching_ids(parsed)
+
+
+def test_after_a_day_starts_the_next_day():
+    parsed = parse_query("how much did I spend after march 5", today=TODAY)
+    assert parsed.confident
+    assert parsed.date_from == date(2026, 3, 6) and parsed.date_to is None
+    ids = _matching_ids(parsed)
+    assert "mar6" in ids and "mar5" not in ids
+
+
+def test_since_and_until_include_the_endpoint():
+    since = parse_query("how much did I spend since march 5", today=TODAY)
+    until = parse_query("how much did I spend until march 5", today=TODAY)
+    assert since.date_from == date(2026, 3, 5)
+    assert until.date_to == date(2026, 3, 6)
+
+
+def test_explicit_day_range_with_a_year():
+    parsed = parse_query("how much did I spend from march 5 to april 2, 2025", today=TODAY)
+    assert parsed.confident
+    assert (parsed.date_from, parsed.date_to) == (date(2025, 3, 5), date(2025, 4, 3))
+
+
+def test_first_week_of_a_month():
+    parsed = parse_query("how much did I spend in the first week of march", today=TODAY)
+    assert parsed.confident
+    assert (parsed.date_from, parsed.date_to) == (date(2026, 3, 1), date(2026, 3, 8))
+    ids = _matching_ids(parsed)
+    assert {"mar1", "mar5", "mar6"} <= ids and "mar8" not in ids and "feb" not in ids
+
+
+def test_last_week_of_a_month():
+    parsed = parse_query("how much did I spend in the last week of february 2024", today=TODAY)
+    assert parsed.confident
+    assert (parsed.date_from, parsed.date_to) == (date(2024, 2, 23), date(2024, 3, 1))
+
+
+def test_excluding_an_overlapping_category_is_not_trusted():
+    # dining is an alias of food: the exclusion would empty the filter, so this goes to the LLM
+    parsed = parse_query("how much did I spend on food not including dining", today=TODAY)
+    assert not parsed.confident
+
+
+def test_excluded_category_becomes_a_negative_predicate():
+    parsed = parse_query("how much did I spend except rent in march", today=TODAY)
+    assert parsed.confident
+    assert parsed.excluded_categories == ["housing"]
+    assert "rent" not in _matching_ids(parsed)
+
+
+def test_excluded_word_filters_descriptions():
+    parsed = parse_query("total spent in march excluding starbucks", today=TODAY)
+    assert parsed.confident
+    assert parsed.excluded_keywords == ["starbucks"]
+    assert "NOT ILIKE '%starbucks%'" in parsed.to_sql()
+    assert "coffee" not in _matching_ids(parsed)
+
+
+@pytest.mark.parametrize("query", [
+    "how much did I spend on food not on weekends",
+    "how much did I spend in march before the 10th",
+    "how much did I spend after payday",
+    "total spent between paychecks",
+])
+def test_range_words_it_cannot_express_drop_confidence(query):
+    parsed = parse_query(query, today=TODAY)
+    assert not parsed.confident
+    assert not set(parsed.keywords) & RANGE_WORDS
+
+
+def test_relative_periods_still_parse():
+    assert parse_query("how much did I spend last month", today=TODAY).period == "last_month"
+    assert parse_query("how many transactions in the last 30 days", today=TODAY).confident
+
+
+@pytest.mark.parametrize("query", [
+    "how much tax did i pay in march",
+    "how much cash did i spend in march",
+    "how much did i spend online",
+    "how much did i get as refund",
+    "how much did i save in march",
+    "how much do i owe",
+])
+def test_one_unrecognised_word_is_not_a_plain_total(query):
+    parsed = parse_query(query, today=TODAY)
+    assert not parsed.confident
+    assert any(r.startswith("unrecognised words") for r in parsed.reasons)
+
+
+def test_months_in_different_years_are_not_trusted():
+    parsed = parse_query("how much did I spend in march 2025 and april 2024", today=TODAY)
+    assert not parsed.confident
+    assert parse_query("how much did I spend in march 2025 and april 2025", today=TODAY).confident
+
+
+@pytest.mark.parametrize("query", [
+    "how much money do i have",
+    "how much is left in my balance",
+    "what is my net worth",
+])
+def test_balance_questions_are_not_a_sum_of_expenses(query):
+    parsed = parse_query(query, today=TODAY)
+    assert not parsed.confident
+    assert any(r.startswith("asks for a balance") for r in parsed.reasons)
+
+
+def test_have_as_an_auxiliary_is_not_a_balance_question():
+    parsed = parse_query("how much have i spent on food in march", today=TODAY)
+    assert parsed.confident
+    assert parsed.aggregate == "SUM"
+
+
+def test_total_transactions_is_a_count():
+    parsed = parse_query("total transactions", today=TODAY)
+    assert parsed.confident
+    assert (parsed.aggregate, parsed.txn_type) == ("COUNT", None)
+    assert parsed.to_sql() == "SELECT COUNT(*) AS transaction_count FROM transactions"
+    assert parse_query("total spent on transactions in march", today=TODAY).aggregate == "SUM"
+
+
+@pytest.mark.parametrize("query", [
+    "how much more did i spend on food",
+    "did i spend less on travel in march",
+])
+def test_comparisons_it_did_not_parse_drop_confidence(query):
+    parsed = parse_query(query, today=TODAY)
+    assert not parsed.confident
+    assert any(r.startswith("comparison not understood") for r in parsed.reasons)
+    assert parse_query("show transactions more than 500", today=TODAY).confident  # a threshold, not a comparison
+
+
+@pytest.mark.parametrize("query", [
+    "how much did i spend on personal care products",
+    "how much did i spend on food items",
+    "how much did i spend on travel stuff",
+    "how much did i spend on eating out",
+])
+def test_generic_nouns_are_not_description_keywords(query):
+    parsed = parse_query(query, today=TODAY)
+    assert parsed.confident
+    assert parsed.keywords == []
+    assert "ILIKE '%" in parsed.to_sql() and "description" not in parsed.to_sql()
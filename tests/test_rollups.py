@@ -0,0 +1,61 @@
+import time
+from datetime import date
+
+import pytest
+
+from queryParser import parse_query
+from rollups import RollupStore
+
+TODAY = date(2026, 10, 16)
+QUESTION = parse_query("how much did I spend on food in march", today=TODAY)
+
+
+def _txn(id, amount, updated="2026-03-10T10:00:00"):
+    return {"id": id, "type": "EXPENSE", "amount": amount, "date": "2026-03-05", "category": "food",
+            "userId": "u1", "accountId": "a1", "createdAt": "2026-03-05T10:00:00", "updatedAt": updated}
+
+
+def _total(store):
+    rows = store.answer(QUESTION, "u1", "a1", today=TODAY)
+    return rows and rows[0]["total_spent"]
+
+
+def test_a_build_from_before_webhooks_were_consumed_is_not_trusted(tmp_path):
+    store = RollupStore(str(tmp_path / "rollups.db"))
+    store.build([[_txn("t1", 10.0)]])
+    assert _total(store) is None  # nobody is feeding it: events since the build may be missing
+
+    store.start_feeding()
+    assert _total(store) is None  # built before this process saw webhooks
+
+    time.sleep(0.01)
+    store.build([[_txn("t1", 10.0)]])
+    assert _total(store) == 10.0
+
+
+def test_a_failed_event_fails_closed_until_the_next_build(tmp_path, monkeypatch):
+    store = RollupStore(str(tmp_path / "rollups.db"))
+    store.start_feeding()
+    store.build([[_txn("t1", 10.0)]])
+
+    def fail(*args):
+        raise OSError("disk full")
+    monkeypatch.setattr(store, "_apply", fail)
+    with pytest.raises(OSError):
+        store.apply_event("INSERT", _txn("t2", 5.0))
+    monkeypatch.undo()
+    assert _total(store) is None
+
+    time.sleep(0.01)
+    store.build([[_txn("t1", 10.0), _txn("t2", 5.0)]])
+    assert _total(store) == 15.0
+
+
+def test_a_delete_with_only_the_id_is_not_undone_by_a_replayed_insert(tmp_path):
+    store = RollupStore(str(tmp_path / "rollups.db"))
+    store.start_feeding()
+    store.build([])
+    assert store.apply_event("DELETE", None, {"id": "t1"})  # the delete overtook its insert
+    assert not store.apply_event("INSERT", _txn("t1", 10.0))
+    assert not store.apply_event("UPDATE", _txn("t1", 12.0, updated="2026-03-11T10:00:00"), _txn("t1", 10.0))
+    assert store.answer(QUESTION, "u1", "a1", today=TODAY) == [{"total_spent": None}]
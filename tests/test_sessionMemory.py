@@ -0,0 +1,55 @@
+from sessionMemory import SessionMemory, session_key
+
+
+def test_turns_leaving_the_ring_are_folded_into_the_summary():
+    memory = SessionMemory(max_turns=2)
+    key = session_key("u1", "s1")
+    for i in range(4):
+        memory.append(key, f"question {i}", f"answer {i}")
+
+    history = memory.history(key).splitlines()
+    assert history == [
+        "Earlier in this conversation: Q: question 0 A: answer 0 | Q: question 1 A: answer 1",
+        "User: question 2", "Assistant: answer 2",
+        "User: question 3", "Assistant: answer 3",
+    ]
+    assert memory.stats()["compacted"] == 2
+
+
+def test_the_summary_is_capped_oldest_first():
+    memory = SessionMemory(max_turns=1, summary_chars=60)
+    key = session_key("u1")
+    for i in range(5):
+        memory.append(key, f"question {i}", f"answer {i}")
+    summary = memory.history(key).splitlines()[0]
+    assert len(summary) <= len("Earlier in this conversation: ") + 60
+    assert "question 3" in summary and "question 0" not in summary
+
+
+def test_sessions_and_users_are_isolated():
+    memory = SessionMemory()
+    memory.append(session_key("u1", "s1"), "food in march?", "120")
+    memory.append(session_key("u1", "s2"), "rent?", "900")
+    memory.append(session_key("u2", "s1"), "salary?", "5000")
+
+    assert "food in march" in memory.history(session_key("u1", "s1"))
+    assert "rent" not in memory.history(session_key("u1", "s1"))
+    assert "salary" not in memory.history(session_key("u1", "s1"))
+    assert memory.history(session_key("u3", "s1")) == "None"
+    assert session_key("u1") == "u1:default"
+
+
+def test_idle_and_least_recently_used_sessions_are_dropped():
+    memory = SessionMemory(max_sessions=2)
+    for user in ("u1", "u2"):
+        memory.append(session_key(user), "hi", "hello")
+    memory.history(session_key("u1"))          # u2 is now the least recently used
+    memory.append(session_key("u3"), "hi", "hello")
+    assert memory.history(session_key("u2")) == "None"
+    assert memory.history(session_key("u1")) != "None"
+    assert memory.stats()["evicted"] == 1
+
+    expiring = SessionMemory(ttl_seconds=0)
+    expiring.append(session_key("u1"), "hi", "hello")
+    assert expiring.history(session_key("u1")) == "None"
+    assert expiring.stats()["expired"] == 1
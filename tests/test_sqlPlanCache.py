@@ -0,0 +1,47 @@
+from sqlPlanCache import SqlPlanCache
+
+FOOD_IN_SEPTEMBER = ("SELECT SUM(amount) AS total_spent FROM transactions WHERE type = 'EXPENSE' "
+                     "AND category ILIKE '%food%' AND EXTRACT(MONTH FROM date) = 9")
+
+
+def test_a_learned_template_is_filled_with_the_new_slots():
+    cache = SqlPlanCache(path=None)
+    assert cache.learn("How much did I spend on food in September?", FOOD_IN_SEPTEMBER)
+    sql = cache.lookup("how much did i spend on travel in march")
+    assert "category ILIKE '%travel%'" in sql and "EXTRACT(MONTH FROM date) = 3" in sql
+    assert cache.lookup("how much did i spend on travel") is None  # a different shape
+
+
+def test_date_and_year_slots_are_parameterized():
+    cache = SqlPlanCache(path=None)
+    assert cache.learn("what did i spend on 2025-03-05",
+                       "SELECT * FROM transactions WHERE date >= '2025-03-05' AND date < '2025-03-06'")
+    assert cache.lookup("what did i spend on 2024-02-28") == \
+        "SELECT * FROM transactions WHERE date >= '2024-02-28' AND date < '2024-02-29'"
+    assert cache.learn("how much did i spend in 2025",
+                       "SELECT SUM(amount) FROM transactions WHERE EXTRACT(YEAR FROM date) = 2025")
+    assert cache.lookup("how much did i spend in 2024").endswith("= 2024")
+
+
+def test_dates_the_question_did_not_name_are_never_cached():
+    cache = SqlPlanCache(path=None)
+    assert not cache.learn("how much did i spend this year",
+                           "SELECT SUM(amount) FROM transactions WHERE EXTRACT(YEAR FROM date) = 2026")
+    assert not cache.learn("what did i spend yesterday",
+                           "SELECT * FROM transactions WHERE date >= '2026-10-15' AND date < '2026-10-16'")
+    assert not cache.learn("how much did i spend in september",
+                           "SELECT SUM(amount) FROM transactions WHERE date >= '2026-09-01' AND date < '2026-10-01'")
+    assert cache.lookup("how much did i spend this year") is None
+    assert cache.stats()["unlearnable"] == 3
+
+
+def test_a_slot_missing_from_the_sql_is_not_learned():
+    cache = SqlPlanCache(path=None)
+    assert not cache.learn("how much did i spend on food in september",
+                           "SELECT SUM(amount) FROM transactions WHERE category ILIKE '%food%'")
+
+
+def test_templates_persist(tmp_path):
+    path = str(tmp_path / "plans.json")
+    SqlPlanCache(path=path).learn("how much did i spend on food in september", FOOD_IN_SEPTEMBER)
+    assert "EXTRACT(MONTH FROM date) = 10" in SqlPlanCache(path=path).lookup("how much did i spend on food in october")
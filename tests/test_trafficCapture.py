@@ -0,0 +1,34 @@
+import json
+
+from replay import load_capture
+from trafficCapture import CaptureWriter, sanitize
+
+
+def test_ids_and_row_free_text_are_hashed_by_default():
+    body = {"type": "INSERT", "table": "transactions", "api_key": "secret",
+            "record": {"id": "t1", "userId": "u1", "description": "dinner with alice", "amount": 12.5},
+            "old_record": None}
+    clean = sanitize(body)
+    assert clean["api_key"] == "[redacted]"
+    assert clean["record"]["userId"].startswith("anon-")
+    assert clean["record"]["description"].startswith("text-")
+    assert clean["record"]["amount"] == 12.5 and clean["record"]["id"] == "t1"
+    assert sanitize(body)["record"]["description"] == clean["record"]["description"]
+
+
+def test_questions_keep_their_text():
+    clean = sanitize({"query": "how much did I spend on food", "userid": "u1"})
+    assert clean["query"] == "how much did I spend on food"
+    assert clean["userid"].startswith("anon-")
+
+
+def test_daily_file_is_created_under_the_capture_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = CaptureWriter()
+    writer.write({"ts": 1.0, "method": "POST", "path": "/api/retrieve", "body": {"query": "q"}})
+    writer.close()
+    assert writer.path.startswith("captures/requests-") and writer.path.endswith(".jsonl")
+    with open(writer.path) as f:
+        assert json.loads(f.readline())["path"] == "/api/retrieve"
+    records, skipped = load_capture([writer.path])
+    assert len(records) == 1 and skipped == 0
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from vectorCodec import FORMATS, decode_vector, encode_vector, to_pgvector
+
+
+def _cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+@pytest.fixture
+def vector():
+    vec = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def test_lossless_formats_round_trip_exactly(vector):
+    for fmt in ("text", "f32"):
+        assert np.array_equal(decode_vector(encode_vector(vector, fmt)), vector)
+
+
+@pytest.mark.parametrize("fmt", ["f16", "i8"])
+def test_compact_formats_keep_the_direction(vector, fmt):
+    decoded = decode_vector(encode_vector(vector, fmt))
+    assert decoded.dtype == np.float32 and decoded.shape == vector.shape
+    assert _cosine(decoded, vector) > 0.9999
+
+
+def test_every_format_decodes_lists_and_literals(vector):
+    assert set(FORMATS) == {"text", "f32", "f16", "i8"}
+    assert np.array_equal(decode_vector(vector.tolist()), vector)
+    assert np.array_equal(decode_vector(to_pgvector(vector)), vector)
+    assert decode_vector(None) is None
+
+
+def test_a_zero_vector_survives_i8(vector):
+    assert not decode_vector(encode_vector(np.zeros(384), "i8")).any()
+
+
+def test_unknown_encodings_are_rejected():
+    with pytest.raises(ValueError):
+        decode_vector("f64:AAAA")
+    with pytest.raises(ValueError):
+        encode_vector([1.0], "f64")
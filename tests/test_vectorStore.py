@@ -0,0 +1,66 @@
+import numpy as np
+
+from vectorStore import LocalVectorIndex
+
+DIM = 8
+
+
+def _record(id, user="u1", account="a1", text=None):
+    return {"source_table": "transactions", "source_id": id, "user_id": user, "account_id": account,
+            "chunk_text": text or f"row {id}", "metadata": {"columns": {"id": id}}}
+
+
+def _vec(i):
+    vec = np.zeros(DIM, dtype=np.float32)
+    vec[i] = 1.0
+    return vec.tolist()
+
+
+def _ids(index, query, user="u1", account="a1", top_k=5):
+    return [hit["source_id"] for hit in index.match(query, user, account, top_k)]
+
+
+def test_upsert_replaces_in_place_and_moves_between_partitions():
+    index = LocalVectorIndex(directory=None, dim=DIM)
+    index.upsert(_record("t1"), _vec(0))
+    index.upsert(_record("t2"), _vec(1))
+    index.upsert(_record("t1", text="updated"), _vec(2))
+    assert index.stats() == {"partitions": 1, "vectors": 2}
+    assert _ids(index, _vec(2), top_k=1) == ["t1"]
+    assert index.match(_vec(2), "u1", "a1", 1)[0]["chunk_text"] == "updated"
+
+    index.upsert(_record("t1", account="a2"), _vec(2))  # the row moved to another account
+    assert _ids(index, _vec(2)) == ["t2"]
+    assert _ids(index, _vec(2), account="a2") == ["t1"]
+    assert index.match(_vec(0), "u2", "a1") == []
+
+
+def test_remove_keeps_the_other_rows_matchable():
+    index = LocalVectorIndex(directory=None, dim=DIM)
+    for i in range(4):
+        index.upsert(_record(f"t{i}"), _vec(i))
+    index.remove("t1")
+    index.remove("missing")
+    assert index.stats()["vectors"] == 3
+    for i in (0, 2, 3):  # t3 was swapped into t1's slot
+        assert _ids(index, _vec(i), top_k=1) == [f"t{i}"]
+    assert "t1" not in _ids(index, _vec(1))
+
+
+def test_a_flushed_index_is_reloaded_from_disk(tmp_path):
+    index = LocalVectorIndex(directory=str(tmp_path), dim=DIM)
+    index.upsert(_record("t1"), _vec(0))
+    index.upsert(_record("t2", user="u2"), _vec(1))
+    index.upsert(_record("t3"), _vec(3))
+    index.patch_metadata("t1", {"columns": {"id": "t1", "status": "PENDING"}})
+    index.remove("t3")
+    index.flush()
+
+    reloaded = LocalVectorIndex(directory=str(tmp_path), dim=DIM)
+    assert reloaded.stats() == {"partitions": 2, "vectors": 2}
+    [hit] = reloaded.match(_vec(0), "u1", "a1")
+    assert (hit["source_id"], hit["metadata"]["columns"]["status"]) == ("t1", "PENDING")
+    assert _ids(reloaded, _vec(1), user="u2") == ["t2"]
+
+    reloaded.upsert(_record("t4"), _vec(4))  # writes after a reload go past the memmap
+    assert _ids(reloaded, _vec(4), top_k=1) == ["t4"]
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+import worker
+from embeddingCreation import build_embedding_record
+from ingestQueue import Job
+from vectorStore import LocalVectorIndex
+
+
+def _txn(id, description="lunch", updated="2026-03-05T10:00:00"):
+    return {"id": id, "type": "EXPENSE", "amount": 10.0, "description": description, "date": "2026-03-05",
+            "category": "food", "isRecurring": False, "recurringInterval": None, "status": "COMPLETED",
+            "userId": "u1", "accountId": "a1", "createdAt": "2026-03-05T10:00:00", "updatedAt": updated}
+
+
+@pytest.fixture
+def index(fake_clients, monkeypatch):
+    index = LocalVectorIndex(directory=None)
+    monkeypatch.setattr(worker, "retrieval_backend", index)
+    return index
+
+
+def _event(type, record=None, old_record=None):
+    return {"type": type, "table": "transactions", "record": record, "old_record": old_record}
+
+
+def test_a_late_insert_or_update_does_not_bring_a_deleted_row_back(fake_clients, index):
+    supabase, _ = fake_clients
+    worker.process_event(_event("INSERT", _txn("t1")))
+    assert index.match(supabase.embeddings[("transactions", "t1")]["embedding"], "u1", "a1")
+
+    worker.process_event(_event("DELETE", old_record={"id": "t1"}))
+    assert supabase.embeddings[("transactions", "t1")]["deleted"]
+    assert index.stats()["vectors"] == 0
+
+    worker.process_event(_event("INSERT", _txn("t1")))  # a retry that lost the race
+    worker.process_event(_event("UPDATE", _txn("t1", "dinner", "2026-03-06T10:00:00"), _txn("t1")))
+    assert supabase.embeddings[("transactions", "t1")]["deleted"]
+    assert index.stats()["vectors"] == 0
+    assert supabase._match([1.0] * 384, "u1", "a1", 5) == []
+
+
+def test_metadata_patches_skip_tombstones(fake_clients, index):
+    supabase, _ = fake_clients
+    worker.process_event(_event("INSERT", _txn("t1")))
+    worker.process_event(_event("DELETE", old_record={"id": "t1"}))
+    renamed = dict(_txn("t1", updated="2026-03-07T10:00:00"), status="PENDING")  # same embedded text
+    worker.process_event(_event("UPDATE", renamed, _txn("t1")))
+    assert supabase.embeddings[("transactions", "t1")]["deleted"]
+
+
+def test_the_backend_drops_a_listener_write_that_the_delete_overtook(index):
+    record = build_embedding_record("transactions", _txn("t1"), "lunch", [1.0] * 384)
+    index.upsert({**record, "deleted": True, "version": record["version"] + 1}, None)
+    index.upsert(record, [1.0] * 384)
+    assert index.stats()["vectors"] == 0
+
+
+def test_an_update_that_leaves_the_embedded_text_alone_is_not_re_embedded(fake_clients, index):
+    supabase, genai = fake_clients
+    worker.process_event(_event("INSERT", _txn("t2", "fingerprint lunch")))
+    calls = genai.embed_calls
+
+    settled = dict(_txn("t2", "fingerprint lunch", "2026-03-06T10:00:00"), status="PENDING")
+    result = worker.process_event(_event("UPDATE", settled, _txn("t2", "fingerprint lunch")))
+    assert result["status"] == "embedded content unchanged for t2, metadata refreshed"
+    stored = supabase.embeddings[("transactions", "t2")]
+    assert stored["metadata"]["columns"]["status"] == "PENDING"
+
+    # Supabase without REPLICA IDENTITY FULL sends only the id: compared with the stored fingerprint
+    renamed = dict(settled, updatedAt="2026-03-07T10:00:00", receiptUrl="r.png")
+    result = worker.process_event(_event("UPDATE", renamed, {"id": "t2"}))
+    assert result["status"] == "embedded content unchanged for t2, metadata refreshed"
+    assert genai.embed_calls == calls
+
+
+def test_an_update_that_changes_the_embedded_text_is_re_embedded(fake_clients, index):
+    supabase, genai = fake_clients
+    worker.process_event(_event("INSERT", _txn("t3", "fingerprint tea")))
+    before = supabase.embeddings[("transactions", "t3")]["metadata"]["fingerprint"]
+    calls = genai.embed_calls
+
+    changed = _txn("t3", "fingerprint coffee", "2026-03-06T10:00:00")
+    result = worker.process_event(_event("UPDATE", changed, {"id": "t3"}))
+    assert result["status"] == "updated embedding for t3"
+    assert genai.embed_calls == calls + 1
+    assert supabase.embeddings[("transactions", "t3")]["metadata"]["fingerprint"] != before
+
+
+class _RecordingQueue:
+    """Notes whether each write ran on the event loop's thread."""
+
+    def __init__(self, jobs=()):
+        self.jobs, self.on_loop = list(jobs), {}
+
+    def _note(self, name):
+        try:
+            asyncio.get_running_loop()
+            self.on_loop[name] = True
+        except RuntimeError:
+            self.on_loop[name] = False
+
+    def put(self, payload):
+        self._note("put")
+        return 1
+
+    def claim(self, limit=1):
+        jobs, self.jobs = self.jobs[:limit], self.jobs[limit:]
+        return jobs
+
+    def ack(self, job_id):
+        self._note("ack")
+
+    def retry(self, job_id, error, delay):
+        self._note("retry")
+
+
+class _Request:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def json(self):
+        return self.payload
+
+
+def test_queue_writes_run_off_the_event_loop(fake_clients, index, monkeypatch):
+    queue = _RecordingQueue([Job(1, _event("INSERT", _txn("t5", "loop lunch")), 0, 0.0),
+                             Job(2, _event("UPDATE", None, None), 0, 0.0)])
+    monkeypatch.setattr(worker, "ingest_queue", queue)
+    monkeypatch.setattr(worker, "_backoff", lambda attempts: 0.0)
+
+    async def run():
+        monkeypatch.setattr(worker, "_wakeup", asyncio.Event())
+        assert (await worker.webhook(_Request(_event("INSERT", _txn("t6")))))["status"] == "queued"
+        consumer = asyncio.create_task(worker._consume(0))
+        while len(queue.on_loop) < 3:
+            await asyncio.sleep(0.01)
+        consumer.cancel()
+        await asyncio.gather(consumer, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(run(), timeout=10))
+    assert queue.on_loop == {"put": False, "ack": False, "retry": False}
@@ -0,0 +1,215 @@
+# trafficCapture.py
+"""
+Opt-in capture of live traffic for replay.py.
+
+With REQUEST_CAPTURE=1, main.app appends every POST to the captured paths to a JSONL
+file, one line per request. By default that is captures/requests-<date>.jsonl
+(REQUEST_CAPTURE_DIR), a new file each UTC day; REQUEST_CAPTURE_FILE pins one path.
+
+    {"ts": 1760601234.512, "method": "POST", "path": "/api/retrieve",
+     "body": {...}, "status": 200, "duration_ms": 812.4}
+
+Bodies are sanitized before they are written:
+  - values under secret-looking keys (password, token, api_key, auth, cookie...) are redacted
+  - strings are cut at CAPTURE_MAX_STRING characters; bodies over CAPTURE_MAX_BODY_BYTES are dropped
+  - user and account ids are replaced by salted hashes (CAPTURE_PSEUDONYMIZE=0 keeps
+    them; stable within a capture, set CAPTURE_SALT to keep them stable across restarts)
+  - free-text columns of webhook rows (description, name, ...) in "record" and
+    "old_record" become salted hashes too, so a replayed row still embeds as distinct
+    text; CAPTURE_FREE_TEXT=1 keeps the original text
+Headers are never recorded.
+
+Lines are written by one background thread, so a request never waits on the file.
+The middleware is pure ASGI: it sees the body as it is read and does not buffer
+streamed responses.
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from structuredLog import SECRET_KEY, log_event
+
+CAPTURE_ENABLED = os.getenv("REQUEST_CAPTURE", "0") == "1"
+CAPTURE_DIR = os.getenv("REQUEST_CAPTURE_DIR", "captures")
+CAPTURE_FILE = os.getenv("REQUEST_CAPTURE_FILE")  # unset: one file per day in CAPTURE_DIR
+CAPTURE_PATHS = tuple(
+    p.strip() for p in os.getenv("CAPTURE_PATHS", "/api/retrieve,/api/retrieve/stream,/webhook/webhook").split(",")
+    if p.strip()
+)
+CAPTURE_MAX_BODY_BYTES = int(os.getenv("CAPTURE_MAX_BODY_BYTES", str(256 * 1024)))
+CAPTURE_MAX_STRING = int(os.getenv("CAPTURE_MAX_STRING", "4000"))
+CAPTURE_PSEUDONYMIZE = os.getenv("CAPTURE_PSEUDONYMIZE", "1") != "0"
+CAPTURE_FREE_TEXT = os.getenv("CAPTURE_FREE_TEXT", "0") == "1"
+CAPTURE_SALT = os.getenv("CAPTURE_SALT") or os.urandom(16).hex()
+
+_ID_KEYS = {"userid", "accountid", "user_id", "account_id"}
+_ROW_KEYS = {"record", "old_record"}
+_FREE_TEXT_KEYS = {"description", "name", "notes", "note", "memo", "merchant", "receipturl"}
+
+
+# 🔹 Sanitizing
+
+def _pseudonym(value, prefix="anon"):
+    digest = hashlib.sha256(f"{CAPTURE_SALT}:{value}".encode()).hexdigest()
+    return f"{prefix}-{digest[:16]}"
+
+
+def sanitize(value, key=None, in_row=False):
+    """
+    Copy of a JSON body with secrets redacted, long strings cut, ids hashed and the
+    free text of webhook rows hashed (the last two unless turned off).
+    """
+    if key is not None and SECRET_KEY.search(key):
+        return "[redacted]"
+    if isinstance(value, dict):
+        return {k: sanitize(v, k, in_row or k in _ROW_KEYS) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v, key, in_row) for v in value]
+    if isinstance(value, str):
+        if CAPTURE_PSEUDONYMIZE and key is not None and key.lower() in _ID_KEYS:
+            return _pseudonym(value)
+        if in_row and not CAPTURE_FREE_TEXT and key is not None and key.lower() in _FREE_TEXT_KEYS:
+            return _pseudonym(value, "text")
+        if len(value) > CAPTURE_MAX_STRING:
+            return value[:CAPTURE_MAX_STRING]
+    return value
+
+
+# 🔹 Writer thread
+
+def daily_capture_path(directory=CAPTURE_DIR):
+    return os.path.join(directory, f"requests-{time.strftime('%Y-%m-%d', time.gmtime())}.jsonl")
+
+
+class CaptureWriter:
+    """Appends records to `path`, or to daily_capture_path() when no path is given."""
+
+    def __init__(self, path=None):
+        self.fixed_path = path
+        self.path = path or daily_capture_path()
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, record):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="request-capture", daemon=True)
+                    self.thread.start()
+        self.queue.put(record)
+
+    def _open(self, f):
+        """The file for today's lines, reopened when the date (and so the path) changes."""
+        path = self.fixed_path or daily_capture_path()
+        if f is not None and not f.closed:
+            if path == self.path:
+                return f
+            f.close()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        f = open(path, "a", encoding="utf-8")
+        self.path = path
+        return f
+
+    def _run(self):
+        f = None
+        try:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                batch = [record]
+                while True:  # write whatever else is already queued in the same flush
+                    try:
+                        record = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is None:
+                        self.queue.put(None)
+                        break
+                    batch.append(record)
+                try:
+                    f = self._open(f)
+                    f.write("".join(json.dumps(r, default=str) + "\n" for r in batch))
+                    f.flush()
+                    self.written += len(batch)
+                except Exception as e:
+                    self.dropped += len(batch)
+                    log_event("capture.write_failed", logging.WARNING, error=str(e))
+        finally:
+            if f is not None:
+                f.close()
+
+    def close(self, timeout=5.0):
+        """Flush what is queued and stop the thread (called from main's lifespan)."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout)
+
+    def stats(self):
+        return {"file": self.path, "written": self.written, "dropped": self.dropped,
+                "queued": self.queue.qsize()}
+
+
+capture_writer = CaptureWriter(CAPTURE_FILE)
+
+
+# 🔹 ASGI middleware
+
+class RequestRecorder:
+    def __init__(self, app, writer=None, paths=CAPTURE_PATHS):
+        self.app = app
+        self.writer = writer or capture_writer
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        ts = time.time()
+        started = time.perf_counter()
+        chunks, size = [], 0
+        state = {"status": None}
+
+        async def recording_receive():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request" and size <= CAPTURE_MAX_BODY_BYTES:
+                body = message.get("body", b"")
+                size += len(body)
+                if size <= CAPTURE_MAX_BODY_BYTES:
+                    chunks.append(body)
+            return message
+
+        async def recording_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, recording_receive, recording_send)
+        finally:
+            self.writer.write(self._record(scope, ts, started, chunks, size, state["status"]))
+
+    @staticmethod
+    def _record(scope, ts, started, chunks, size, status):
+        record = {"ts": round(ts, 6), "method": scope["method"], "path": scope["path"]}
+        if size > CAPTURE_MAX_BODY_BYTES:
+            record["body"], record["body_dropped"] = None, size
+        else:
+            try:
+                record["body"] = sanitize(json.loads(b"".join(chunks) or b"null"))
+            except ValueError:
+                record["body"], record["invalid_json"] = None, True
+        record["status"] = status
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return record
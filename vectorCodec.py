@@ -0,0 +1,113 @@
+# vectorCodec.py
+"""
+Wire encodings for embeddings sent to Supabase.
+
+Embeddings used to travel as pgvector text literals ("[0.0123, -0.0456, ...]",
+~20 characters per float, built with str() per element) on writes, and as JSON float
+lists on match_embeddings queries. VECTOR_WIRE_FORMAT selects a compact encoding
+instead:
+
+  text : pgvector literal, the original format (no SQL changes needed)
+  f32  : "f32:" + base64 of little-endian float32   lossless,     2.0 KB for 384-d
+  f16  : "f16:" + base64 of little-endian float16   |err| ~1e-3,  1.0 KB
+  i8   : "i8:<scale>:" + base64 of int8, symmetric per-vector scale, 0.5 KB
+
+(the text literal is ~8.4 KB)
+
+The binary formats are decoded in Postgres by decode_vector() (SQL in the README),
+which also accepts text literals, so upsert_embeddings and match_embeddings_encoded
+take either. Every reader in Python goes through decode_vector() here.
+
+    python vectorCodec.py            # payload size and encode/decode time per format
+"""
+import base64
+import json
+import os
+import time
+
+import numpy as np
+
+VECTOR_WIRE_FORMAT = os.getenv("VECTOR_WIRE_FORMAT", "text")
+FORMATS = ("text", "f32", "f16", "i8")
+
+if VECTOR_WIRE_FORMAT not in FORMATS:
+    raise ValueError(f"VECTOR_WIRE_FORMAT must be one of {', '.join(FORMATS)}, got {VECTOR_WIRE_FORMAT!r}")
+
+_DTYPES = {"f32": np.dtype("<f4"), "f16": np.dtype("<f2")}
+
+
+def to_pgvector(vec):
+    """pgvector text literal ("[0.1, 0.2, ...]"), the pre-codec wire format."""
+    if isinstance(vec, np.ndarray):
+        vec = vec.tolist()
+    return json.dumps(vec)
+
+
+def encode_vector(vec, fmt=None):
+    """Encode one embedding for the wire in `fmt` (default VECTOR_WIRE_FORMAT)."""
+    fmt = fmt or VECTOR_WIRE_FORMAT
+    if fmt == "text":
+        return to_pgvector(vec)
+    arr = np.asarray(vec, dtype=np.float32)
+    if fmt == "i8":
+        peak = float(np.abs(arr).max()) if arr.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        data = np.clip(np.rint(arr / scale), -127, 127).astype(np.int8)
+        return f"i8:{scale!r}:{base64.b64encode(data.tobytes()).decode('ascii')}"
+    dtype = _DTYPES.get(fmt)
+    if dtype is None:
+        raise ValueError(f"unknown vector format {fmt!r}")
+    return f"{fmt}:{base64.b64encode(arr.astype(dtype).tobytes()).decode('ascii')}"
+
+
+def decode_vector(value):
+    """float32 array from any encoding, a pgvector literal or a list; None stays None."""
+    if value is None:
+        return None
+    if isinstance(value, np.ndarray):
+        return value.astype(np.float32, copy=False)
+    if not isinstance(value, str):
+        return np.asarray(value, dtype=np.float32)
+    if value.startswith("["):
+        return np.asarray(json.loads(value), dtype=np.float32)
+    fmt, _, body = value.partition(":")
+    if fmt == "i8":
+        scale, _, body = body.partition(":")
+        data = np.frombuffer(base64.b64decode(body), dtype=np.int8)
+        return data.astype(np.float32) * np.float32(scale)
+    dtype = _DTYPES.get(fmt)
+    if dtype is None:
+        raise ValueError(f"unrecognised vector encoding {value[:16]!r}")
+    return np.frombuffer(base64.b64decode(body), dtype=dtype).astype(np.float32)
+
+
+def _bench(dim=384, n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    floats = [v.tolist() for v in vectors]  # what Gemini hands back
+
+    started = time.perf_counter()
+    legacy = [f"[{', '.join(str(x) for x in v)}]" for v in floats]
+    legacy_us = (time.perf_counter() - started) / n * 1e6
+    print(f"{dim}-d, {n} vectors; old str() literal: {len(legacy[0])} bytes, encode {legacy_us:.1f} us")
+    for fmt in FORMATS:
+        started = time.perf_counter()
+        encoded = [encode_vector(v, fmt) for v in floats]
+        encode_us = (time.perf_counter() - started) / n * 1e6
+        started = time.perf_counter()
+        decoded = np.stack([decode_vector(e) for e in encoded])
+        decode_us = (time.perf_counter() - started) / n * 1e6
+        cosine = float(np.min(np.sum(decoded * vectors, axis=1) / np.linalg.norm(decoded, axis=1)))
+        print(f"{fmt:>4}: {len(encoded[0]):6d} bytes  encode {encode_us:7.1f} us  decode {decode_us:6.1f} us  "
+              f"min cosine to original {cosine:.6f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the vector wire encodings")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--vectors", type=int, default=2000)
+    args = parser.parse_args()
+    _bench(args.dim, args.vectors)
@@ -0,0 +1,401 @@
+# vectorStore.py
+"""
+Pluggable retrieval backends behind fetching.match_documents_online.
+
+  supabase : the match_embeddings RPC (pgvector), the original behaviour
+  local    : an in-process exact index, one partition per (userId, accountId),
+             vectors kept L2-normalised in a contiguous float32 array so a query is
+             one matrix-vector product plus argpartition. Partitions are persisted
+             as .npy (memory-mapped on load) + .json sidecars and kept in sync by the
+             worker's webhook events.
+  ann      : approximate IVF-PQ index for large tenants (see annIndex.py)
+
+Select with RETRIEVAL_BACKEND=supabase|local|ann.
+
+    python vectorStore.py --sync     # seed the local index from embeddingsnew
+    python vectorStore.py --bench    # offline latency benchmark on synthetic data
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from structuredLog import log_event
+from vectorCodec import VECTOR_WIRE_FORMAT, encode_vector, decode_vector
+
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "supabase")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", ".vector_index")
+VECTOR_INDEX_FLUSH_SECONDS = float(os.getenv("VECTOR_INDEX_FLUSH_SECONDS", "30"))
+EMBEDDING_DIM = 384
+
+
+def parse_embedding(value):
+    """
+    float32 array from an embeddingsnew.embedding value: a '[...]' string from PostgREST,
+    a list, or a wire-encoded vector (vectorCodec) handed over by the embedding batcher.
+    """
+    return decode_vector(value)
+
+
+def _normalize(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+class RetrievalBackend:
+    """Interface every retrieval backend implements. Results mirror match_embeddings rows."""
+
+    name = "base"
+    keeps_vectors = False  # raw vectors in process, so vectors_for can serve hybrid retrieval
+
+    def match(self, query_embedding, user_id, account_id, top_k=5):
+        raise NotImplementedError
+
+    def upsert(self, record, embedding):
+        """
+        record is an embeddingsnew row (source_table, source_id, user_id, account_id, chunk_text,
+        metadata, version, deleted). A record with deleted set is a tombstone: drop the row.
+        """
+
+    def patch_metadata(self, source_id, metadata):
+        pass
+
+    def remove(self, source_id):
+        pass
+
+    def flush(self):
+        pass
+
+    def drain(self, timeout=None):
+        """Wait for background maintenance (ANN training) before a final flush."""
+
+    def _superseded(self, record):
+        """
+        Whether an upsert must not index this record: it is a delete tombstone (remembered
+        here; the caller drops the row) or no newer than one. Batcher listeners can run after
+        the DELETE that overtook them, so a plain remove() would let them bring the row back.
+        Call under the backend's lock.
+        """
+        source_id = record["source_id"]
+        version = record.get("version") or 0
+        if record.get("deleted"):
+            self.tombstones[source_id] = max(version, self.tombstones.get(source_id, version))
+            return True
+        return source_id in self.tombstones and version <= self.tombstones[source_id]
+
+    def vectors_for(self, source_ids, user_id, account_id):
+        """
+        (doc, embedding) pairs for the given transaction ids, used by hybrid retrieval to
+        rank a pre-filtered candidate set in memory. Only called when keeps_vectors is set;
+        other backends leave the filtered match to the match_filtered_embeddings RPC.
+        """
+        return None
+
+
+class SupabaseBackend(RetrievalBackend):
+    name = "supabase"
+
+    def __init__(self, client):
+        self.client = client
+
+    def match(self, query_embedding, user_id, account_id, top_k=5):
+        if VECTOR_WIRE_FORMAT != "text":
+            # compact payload, decoded by the SQL wrapper around match_embeddings
+            rpc, params = "match_embeddings_encoded", {"query_vector": encode_vector(query_embedding)}
+        else:
+            if isinstance(query_embedding, np.ndarray):
+                query_embedding = query_embedding.tolist()
+            rpc, params = "match_embeddings", {"query_embedding": query_embedding}
+        res = self.client.rpc(
+            rpc,
+            {
+                **params,
+                "user_id": user_id,
+                "account_id": account_id,
+                "top_k": top_k
+            }
+        ).execute()
+
+        if hasattr(res, "error") and res.error:
+            raise Exception(f"Supabase RPC error: {res.error}")
+        if isinstance(res, dict) and "error" in res and res["error"]:
+            raise Exception(f"Supabase RPC error: {res['error']}")
+        return res.data
+
+
+class _Partition:
+    """Vectors and documents for one (userId, accountId)."""
+
+    def __init__(self, dim, vectors=None, docs=None):
+        self.dim = dim
+        self.docs = docs or []
+        self.count = len(self.docs)
+        # a memmap straight from disk until the first write, then an owned growable array
+        self.vectors = vectors if vectors is not None else np.empty((0, dim), dtype=np.float32)
+        self.positions = {d["source_id"]: i for i, d in enumerate(self.docs)}
+        self.dirty = False
+
+    def _writable(self, needed):
+        if isinstance(self.vectors, np.memmap):
+            capacity = max(needed, 16)
+        elif self.vectors.shape[0] < needed:
+            capacity = max(needed, 16, self.vectors.shape[0] * 2)
+        else:
+            return
+        grown = np.empty((capacity, self.dim), dtype=np.float32)
+        grown[:self.count] = self.vectors[:self.count]
+        self.vectors = grown
+
+    def upsert(self, doc, vec):
+        pos = self.positions.get(doc["source_id"])
+        if pos is None:
+            self._writable(self.count + 1)
+            pos = self.count
+            self.count += 1
+            self.docs.append(doc)
+            self.positions[doc["source_id"]] = pos
+        else:
+            self._writable(self.count)
+            self.docs[pos] = doc
+        self.vectors[pos] = vec
+        self.dirty = True
+
+    def remove(self, source_id):
+        pos = self.positions.pop(source_id, None)
+        if pos is None:
+            return False
+        self._writable(self.count)
+        last = self.count - 1
+        if pos != last:  # swap the last row into the hole to keep the array contiguous
+            self.vectors[pos] = self.vectors[last]
+            self.docs[pos] = self.docs[last]
+            self.positions[self.docs[pos]["source_id"]] = pos
+        self.docs.pop()
+        self.count = last
+        self.dirty = True
+        return True
+
+    def top_k(self, query, k):
+        if self.count == 0:
+            return []
+        scores = self.vectors[:self.count] @ query
+        k = min(k, self.count)
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx])]
+        return [(int(i), float(scores[i])) for i in idx]
+
+
+class LocalVectorIndex(RetrievalBackend):
+    name = "local"
+    keeps_vectors = True
+
+    def __init__(self, directory=VECTOR_INDEX_DIR, dim=EMBEDDING_DIM, flush_seconds=VECTOR_INDEX_FLUSH_SECONDS):
+        self.directory = directory
+        self.dim = dim
+        self.flush_seconds = flush_seconds
+        self.partitions = {}
+        self.owner = {}   # source_id -> partition key
+        self.tombstones = {}  # source_id -> version of its DELETE, see _superseded
+        self.lock = threading.RLock()
+        self.last_flush = time.monotonic()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    @staticmethod
+    def _file_stem(key):
+        return hashlib.sha1(f"{key[0]}|{key[1]}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            stem = name[:-5]
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+                vectors = np.load(os.path.join(self.directory, f"{stem}.npy"), mmap_mode="r")
+            except Exception as e:
+                log_event("vector_index.partition_unreadable", logging.WARNING, partition=stem, error=str(e))
+                continue
+            key = (meta["user_id"], meta["account_id"])
+            part = _Partition(self.dim, vectors, meta["docs"])
+            self.partitions[key] = part
+            for doc in part.docs:
+                self.owner[doc["source_id"]] = key
+
+    def _save(self, key, part):
+        stem = os.path.join(self.directory, self._file_stem(key))
+        np.save(f"{stem}.npy.tmp.npy", np.ascontiguousarray(part.vectors[:part.count]))
+        with open(f"{stem}.json.tmp", "w") as f:
+            json.dump({"user_id": key[0], "account_id": key[1], "docs": part.docs}, f, default=str)
+        os.replace(f"{stem}.npy.tmp.npy", f"{stem}.npy")
+        os.replace(f"{stem}.json.tmp", f"{stem}.json")
+        part.dirty = False
+
+    def flush(self):
+        if not self.directory:
+            return
+        with self.lock:
+            for key, part in self.partitions.items():
+                if part.dirty:
+                    self._save(key, part)
+            self.last_flush = time.monotonic()
+
+    def _maybe_flush(self):
+        if self.directory and time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def match(self, query_embedding, user_id, account_id, top_k=5):
+        part = self.partitions.get((user_id, account_id))
+        if part is None:
+            return []
+        query = _normalize(query_embedding)
+        with self.lock:
+            hits = part.top_k(query, top_k)
+            return [{**part.docs[i], "similarity": score} for i, score in hits]
+
+    def upsert(self, record, embedding):
+        if record.get("deleted"):
+            with self.lock:
+                self._superseded(record)
+                self.remove(record["source_id"])
+            return
+        vec = _normalize(parse_embedding(embedding))
+        if vec.shape != (self.dim,):
+            raise ValueError(f"expected a {self.dim}-d embedding, got {vec.shape}")
+        key = (record.get("user_id"), record.get("account_id"))
+        doc = {
+            "source_table": record.get("source_table"),
+            "source_id": record["source_id"],
+            "chunk_text": record.get("chunk_text"),
+            "metadata": record.get("metadata"),
+        }
+        with self.lock:
+            if self._superseded(record):
+                return
+            previous = self.owner.get(doc["source_id"])
+            if previous is not None and previous != key:
+                self.partitions[previous].remove(doc["source_id"])
+            part = self.partitions.get(key)
+            if part is None:
+                part = self.partitions[key] = _Partition(self.dim)
+            part.upsert(doc, vec)
+            self.owner[doc["source_id"]] = key
+            self._maybe_flush()
+
+    def patch_metadata(self, source_id, metadata):
+        with self.lock:
+            key = self.owner.get(source_id)
+            if key is None:
+                return
+            part = self.partitions[key]
+            part.docs[part.positions[source_id]]["metadata"] = metadata
+            part.dirty = True
+            self._maybe_flush()
+
+    def remove(self, source_id):
+        with self.lock:
+            key = self.owner.pop(source_id, None)
+            if key is not None:
+                self.partitions[key].remove(source_id)
+                self._maybe_flush()
+
+    def vectors_for(self, source_ids, user_id, account_id):
+        part = self.partitions.get((user_id, account_id))
+        if part is None:
+            return []
+        with self.lock:
+            return [(part.docs[pos], part.vectors[pos])
+                    for pos in (part.positions.get(sid) for sid in source_ids) if pos is not None]
+
+    def load_from_supabase(self, client, page_size=1000):
+        """Seed the index from embeddingsnew with keyset pagination on source_id."""
+        after, loaded = None, 0
+        while True:
+            query = client.table("embeddingsnew")\
+                .select("source_table, source_id, user_id, account_id, chunk_text, metadata, embedding")\
+                .eq("deleted", False)\
+                .order("source_id")\
+                .limit(page_size)
+            if after is not None:
+                query = query.gt("source_id", after)
+            rows = query.execute().data or []
+            for row in rows:
+                self.upsert(row, row["embedding"])
+            loaded += len(rows)
+            if len(rows) < page_size:
+                break
+            after = rows[-1]["source_id"]
+        self.flush()
+        return loaded
+
+    def stats(self):
+        with self.lock:
+            return {
+                "partitions": len(self.partitions),
+                "vectors": sum(p.count for p in self.partitions.values()),
+            }
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(client=None):
+    """Process-wide backend shared by the retrieval API and the webhook worker."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if RETRIEVAL_BACKEND == "local":
+                    _backend = LocalVectorIndex()
+                elif RETRIEVAL_BACKEND == "ann":
+                    from annIndex import AnnVectorIndex
+                    _backend = AnnVectorIndex()
+                else:
+                    if client is None:
+                        raise ValueError("SupabaseBackend needs a Supabase client")
+                    _backend = SupabaseBackend(client)
+    return _backend
+
+
+def _bench(n_docs=20000, n_queries=200, top_k=5, seed=0):
+    """Offline benchmark: exact top-k over one synthetic partition, no network involved."""
+    rng = np.random.default_rng(seed)
+    index = LocalVectorIndex(directory=None)
+    vectors = rng.standard_normal((n_docs, EMBEDDING_DIM), dtype=np.float32)
+    for i, vec in enumerate(vectors):
+        index.upsert({"source_id": f"t{i}", "user_id": "u", "account_id": "a", "chunk_text": ""}, vec)
+    queries = rng.standard_normal((n_queries, EMBEDDING_DIM), dtype=np.float32)
+
+    latencies = []
+    for q in queries:
+        started = time.perf_counter()
+        index.match(q, "u", "a", top_k=top_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    print(f"{n_docs} docs, {n_queries} queries, top_k={top_k}: "
+          f"p50={latencies[len(latencies) // 2]:.3f} ms  p99={latencies[int(len(latencies) * 0.99) - 1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local vector index utilities.")
+    parser.add_argument("--sync", action="store_true", help="seed the local index from embeddingsnew")
+    parser.add_argument("--bench", action="store_true", help="run the offline latency benchmark")
+    parser.add_argument("--docs", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.sync:
+        from clients import supabase
+        index = LocalVectorIndex()
+        print(f"Loaded {index.load_from_supabase(supabase)} embeddings into {index.directory}")
+    if args.bench:
+        _bench(n_docs=args.docs)
@@ -1,88 +1,284 @@
 # worker.py
 from fastapi import FastAPI, Request
-import uvicorn
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import os
-from supabase import create_client
-from embeddingCreation import embed_and_insert
-from dotenv import load_dotenv
+from embeddingBatcher import batcher
+from embeddingCreation import (
+    build_embedding_text,
+    content_fingerprint,
+    has_text_columns,
+    stored_fingerprint,
+    patch_embedding_metadata,
+    delete_embedding,
+)
+from ingestQueue import get_ingest_queue
+from rollups import get_rollup_store, ROLLUPS_ENABLED
+from vectorStore import get_backend
+from answerCache import answer_cache
+from clients import supabase, lazy  # 🔹 shared lazy Supabase client
+import metrics
+from structuredLog import log_event
 
-# 🔹 Load environment variables
-load_dotenv()
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-print("Supabase URL:", SUPABASE_URL, "Supabase Key:", SUPABASE_KEY)
+# 🔹 Durable ingest queue + consumer pool settings
+# consumers share one embedding batcher, so more of them means larger coalesced batches
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "16"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+INGEST_BACKOFF_BASE = float(os.getenv("INGEST_BACKOFF_BASE", "2.0"))
+INGEST_BACKOFF_MAX = float(os.getenv("INGEST_BACKOFF_MAX", "300"))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "1.0"))
+
+EVENT_TYPES = ("INSERT", "UPDATE", "DELETE")
+
+# 🔹 Keep the retrieval backend (a no-op for the Supabase RPC one) in sync with embeddingsnew.
+# Both handles are lazy: the backend and the SQLite queue are opened on first use, not on import.
+retrieval_backend = lazy(lambda: get_backend(supabase))
+batcher.add_listener(lambda record, embedding: retrieval_backend.upsert(record, embedding))
+
+ingest_queue = lazy(get_ingest_queue)
+rollup_store = lazy(get_rollup_store)
+
+# 🔹 Queue depth and age, read from the queue at scrape time
+metrics.registry.gauge(
+    "rag_ingest_queue_depth", "Events in the ingest queue", lambda: {
+        (state,): n for state, n in ingest_queue.stats().items() if state != "oldest_age_seconds"},
+    ["state"])
+metrics.registry.gauge(
+    "rag_ingest_oldest_age_seconds", "Age of the oldest queued event",
+    lambda: ingest_queue.stats()["oldest_age_seconds"])
+_executor = ThreadPoolExecutor(max_workers=INGEST_CONCURRENCY, thread_name_prefix="ingest")
+_consumers = []
+_wakeup = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # only used when worker.app runs on its own; main.app drives the consumers itself
+    await start_consumers()
+    yield
+    await stop_consumers()
 
-# 🔹 Initialize Supabase client
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # 🔹 Initialize FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+
+def validate_payload(payload):
+    """Return an error message for payloads the consumers could never process, else None."""
+    if not isinstance(payload, dict):
+        return "payload must be a JSON object"
+    event_type = payload.get("type")
+    if event_type not in EVENT_TYPES:
+        return f"unhandled event type {event_type}"
+    if not payload.get("table"):
+        return "missing table"
+    row = payload.get("record") if event_type == "INSERT" else (payload.get("record") or payload.get("old_record"))
+    if not isinstance(row, dict):
+        return f"no row data for {event_type.lower()}"
+    if not row.get("id"):
+        return f"missing id in {event_type.lower()}"
+    return None
 
-@app.post("/webhook")
-async def webhook(request: Request):
-    try:
-        payload = await request.json()
-    except Exception:
-        return {"status": "failed to parse JSON"}
-    print("Received payload:", payload)
 
+def invalidate_answers(payload):
+    """Drop cached /api/retrieve answers of the user/account an event belongs to."""
+    for row in (payload.get("record"), payload.get("old_record")):
+        if isinstance(row, dict) and row.get("userId"):
+            # rows without accountId (accounts, budgets) invalidate every account of the user
+            answer_cache.invalidate(row["userId"], row.get("accountId"))
+
+
+def process_event(payload, received_at=None):
+    """
+    Apply one webhook event to embeddingsnew (and, for transactions, the rollups). Runs in a consumer thread.
+    received_at is when the webhook was queued. Raises on failure so the consumer can retry / dead-letter the event.
+    """
     event_type = payload.get("type")  # INSERT, UPDATE, DELETE
     table_name = payload.get("table")
     row = payload.get("record")  # Supabase sends the full row
     old_row = payload.get("old_record")  # For UPDATE/DELETE events
 
+    # 🔹 Monthly rollups first: idempotent and version-checked, so a retried event is a no-op
+    if ROLLUPS_ENABLED and table_name == "transactions":
+        with metrics.span("rollup_apply"):
+            rollup_store.apply_event(event_type, row, old_row, received_at=received_at)
 
-    # 🔹 Check only if this specific row already has an embedding
+    # 🔹 Every write is an upsert keyed on (source_table, source_id) and guarded by the row's
+    # version, so replayed or out-of-order events can neither duplicate nor roll back an embedding
     if event_type == "INSERT":
         source_id = row.get("id")
-        if not source_id:
-            return {"status": "missing id in insert"}
-        existing = supabase.table("embeddingsnew").select("*").eq("source_id", source_id).execute()
-        if existing.data and len(existing.data) > 0:
-            return {"status": f"embedding already exists for {source_id}"}
         # 🔹 Prepare text for embedding
-        text = " ".join(str(v) for v in row.values() if v is not None)
-        # 🔹 Call your embedding function
-        try:
-            embed_and_insert(table_name, row, text)
-            return {"status": f"embedding inserted for {source_id}"}
-        except Exception as e:
-            return {"status": f"embedding failed for {source_id}", "error": str(e)}
+        text = build_embedding_text(table_name, row)
+        # 🔹 Coalesced with other in-flight events into one embed call + one bulk upsert
+        batcher.embed_and_insert(table_name, row, text)
+        return {"status": f"embedding upserted for {source_id}"}
 
     elif event_type == "UPDATE":
-        new_row = payload.get("record")
-        old_row = payload.get("old_record")
-        row = new_row or old_row  
+        new_row = row or old_row
+        source_id = new_row.get("id")
+        text = build_embedding_text(table_name, new_row)
+        new_fp = content_fingerprint(text)
 
-        if not row:
-            return {"status": "no row data for update"}
+        # 🔹 Compare against the old record when Supabase sent it in full
+        # (REPLICA IDENTITY FULL), otherwise against the fingerprint stored with the embedding
+        if has_text_columns(table_name, old_row):
+            old_fp = content_fingerprint(build_embedding_text(table_name, old_row))
+        else:
+            old_fp = stored_fingerprint(table_name, source_id)
 
-        source_id = row.get("id")
-        if not source_id:
-            return {"status": "missing id in update"}
-
-        # deletion of old embedding 
-        supabase.table("embeddingsnew").delete().eq("source_id", source_id).execute()
+        if old_fp == new_fp:
+            patched = patch_embedding_metadata(table_name, new_row, text)
+            if patched.data:
+                retrieval_backend.patch_metadata(source_id, patched.data[0].get("metadata"))
+                return {"status": f"embedded content unchanged for {source_id}, metadata refreshed"}
+            # no embedding row to patch (or a newer one) → the versioned upsert sorts it out
 
-        # re-creation of embedding
-        text = " ".join(str(v) for v in new_row.values() if v is not None)
-        embed_and_insert(table_name, new_row, text)
+        # 🔹 Re-embed and replace in place; no delete-then-insert window
+        batcher.embed_and_insert(table_name, new_row, text)
 
-        print(f"Updated embedding for {source_id}")
+        log_event("embedding.updated", source_id=source_id)
         return {"status": f"updated embedding for {source_id}"}
 
     elif event_type == "DELETE":
-        row = payload.get("record") or payload.get("old_record")
-        if not row:
-            return {"status": "no row data for delete"}
+        row = row or old_row
         source_id = row.get("id")
-        if not source_id:
-            return {"status": "missing id in delete"}
-        supabase.table("embeddingsnew").delete().eq("source_id", source_id).execute()
-        print(f"Deleted embedding for {source_id}")
+        # 🔹 A versioned tombstone, not a hard delete: an INSERT/UPDATE of this row still in
+        # flight on another consumer (or in the batcher) is older and can't write it back
+        tombstone = delete_embedding(table_name, row, received_at)
+        if tombstone is None:
+            log_event("embedding.stale", table=table_name, source_id=source_id)
+            return {"status": f"newer embedding kept for {source_id}"}
+        retrieval_backend.upsert(tombstone, None)  # the backend drops the row and remembers the tombstone
+        log_event("embedding.deleted", source_id=source_id)
         return {"status": f"deleted embedding for {source_id}"}
-        
-    else:
-        return {"status": f"unhandled event type {event_type}"}
+
+    return {"status": f"unhandled event type {event_type}"}
+
+
+def _process(payload, received_at=None):
+    """process_event with its spans labelled route=webhook, intent=<event type>."""
+    metrics.begin_request("webhook", payload.get("type"))
+    with metrics.span("process_event"):
+        return process_event(payload, received_at)
+
+
+def _backoff(attempts):
+    delay = min(INGEST_BACKOFF_MAX, INGEST_BACKOFF_BASE * (2 ** attempts))
+    return delay * (0.5 + random.random() / 2)  # jitter so retries don't arrive in lockstep
+
+
+async def _consume(worker_id):
+    loop = asyncio.get_running_loop()
+    while True:
+        jobs = await asyncio.to_thread(ingest_queue.claim, 1)
+        if not jobs:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=INGEST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            continue
+
+        job = jobs[0]
+        try:
+            result = await loop.run_in_executor(_executor, _process, job.payload, job.enqueued_at)
+            invalidate_answers(job.payload)  # semantic answers depend on the updated embeddings
+            await asyncio.to_thread(ingest_queue.ack, job.id)  # SQLite writes stay off the event loop
+            metrics.inc(metrics.INGEST_EVENTS, result="processed")
+            if metrics.METRICS_ENABLED:
+                metrics.INGEST_LAG.labels().observe(time.time() - job.enqueued_at)
+            log_event("ingest.processed", consumer=worker_id, event_id=job.id, status=result["status"])
+        except asyncio.CancelledError:
+            raise  # lease expires and the event is picked up again
+        except Exception as e:
+            if job.attempts + 1 >= INGEST_MAX_ATTEMPTS:
+                await asyncio.to_thread(ingest_queue.dead_letter, job.id, e)
+                metrics.inc(metrics.INGEST_EVENTS, result="dead_letter")
+                log_event("ingest.dead_letter", logging.ERROR, consumer=worker_id, event_id=job.id,
+                          attempts=job.attempts + 1, error=str(e))
+            else:
+                delay = _backoff(job.attempts)
+                await asyncio.to_thread(ingest_queue.retry, job.id, e, delay)
+                metrics.inc(metrics.INGEST_EVENTS, result="retried")
+                log_event("ingest.retry", logging.WARNING, consumer=worker_id, event_id=job.id,
+                          error=str(e), retry_in_s=round(delay, 1))
+
+
+async def start_consumers():
+    """Start the consumer pool. Safe to call more than once (main.app and worker.app both do)."""
+    global _wakeup
+    if _consumers:
+        return
+    _wakeup = asyncio.Event()
+    if ROLLUPS_ENABLED:
+        # events from here on reach the rollups; a build started after this makes them complete
+        rollup_store.start_feeding()
+    for i in range(INGEST_CONCURRENCY):
+        _consumers.append(asyncio.create_task(_consume(i)))
+
+
+async def stop_consumers():
+    for task in _consumers:
+        task.cancel()
+    await asyncio.gather(*_consumers, return_exceptions=True)
+    _consumers.clear()
+    retrieval_backend.drain()
+    retrieval_backend.flush()
+
+
+
+@app.post("/webhook")
+async def webhook(request: Request):
+    try:
+        payload = await request.json()
+    except Exception:
+        metrics.inc(metrics.WEBHOOK_EVENTS, type="unknown", status="invalid_json")
+        return {"status": "failed to parse JSON"}
+    error = validate_payload(payload)
+    event_type = payload.get("type") if isinstance(payload, dict) else None
+    if error:
+        log_event("webhook.rejected", logging.WARNING, type=event_type, reason=error)
+        metrics.inc(metrics.WEBHOOK_EVENTS, type=event_type if event_type in EVENT_TYPES else "unknown",
+                    status="rejected")
+        return {"status": error}
+
+    # 🔹 Event identity only; the row itself is never logged
+    row = payload.get("record") or payload.get("old_record")
+    log_event("webhook.received", type=event_type, table=payload["table"], source_id=row["id"])
+
+    # the source table already changed; embeddings catch up when the event is processed
+    invalidate_answers(payload)
+
+    # a blocking SQLite (WAL) write: on the event loop an fsync would stall every route of the app
+    event_id = await asyncio.to_thread(ingest_queue.put, payload)
+    metrics.inc(metrics.WEBHOOK_EVENTS, type=event_type, status="queued")
+    if _wakeup is not None:
+        _wakeup.set()
+    return {"status": "queued", "event_id": event_id}
+
+
+@app.get("/queue")
+def queue_stats():
+    return ingest_queue.stats()
+
+
+@app.get("/batcher")
+def batcher_stats():
+    """Batch-size and latency histograms for tuning EMBED_BATCH_MAX_ITEMS / EMBED_BATCH_MAX_WAIT_MS."""
+    return batcher.stats()
+
+
+@app.post("/queue/requeue-dead-letters")
+def requeue_dead_letters():
+    count = ingest_queue.requeue_dead_letters()
+    if _wakeup is not None:
+        _wakeup.set()
+    return {"status": f"requeued {count} events"}
+
 # if __name__ == "__main__":
+#     import uvicorn
 #     uvicorn.run(app, host="0.0.0.0", port=8000)